@@ -1,42 +1,131 @@
+import bisect
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 from PIL import Image
 from scipy.spatial.transform import Rotation as R
 import argparse
 
 
-def combine_and_rename_files(
-    tum_folder: str,
-    output_folder: str,
+MANIFEST_NAME = "conversion_manifest.jsonl"
+
+
+class _SortedPool:
+    """
+    Timestamps sorted in increasing order from which matched entries are
+    removed. The closest remaining entry is found by bisection, and removed
+    entries are skipped through path compressed links, so that a lookup costs
+    amortized constant time on top of the bisection.
+    """
+
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+        self.remaining = len(timestamps)
+        # _next[i]: first remaining index >= i (len if none)
+        # _prev[i]: 1 + last remaining index < i (0 if none)
+        self._next = list(range(len(timestamps) + 1))
+        self._prev = list(range(len(timestamps) + 1))
+
+    @staticmethod
+    def _find(links, i):
+        root = i
+        while links[root] != root:
+            root = links[root]
+        while links[i] != root:
+            links[i], i = root, links[i]
+        return root
+
+    def closest(self, ts):
+        """Index of the remaining entry closest to ts, the earliest on ties."""
+        i = bisect.bisect_left(self.timestamps, ts)
+        right = self._find(self._next, i)
+        left = self._find(self._prev, i) - 1
+        if right == len(self.timestamps) or (
+                left >= 0 and abs(ts - self.timestamps[left]) <=
+                abs(ts - self.timestamps[right])):
+            best = left
+        else:
+            best = right
+        # First remaining entry among the duplicates of the closest timestamp
+        return self._find(
+            self._next,
+            bisect.bisect_left(self.timestamps, self.timestamps[best]))
+
+    def remove(self, i):
+        self._next[i] = i + 1
+        self._prev[i + 1] = i
+        self.remaining -= 1
+
+
+def match_frames(
+    rgb_entries: list,
+    depth_entries: list,
+    pose_entries: list,
     margin: float = 0.02
-) -> None:
+) -> list:
     """
-    Match and rename RGB/depth files and write them to the output folder with
-    the BundleFusion naming convention. Additionally, load poses from TUM's
-    groundtruth.txt, match them by timestamp within a given margin, and save
-    them as 4x4 transformation matrices. Color images are re-encoded as JPG at
-    maximum quality, and depth images are divided by 5 becuase for bf depth
-    1mm=1 and for tum_rgbd 1mm=5.
+    Match each RGB frame with the closest remaining depth frame and pose.
+    An RGB frame is dropped when the closest depth or pose is farther than
+    `margin`, otherwise the matched depth and pose are not used again.
 
     Parameters
     ----------
-    tum_folder : str
-        Path to the TUM scene folder containing 'rgb', 'depth', and
-        'groundtruth.txt'.
-    output_folder : str
-        Path to the output folder where converted data will be stored.
+    rgb_entries, depth_entries, pose_entries : list
+        (timestamp, data) tuples, sorted by timestamp.
     margin : float, optional
-        Maximum allowed time difference (in seconds) for matching frames
-        between RGB, depth, and pose data. Defaults to 0.02.
+        Maximum allowed time difference (in seconds). Defaults to 0.02.
 
     Returns
     -------
-    None
+    list
+        (rgb_data, depth_data, pose_data) of the matched frames, in RGB order.
     """
+    depth_pool = _SortedPool([ts for ts, _ in depth_entries])
+    pose_pool = _SortedPool([ts for ts, _ in pose_entries])
 
-    # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
+    matches = []
+    for rgb_ts, rgb_data in rgb_entries:
+        # Find closest depth frame
+        if depth_pool.remaining == 0:
+            break
+        depth_idx = depth_pool.closest(rgb_ts)
+        if abs(rgb_ts - depth_entries[depth_idx][0]) > margin:
+            continue
+
+        # Find closest pose
+        if pose_pool.remaining == 0:
+            break
+        pose_idx = pose_pool.closest(rgb_ts)
+        if abs(rgb_ts - pose_entries[pose_idx][0]) > margin:
+            continue
 
+        # We have matched depth and pose; remove them from the pool
+        depth_pool.remove(depth_idx)
+        pose_pool.remove(pose_idx)
+        matches.append(
+            (rgb_data, depth_entries[depth_idx][1], pose_entries[pose_idx][1]))
+    return matches
+
+
+def read_tum_scene(tum_folder: str):
+    """
+    Read the RGB, depth and pose timestamps of a TUM scene.
+
+    Parameters
+    ----------
+    tum_folder : str
+        Path to the TUM scene folder containing 'rgb', 'depth', and
+        'groundtruth.txt'.
+
+    Returns
+    -------
+    tuple or None
+        (rgb_entries, depth_entries, pose_entries) sorted by timestamp, None
+        if the scene lacks required folders/files.
+    """
     # Paths to subfolders and files
     rgb_path = os.path.join(tum_folder, "rgb")
     depth_path = os.path.join(tum_folder, "depth")
@@ -45,8 +134,7 @@ def combine_and_rename_files(
     # If any required directory or file doesn't exist, return early
     if not (os.path.isdir(rgb_path) and os.path.isdir(depth_path) and
             os.path.exists(pose_file)):
-        print(f"Skipping {tum_folder} because it lacks required folders/files.")
-        return
+        return None
 
     # Get sorted lists of RGB and depth files
     rgb_files = sorted(f for f in os.listdir(rgb_path)
@@ -71,62 +159,217 @@ def combine_and_rename_files(
         data = parts[1:]  # [tx, ty, tz, qx, qy, qz, qw]
         pose_entries.append((ts, data))
 
-    frame_counter = 0
+    # Stable sorts, entries with equal timestamps keep their file order
+    rgb_entries.sort(key=lambda x: x[0])
+    depth_entries.sort(key=lambda x: x[0])
+    pose_entries.sort(key=lambda x: x[0])
+    return rgb_entries, depth_entries, pose_entries
 
-    # Iterate over RGB frames and find matching depth and pose
-    for rgb_ts, rgb_filename in rgb_entries:
-        frame_id = f"frame-{frame_counter:06d}"
 
-        # Find closest depth frame
-        if not depth_entries:
-            break
-        closest_depth = min(depth_entries, key=lambda x: abs(rgb_ts - x[0]))
-        if abs(rgb_ts - closest_depth[0]) > margin:
-            continue
+def convert_frame(
+    rgb_src: str,
+    depth_src: str,
+    pose_data: list,
+    output_folder: str,
+    frame_id: str
+) -> str:
+    """
+    Write the color image, depth image and pose of a frame with the
+    BundleFusion naming convention. Each file is written to a temporary path
+    and renamed, so that an interrupted conversion never leaves a truncated
+    file.
 
-        # Find closest pose
-        if not pose_entries:
-            break
-        closest_pose = min(pose_entries, key=lambda x: abs(rgb_ts - x[0]))
-        if abs(rgb_ts - closest_pose[0]) > margin:
-            continue
+    Returns
+    -------
+    str
+        frame_id
+    """
+    # -- Process and save color image as JPG with max quality --
+    rgb_dst = os.path.join(output_folder, f"{frame_id}.color.jpg")
+    rgb_img = Image.open(rgb_src).convert("RGB")
+    rgb_img.save(rgb_dst + ".tmp", "JPEG", quality=100)
 
-        # We have matched depth and pose; remove them from the pool
-        depth_entries.remove(closest_depth)
-        pose_entries.remove(closest_pose)
+    # -- Process and save depth image (divide by 5) as PNG --
+    depth_dst = os.path.join(output_folder, f"{frame_id}.depth.png")
+    depth_img = np.array(Image.open(depth_src))
+    # Convert to uint16 and divide by 5 (integer division)
+    depth_img = depth_img.astype(np.uint16)
+    depth_img //= 5
+    Image.fromarray(depth_img).save(depth_dst + ".tmp", "PNG")
+
+    # -- Process and save pose as .pose.txt --
+    tx, ty, tz, qx, qy, qz, qw = map(float, pose_data)
+    rotation = R.from_quat([qx, qy, qz, qw]).as_matrix()
+
+    pose_matrix = np.eye(4, dtype=np.float64)
+    pose_matrix[:3, :3] = rotation
+    pose_matrix[:3, 3] = [tx, ty, tz]
 
-        # Increment the frame counter now that we have a valid match
-        frame_counter += 1
+    pose_dst = os.path.join(output_folder, f"{frame_id}.pose.txt")
+    np.savetxt(pose_dst + ".tmp", pose_matrix, fmt="%.6f")
 
-        # -- Process and save color image as JPG with max quality --
-        rgb_src = os.path.join(rgb_path, rgb_filename)
-        rgb_dst = os.path.join(output_folder, f"{frame_id}.color.jpg")
+    for dst in (rgb_dst, depth_dst, pose_dst):
+        os.replace(dst + ".tmp", dst)
+    return frame_id
 
-        rgb_img = Image.open(rgb_src).convert("RGB")
-        rgb_img.save(rgb_dst, "JPEG", quality=100)
 
-        # -- Process and save depth image (divide by 5) as PNG --
-        depth_src = os.path.join(depth_path, closest_depth[1])
-        depth_dst = os.path.join(output_folder, f"{frame_id}.depth.png")
+def read_manifest(output_folder: str) -> dict:
+    """
+    Frames already converted in output_folder, as recorded in its manifest.
+    A line truncated by an interrupted conversion is ignored.
+
+    Returns
+    -------
+    dict
+        frame_id -> [rgb_filename, depth_filename, pose_data]
+    """
+    done = {}
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[entry["frame_id"]] = entry["sources"]
+    return done
+
+
+def open_manifest(output_folder: str):
+    """Open the manifest of output_folder for appending, after a truncated line if any."""
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = open(manifest_path, "a+")
+    if manifest.tell() > 0:
+        manifest.seek(manifest.tell() - 1)
+        if manifest.read(1) != "\n":
+            manifest.write("\n")
+    return manifest
+
+
+def plan_scene(
+    tum_folder: str,
+    output_folder: str,
+    margin: float = 0.02
+):
+    """
+    Match the frames of a TUM scene and list the ones which are not converted
+    yet. A frame is converted again when its sources differ from the
+    manifest, e.g. after changing `margin`.
 
-        depth_img = np.array(Image.open(depth_src))
-        # Convert to uint16 and divide by 5 (integer division)
-        depth_img = depth_img.astype(np.uint16)
-        depth_img //= 5
+    Returns
+    -------
+    list or None
+        (rgb_src, depth_src, pose_data, output_folder, frame_id) arguments of
+        convert_frame, None if the scene lacks required folders/files.
+    """
+    entries = read_tum_scene(tum_folder)
+    if entries is None:
+        return None
+    matches = match_frames(*entries, margin=margin)
+
+    done = read_manifest(output_folder)
+    jobs = []
+    for frame_counter, (rgb_filename, depth_filename, pose_data) in \
+            enumerate(matches):
+        frame_id = f"frame-{frame_counter:06d}"
+        if done.get(frame_id) == [rgb_filename, depth_filename, pose_data]:
+            continue
+        jobs.append((
+            os.path.join(tum_folder, "rgb", rgb_filename),
+            os.path.join(tum_folder, "depth", depth_filename),
+            pose_data,
+            output_folder,
+            frame_id,
+        ))
+    return jobs
 
-        depth_img_pil = Image.fromarray(depth_img)
-        depth_img_pil.save(depth_dst)
 
-        # -- Process and save pose as .pose.txt --
-        tx, ty, tz, qx, qy, qz, qw = map(float, closest_pose[1])
-        rotation = R.from_quat([qx, qy, qz, qw]).as_matrix()
+def run_jobs(jobs: list, n_workers: int = None) -> int:
+    """
+    Convert the frames in a process pool and append each converted frame to
+    the manifest of its scene.
 
-        pose_matrix = np.eye(4, dtype=np.float64)
-        pose_matrix[:3, :3] = rotation
-        pose_matrix[:3, 3] = [tx, ty, tz]
+    Returns
+    -------
+    int
+        Number of converted frames.
+    """
+    manifests = {}
+    n_converted = 0
+    start_time = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(convert_frame, *job): job for job in jobs
+            }
+            for future in as_completed(futures):
+                rgb_src, depth_src, pose_data, output_folder, frame_id = \
+                    futures[future]
+                future.result()
+                if output_folder not in manifests:
+                    manifests[output_folder] = open_manifest(output_folder)
+                manifest = manifests[output_folder]
+                manifest.write(json.dumps({
+                    "frame_id": frame_id,
+                    "sources": [os.path.basename(rgb_src),
+                                os.path.basename(depth_src), pose_data],
+                }) + "\n")
+                manifest.flush()
+
+                n_converted += 1
+                if n_converted % 500 == 0 or n_converted == len(jobs):
+                    elapsed = time.time() - start_time
+                    print(f"{n_converted}/{len(jobs)} frames, "
+                          f"{n_converted / elapsed:.1f} frames/s")
+    finally:
+        for manifest in manifests.values():
+            manifest.close()
+    return n_converted
 
-        pose_dst = os.path.join(output_folder, f"{frame_id}.pose.txt")
-        np.savetxt(pose_dst, pose_matrix, fmt="%.6f")
+
+def combine_and_rename_files(
+    tum_folder: str,
+    output_folder: str,
+    margin: float = 0.02,
+    n_workers: int = None
+) -> None:
+    """
+    Match and rename RGB/depth files and write them to the output folder with
+    the BundleFusion naming convention. Additionally, load poses from TUM's
+    groundtruth.txt, match them by timestamp within a given margin, and save
+    them as 4x4 transformation matrices. Color images are re-encoded as JPG at
+    maximum quality, and depth images are divided by 5 becuase for bf depth
+    1mm=1 and for tum_rgbd 1mm=5. Frames already recorded in the manifest of
+    the output folder are skipped.
+
+    Parameters
+    ----------
+    tum_folder : str
+        Path to the TUM scene folder containing 'rgb', 'depth', and
+        'groundtruth.txt'.
+    output_folder : str
+        Path to the output folder where converted data will be stored.
+    margin : float, optional
+        Maximum allowed time difference (in seconds) for matching frames
+        between RGB, depth, and pose data. Defaults to 0.02.
+    n_workers : int, optional
+        Number of processes, defaults to the number of CPUs.
+
+    Returns
+    -------
+    None
+    """
+
+    # Create output folder if it doesn't exist
+    os.makedirs(output_folder, exist_ok=True)
+
+    jobs = plan_scene(tum_folder, output_folder, margin)
+    if jobs is None:
+        print(f"Skipping {tum_folder} because it lacks required folders/files.")
+        return
+    run_jobs(jobs, n_workers)
 
 
 def generate_info_txt(output_folder: str, folder_name: str) -> None:
@@ -187,14 +430,21 @@ def generate_info_txt(output_folder: str, folder_name: str) -> None:
                 "1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1\n")
 
 
-def main(source_dir: str, dest_dir: str) -> None:
+def main(
+    source_dir: str,
+    dest_dir: str,
+    margin: float = 0.02,
+    n_workers: int = None
+) -> None:
     """
     Main function that processes multiple TUM scene folders within a source
     directory and saves the converted data to a destination directory.
 
     For each scene in `source_dir`, this function:
-    1. Calls `combine_and_rename_files` to match and convert images/poses.
+    1. Calls `plan_scene` to match the images/poses and list the frames which
+       are not converted yet.
     2. Calls `generate_info_txt` to create the BundleFusion 'info.txt'.
+    The frames of all the scenes are then converted in a single process pool.
 
     Parameters
     ----------
@@ -202,6 +452,11 @@ def main(source_dir: str, dest_dir: str) -> None:
         Path to the directory containing multiple TUM scenes (subdirectories).
     dest_dir : str
         Path to the directory where the converted scenes will be stored.
+    margin : float, optional
+        Maximum allowed time difference (in seconds) for matching frames
+        between RGB, depth, and pose data. Defaults to 0.02.
+    n_workers : int, optional
+        Number of processes, defaults to the number of CPUs.
 
     Returns
     -------
@@ -215,6 +470,7 @@ def main(source_dir: str, dest_dir: str) -> None:
     os.makedirs(dest_dir, exist_ok=True)
 
     # Process each subdirectory (scene) within the source directory
+    jobs = []
     for scene_name in sorted(os.listdir(source_dir)):
         scene_path = os.path.join(source_dir, scene_name)
         if not os.path.isdir(scene_path):
@@ -225,14 +481,24 @@ def main(source_dir: str, dest_dir: str) -> None:
         output_scene_path = os.path.join(dest_dir, scene_name)
         os.makedirs(output_scene_path, exist_ok=True)
 
-        print(f"Processing scene: {scene_name}")
-
-        # Perform matching, renaming, and saving
-        combine_and_rename_files(scene_path, output_scene_path)
+        # Perform matching, skip the frames converted by a previous run
+        scene_jobs = plan_scene(scene_path, output_scene_path, margin)
+        if scene_jobs is None:
+            print(f"Skipping {scene_path} because it lacks required "
+                  "folders/files.")
+            continue
+        print(f"Scene {scene_name}: {len(scene_jobs)} frames to convert")
+        jobs.extend(scene_jobs)
 
         # Generate info.txt
         generate_info_txt(output_scene_path, scene_name)
 
+    start_time = time.time()
+    n_converted = run_jobs(jobs, n_workers)
+    elapsed = time.time() - start_time
+    print(f"Converted {n_converted} frames in {elapsed:.1f}s "
+          f"({n_converted / max(elapsed, 1e-6):.1f} frames/s)")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -250,7 +516,18 @@ if __name__ == "__main__":
         required=True,
         help="Path to the directory where converted scenes will be stored."
     )
+    parser.add_argument(
+        "--margin",
+        type=float,
+        default=0.02,
+        help="Maximum time difference (in seconds) between matched frames."
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=None,
+        help="Number of processes, defaults to the number of CPUs."
+    )
 
     args = parser.parse_args()
-    main(args.source_dir, args.dest_dir)
-
+    main(args.source_dir, args.dest_dir, args.margin, args.n_workers)
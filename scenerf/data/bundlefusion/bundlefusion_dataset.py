@@ -1,13 +1,37 @@
 import torch
 import os
 import glob
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data import Dataset
 import numpy as np
 from PIL import Image
 from torchvision import transforms
 import torch.nn.functional as F
-from tqdm import tqdm
 import imageio
+from scenerf.data.utils.lazy_sequence import LazySequence
+from scenerf.data.utils.frame_stats import load_error_frames
+
+
+def read_rgb_image(path):
+    """Decoded RGB PIL image, the decoding releases the GIL so it can run in a thread pool"""
+    return Image.open(path).convert("RGB")
+
+
+def read_pose(path):
+    # Read and parse the poses
+    pose = np.identity(4)
+    with open(path, 'r') as f:
+        lines = f.readlines()
+        for i, line in enumerate(lines):
+            pose[i, :] = np.fromstring(line, dtype=float, sep=' ')
+    return pose
+
+
+def read_rgb_tensor(path):
+    """Read an image as a (3, H, W) float tensor in [0, 1], used to load the sources lazily"""
+    img = Image.open(path).convert("RGB")
+    img = np.asarray(img, dtype=np.float32) / 255.0
+    return transforms.ToTensor()(img)
 
 
 class BundlefusionDataset(Dataset):
@@ -23,8 +47,18 @@ class BundlefusionDataset(Dataset):
         color_jitter=None,
         select_scans=None,
         tum_rgbd=False,
+        lazy_sources=False,
+        io_threads=0,
     ):
         self.root = root
+        # Return the source images and depths as LazySequence loaded on access
+        self.lazy_sources = lazy_sources
+        # Read the files of an item concurrently with a thread pool in each worker (0: sequential reads).
+        # The files of the whole batch are requested together
+        self.io_threads = io_threads
+        self._io_executor = None
+        self._executor_pid = None
+        self._prefetched = {}
 
         print(dataset)
         # Select a split based on training dataset being either bf or tum_rgbd
@@ -86,6 +120,8 @@ class BundlefusionDataset(Dataset):
         with open(error_frames_path, "r") as file:
             for line in file:
                 self.error_frames.append(line.strip())
+        # Frames flagged by scripts/scan_frames.py, the windows containing one of them are skipped
+        self.scanned_error_frames = load_error_frames(root)
 
         self.scans = []
         for sequence in self.sequences:
@@ -113,6 +149,8 @@ class BundlefusionDataset(Dataset):
                     rel_frame_id = "{:06d}".format(int(frame_id) + i * self.frame_interval)
                     rel_frame_ids.append(rel_frame_id)
 
+                if any((sequence, rel_frame_id) in self.scanned_error_frames for rel_frame_id in rel_frame_ids):
+                    continue
                 
                 if select_scans is not None and rel_frame_ids[self.n_frames // 2] not in select_scans:
                     continue
@@ -151,69 +189,134 @@ class BundlefusionDataset(Dataset):
         print("n_scans", len(self.scans))
 
 
-    def __getitem__(self, index):
-        scan = self.scans[index]        
+    def plan_item(self, index):
+        """
+        Frames of an item, with its random sources drawn, and the files to read
+        ------
+        return
+        plan: dict
+        reads: list of (loader, path)
+        """
+        scan = self.scans[index]
         sequence = scan['sequence']
         rel_frame_ids = scan['rel_frame_ids']
         infer_id = self.n_frames // 2
-        frame_id = rel_frame_ids[infer_id]
-        infer_pose_path = os.path.join(self.root, sequence, "frame-{}.pose.txt".format(rel_frame_ids[infer_id]))
-        
-        
-        img_sources = []
-        img_targets = []
-
-        T_source2infers = []
-        T_source2targets = []
-        source_frame_ids = []
-        source_depths = []
-
-        img_input_path = os.path.join(self.root, sequence, "frame-{}.color.jpg".format(frame_id))
-        img_input = self.to_tensor_normalized(self.read_rgb(img_input_path, aug=True))
-        img_input_original = self.to_tensor(self.read_rgb(img_input_path, aug=False))
 
-        infer_depth_path = os.path.join(self.root, sequence, "frame-{}.depth.png".format(frame_id))
-        infer_depth = self._read_depth(infer_depth_path)
+        def frame_path(frame_id, suffix):
+            return os.path.join(self.root, sequence, "frame-{}.{}".format(frame_id, suffix))
 
-        
         idx = np.arange(self.n_frames + 1)
         idx = np.delete(idx, infer_id)
         n_sources = min(len(idx), self.n_sources)
+        source_ids = []
         for d_id in range(n_sources):
             if self.n_sources < len(rel_frame_ids):
-                source_id = np.random.choice(idx, 1)[0]
+                source_ids.append(np.random.choice(idx, 1)[0])
             else:
-                source_id = idx[d_id]
+                source_ids.append(idx[d_id])
 
-            rel_frame_id = rel_frame_ids[source_id]
-            source_frame_ids.append(rel_frame_id)
-            target_id = source_id - 1
-            
-            img_source_path = os.path.join(self.root, sequence, "frame-{}.color.jpg".format(rel_frame_ids[source_id]))
-            img_target_path = os.path.join(self.root, sequence, "frame-{}.color.jpg".format(rel_frame_ids[target_id]))
-            img_source = self.to_tensor(self.read_rgb(img_source_path))
-            img_target = self.to_tensor(self.read_rgb(img_target_path))
-            img_sources.append(img_source)
-            img_targets.append(img_target)
+        frame_id = rel_frame_ids[infer_id]
+        plan = {
+            "index": index,
+            "frame_id": frame_id,
+            "img_input_path": frame_path(frame_id, "color.jpg"),
+            "infer_depth_path": frame_path(frame_id, "depth.png"),
+            "infer_pose_path": frame_path(frame_id, "pose.txt"),
+            "source_frame_ids": [rel_frame_ids[i] for i in source_ids],
+            "img_source_paths": [frame_path(rel_frame_ids[i], "color.jpg") for i in source_ids],
+            "img_target_paths": [frame_path(rel_frame_ids[i - 1], "color.jpg") for i in source_ids],
+            "source_pose_paths": [frame_path(rel_frame_ids[i], "pose.txt") for i in source_ids],
+            "target_pose_paths": [frame_path(rel_frame_ids[i - 1], "pose.txt") for i in source_ids],
+            "source_depth_paths": [frame_path(rel_frame_ids[i], "depth.png") for i in source_ids],
+        }
 
+        reads = [
+            (read_rgb_image, plan["img_input_path"]),
+            (BundlefusionDataset._read_depth, plan["infer_depth_path"]),
+            (read_pose, plan["infer_pose_path"]),
+        ]
+        reads += [(read_pose, path) for path in plan["source_pose_paths"] + plan["target_pose_paths"]]
+        if not self.lazy_sources:
+            reads += [(read_rgb_image, path) for path in plan["img_source_paths"] + plan["img_target_paths"]]
+            reads += [(BundlefusionDataset._read_depth, path) for path in plan["source_depth_paths"]]
+        return plan, reads
+
+    def _executor(self):
+        # The pool is created in each dataloader worker, threads do not survive the fork
+        if self._executor_pid != os.getpid():
+            self._io_executor = ThreadPoolExecutor(max_workers=self.io_threads)
+            self._executor_pid = os.getpid()
+            self._prefetched = {}
+        return self._io_executor
+
+    def prefetch(self, index):
+        """Draw the sources of an item and start reading its files in the thread pool"""
+        if self.io_threads == 0 or index in self._prefetched or not 0 <= index < len(self):
+            return
+        executor = self._executor()
+        plan, reads = self.plan_item(index)
+        files = {}
+        for loader, path in reads:
+            if path not in files:
+                files[path] = executor.submit(loader, path)
+        self._prefetched[index] = (plan, files)
+
+    def __getitems__(self, indices):
+        # Called by the dataloader with the indices of a whole batch (torch >= 2.0), only the
+        # indices of the batch are prefetched, each entry is removed by the get_item consuming it
+        try:
+            for index in indices:
+                self.prefetch(index)
+            return [self.get_item(index) for index in indices]
+        finally:
+            # Entries left by a failed item
+            for index in indices:
+                self._prefetched.pop(index, None)
 
-            source_pose_path = os.path.join(self.root, sequence, "frame-{}.pose.txt".format(rel_frame_ids[source_id]))
-            target_pose_path = os.path.join(self.root, sequence, "frame-{}.pose.txt".format(rel_frame_ids[target_id]))
+    def __getitem__(self, index):
+        return self.get_item(index)
+
+    def get_item(self, index):
+        self.prefetch(index)
+        if self.io_threads > 0:
+            plan, files = self._prefetched.pop(index)
+            read = lambda path: files[path].result()
+        else:
+            plan, reads = self.plan_item(index)
+            files = {path: loader for loader, path in reads}
+            read = lambda path: files[path](path)
+
+        scan = self.scans[index]
+        sequence = scan['sequence']
+        frame_id = plan["frame_id"]
+        source_frame_ids = plan["source_frame_ids"]
 
-            infer_pose = self.read_pose(infer_pose_path)      
-            source_pose = self.read_pose(source_pose_path)
-            target_pose = self.read_pose(target_pose_path)
-            
+        img_input_image = read(plan["img_input_path"])
+        img_input = self.to_tensor_normalized(self.rgb_to_array(img_input_image, aug=True))
+        img_input_original = self.to_tensor(self.rgb_to_array(img_input_image, aug=False))
+        infer_depth = read(plan["infer_depth_path"])
+        infer_pose = read(plan["infer_pose_path"])
 
+        T_source2infers = []
+        T_source2targets = []
+        for source_pose_path, target_pose_path in zip(plan["source_pose_paths"], plan["target_pose_paths"]):
+            source_pose = read(source_pose_path)
+            target_pose = read(target_pose_path)
             T_source2infer = np.linalg.inv(infer_pose) @ source_pose
             T_source2infers.append(torch.from_numpy(T_source2infer).float())
             T_source2target = np.linalg.inv(target_pose) @ source_pose
             T_source2targets.append(torch.from_numpy(T_source2target).float())
-            
-            source_depth_path = os.path.join(self.root, sequence, "frame-{}.depth.png".format(rel_frame_ids[source_id]))
-            source_depth = self._read_depth(source_depth_path)
-            source_depths.append(source_depth)
-          
+
+        if self.lazy_sources:
+            img_sources = LazySequence(read_rgb_tensor, [(path,) for path in plan["img_source_paths"]])
+            img_targets = LazySequence(read_rgb_tensor, [(path,) for path in plan["img_target_paths"]])
+            source_depths = LazySequence(
+                BundlefusionDataset._read_depth, [(path,) for path in plan["source_depth_paths"]])
+        else:
+            img_sources = [self.to_tensor(self.rgb_to_array(read(path))) for path in plan["img_source_paths"]]
+            img_targets = [self.to_tensor(self.rgb_to_array(read(path))) for path in plan["img_target_paths"]]
+            source_depths = [read(path) for path in plan["source_depth_paths"]]
+
         data = {
             "sequence": sequence,
             "infer_depth": infer_depth,
@@ -236,6 +339,13 @@ class BundlefusionDataset(Dataset):
         }
         return data
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_io_executor"] = None
+        state["_executor_pid"] = None
+        state["_prefetched"] = {}
+        return state
+
     def __len__(self):
         return len(self.scans)
 
@@ -261,27 +371,31 @@ class BundlefusionDataset(Dataset):
 
         return cam_K_color[:3, :3], cam_K_depth[:3, :3]
 
+    @staticmethod
+    def read_depth_shift(path):
+        """Ratio of the values of the depth images to meters, m_depthShift of info.txt"""
+        with open(path, "r") as f:
+            for line in f.readlines():
+                key, _, value = line.partition("=")
+                if key.strip() == "m_depthShift":
+                    return float(value)
+        raise ValueError("no m_depthShift in {}".format(path))
+
 
     def read_pose(self, path):
-
-        # Read and parse the poses
-        pose = np.identity(4)
-        with open(path, 'r') as f:
-            lines = f.readlines()
-            for i, line in enumerate(lines):
-                pose[i, :] = np.fromstring(line, dtype=float, sep=' ')
-        
-        return pose
+        return read_pose(path)
 
     def read_rgb(self, path, aug=False):
-        img = Image.open(path).convert("RGB")
+        return self.rgb_to_array(read_rgb_image(path), aug=aug)
+
+    def rgb_to_array(self, img, aug=False):
         # print(img.size)  # (W, H)
 
         if aug and self.color_jitter is not None:
             img = self.color_jitter(img)
 
         # PIL to numpy
-        img = np.array(img, dtype=np.float32, copy=False) / 255.0      
+        img = np.asarray(img, dtype=np.float32) / 255.0
 
         return img
 
@@ -296,24 +410,3 @@ class BundlefusionDataset(Dataset):
         depth = np.asarray(depth)
 
         return depth
-        
-
-if __name__ == "__main__":
-    root = '/gpfsdswork/dataset/bundlefusion/'
-
-    ds = BundlefusionDataset(
-        "all",
-        root,
-        n_sources=1000,
-        frame_interval=2,
-        n_frames=20
-    )
-    max_depth = 0
-    for i in tqdm(range(len(ds))):
-        ds[i]
-        if i % 100 == 0:
-            print(ds.error_frames)
-            print("writing error frames")
-            with open("error_frames.txt", "w") as file:
-                for element in ds.error_frames:
-                    file.write(element + "\n")
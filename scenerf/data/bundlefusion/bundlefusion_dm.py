@@ -1,7 +1,8 @@
 from torch.utils.data.dataloader import DataLoader
 from scenerf.data.bundlefusion.bundlefusion_dataset import BundlefusionDataset
-from scenerf.data.bundlefusion.collate import collate_fn
+from scenerf.data.bundlefusion.collate import collate_fn, collate_stacked_fn
 import pytorch_lightning as pl
+from scenerf.data.utils.sequence_sampler import SequenceShardSampler
 from scenerf.data.utils.torch_util import worker_init_fn
 
 
@@ -19,6 +20,10 @@ class BundlefusionDM(pl.LightningDataModule):
         infer_frame_train_interval=4,
         infer_frame_val_interval=20,
         n_sources=1,
+        stack_sources=False,
+        lazy_sources=False,
+        shard_by_sequence=False,
+        io_threads=0,
     ):
         super().__init__()
         self.dataset = dataset
@@ -32,6 +37,14 @@ class BundlefusionDM(pl.LightningDataModule):
         self.val_frame_interval = val_frame_interval
         self.infer_frame_train_interval = infer_frame_train_interval
         self.infer_frame_val_interval = infer_frame_val_interval
+        # Stack the sources into padded (B, S, ...) tensors instead of lists
+        self.collate_fn = collate_stacked_fn if stack_sources else collate_fn
+        # Load the source images and depths on access (evaluation with all the sources)
+        self.lazy_sources = lazy_sources
+        # Sample contiguous frames of a few scenes on each rank for the cache locality
+        self.shard_by_sequence = shard_by_sequence
+        # Threads reading the files of the items concurrently in each worker
+        self.io_threads = io_threads
 
     def setup(self, stage=None):
         self.train_ds = BundlefusionDataset(
@@ -42,7 +55,9 @@ class BundlefusionDM(pl.LightningDataModule):
             frame_interval=self.train_frame_interval,
             infer_frame_interval=self.infer_frame_train_interval,
             color_jitter=None,
-            n_sources=self.n_sources
+            n_sources=self.n_sources,
+            lazy_sources=self.lazy_sources,
+            io_threads=self.io_threads,
         )
         self.setup_val_ds()
 
@@ -56,20 +71,29 @@ class BundlefusionDM(pl.LightningDataModule):
             infer_frame_interval=self.infer_frame_val_interval,
             color_jitter=None,
             n_sources=self.n_sources,
-            select_scans=select_scans
+            select_scans=select_scans,
+            lazy_sources=self.lazy_sources,
+            io_threads=self.io_threads,
         )
         
 
     def train_dataloader(self, shuffle=True):
+        sampler = None
+        if self.shard_by_sequence:
+            infer_id = self.train_ds.n_frames // 2
+            sampler = SequenceShardSampler(
+                self.train_ds,
+                [(scan["sequence"], int(scan["rel_frame_ids"][infer_id])) for scan in self.train_ds.scans])
         return DataLoader(
             self.train_ds,
             batch_size=self.batch_size,
             drop_last=True,
             num_workers=self.num_workers,
-            shuffle=True,
+            shuffle=sampler is None,
+            sampler=sampler,
             pin_memory=True,
             worker_init_fn=worker_init_fn,
-            collate_fn=collate_fn,
+            collate_fn=self.collate_fn,
         )
 
     def val_dataloader(self, shuffle=False):
@@ -80,5 +104,5 @@ class BundlefusionDM(pl.LightningDataModule):
             drop_last=False,
             shuffle=shuffle,
             pin_memory=True,
-            collate_fn=collate_fn,
+            collate_fn=self.collate_fn,
         )
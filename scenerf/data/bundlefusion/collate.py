@@ -2,6 +2,8 @@ import torch
 import numpy as np
 import pdb
 
+from scenerf.data.utils.torch_util import pad_stack
+
 
 def collate_fn(batch):
 
@@ -76,3 +78,28 @@ def collate_fn(batch):
    
     
     return ret_data
+
+
+def collate_stacked_fn(batch):
+    """Same as `collate_fn` but the per-source entries are stacked into
+    padded (B, S, ...) tensors so that the model can process all the
+    (item, source) pairs at once. `source_masks` (B, S) marks the real sources,
+    padded transformations are set to identity and padded depths to 0.
+    """
+    ret_data = collate_fn(batch)
+
+    source_depths = [
+        [torch.from_numpy(depth.astype(np.float32)) for depth in depths]
+        for depths in ret_data["source_depths"]
+    ]
+    ret_data["source_depths"], source_masks = pad_stack(source_depths)
+    ret_data["img_sources"], _ = pad_stack(ret_data["img_sources"])
+    ret_data["img_targets"], _ = pad_stack(ret_data["img_targets"])
+
+    for key in ["T_source2targets", "T_source2infers"]:
+        T, _ = pad_stack(ret_data[key])
+        T[~source_masks] = torch.eye(4)
+        ret_data[key] = T
+
+    ret_data["source_masks"] = source_masks
+    return ret_data
@@ -1,8 +1,9 @@
 import torch
 
-def collate_fn(batch):
-    data = {}
+from scenerf.data.utils.torch_util import pad_stack
+
 
+def collate_fn(batch):
     img_inputs = []
     img_input_sources = []
     source_distances = []
@@ -26,11 +27,6 @@ def collate_fn(batch):
 
     target_1_1s = []
 
-    scale_3ds = batch[0]["scale_3ds"]
-    for scale_3d in scale_3ds:
-        data["projected_pix_{}".format(scale_3d)] = []
-        data["fov_mask_{}".format(scale_3d)] = []
-
     for idx, input_dict in enumerate(batch):
         lidar_depths.append(input_dict["lidar_depths"])
         loc2d_with_depths.append(input_dict["loc2d_with_depths"])
@@ -47,8 +43,6 @@ def collate_fn(batch):
         
         T_velo_2_cams.append(torch.from_numpy(input_dict["T_velo_2_cam"]).float())
 
-        for key in data:
-            data[key].append(torch.from_numpy(input_dict[key]))
         
         img_inputs.append(input_dict["img_input"])
         img_input_sources.append(input_dict["img_input_sources"])
@@ -89,7 +83,34 @@ def collate_fn(batch):
     }
     if len(target_1_1s) > 0:
         ret_data["target_1_1"] = torch.stack(target_1_1s)
-    
-    for key in data:
-        ret_data[key] = data[key]
+    return ret_data
+
+
+def collate_stacked_fn(batch):
+    """Same as `collate_fn` but the per-source entries are stacked into
+    padded (B, S, ...) tensors so that the model can process all the
+    (item, source) pairs at once. `source_masks` (B, S) marks the real sources,
+    padded transformations are set to identity. Lidar points are padded along
+    the point dimension with depth 0, so `lidar_depths > 0` is the point mask.
+    """
+    ret_data = collate_fn(batch)
+
+    ret_data["img_sources"], source_masks = pad_stack(ret_data["img_sources"])
+    ret_data["img_targets"], _ = pad_stack(ret_data["img_targets"])
+    ret_data["img_input_sources"], _ = pad_stack(ret_data["img_input_sources"])
+    ret_data["lidar_depths"], _ = pad_stack(ret_data["lidar_depths"])
+    ret_data["loc2d_with_depths"], _ = pad_stack(ret_data["loc2d_with_depths"])
+
+    source_distances = [
+        [torch.tensor(d, dtype=torch.float32) for d in distances]
+        for distances in ret_data["source_distances"]
+    ]
+    ret_data["source_distances"], _ = pad_stack(source_distances)
+
+    for key in ["T_source2targets", "T_source2infers"]:
+        T, _ = pad_stack(ret_data[key])
+        T[~source_masks] = torch.eye(4)
+        ret_data[key] = T
+
+    ret_data["source_masks"] = source_masks
     return ret_data
@@ -2,6 +2,8 @@
 Most of the code in this file is taken from https://github.com/cv-rits/LMSCNet/blob/main/LMSCNet/data/io_data.py
 """
 
+from functools import lru_cache
+
 import numpy as np
 import yaml
 import imageio
@@ -9,17 +11,8 @@ import imageio
 
 def unpack(compressed):
   ''' given a bit encoded voxel grid, make a normal voxel grid out of it.  '''
-  uncompressed = np.zeros(compressed.shape[0] * 8, dtype=np.uint8)
-  uncompressed[::8] = compressed[:] >> 7 & 1
-  uncompressed[1::8] = compressed[:] >> 6 & 1
-  uncompressed[2::8] = compressed[:] >> 5 & 1
-  uncompressed[3::8] = compressed[:] >> 4 & 1
-  uncompressed[4::8] = compressed[:] >> 3 & 1
-  uncompressed[5::8] = compressed[:] >> 2 & 1
-  uncompressed[6::8] = compressed[:] >> 1 & 1
-  uncompressed[7::8] = compressed[:] & 1
-
-  return uncompressed
+  # most significant bit first
+  return np.unpackbits(np.asarray(compressed, dtype=np.uint8))
 
 
 def img_normalize(img, mean, std):
@@ -34,12 +27,8 @@ def pack(array):
   """ convert a boolean array into a bitwise array. """
   array = array.reshape((-1))
 
-  #compressing bit flags.
-  # yapf: disable
-  compressed = array[::8] << 7 | array[1::8] << 6  | array[2::8] << 5 | array[3::8] << 4 | array[4::8] << 3 | array[5::8] << 2 | array[6::8] << 1 | array[7::8]
-  # yapf: enable
-
-  return np.array(compressed, dtype=np.uint8)
+  # compressing bit flags, most significant bit first
+  return np.packbits(array.astype(bool))
 
 
 def get_grid_coords(dims, resolution):
@@ -170,9 +159,11 @@ def _read_calib_SemKITTI(calib_path):
   return calib_out
 
 
+@lru_cache(maxsize=None)
 def get_remap_lut(path):
   '''
   remap_lut to remap classes of semantic kitti for training...
+  The lut is built once per process and shared, it is read-only.
   :return:
   '''
 
@@ -189,6 +180,7 @@ def get_remap_lut(path):
   # Important: For voxels 0 corresponds to "empty" and not "unlabeled".
   remap_lut[remap_lut == 0] = 255  # map 0 to 'invalid'
   remap_lut[0] = 0  # only 'empty' stays 'empty'.
+  remap_lut.setflags(write=False)
 
   return remap_lut
 
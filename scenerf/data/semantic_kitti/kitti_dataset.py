@@ -1,15 +1,222 @@
 import glob
 import os
-import pickle
 import time
+from operator import itemgetter
 
 import numpy as np
 import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
-from scenerf.data.utils.helpers import dump_xyz, vox2pix, read_calib, compute_transformation, read_poses, read_rgb
+from scenerf.data.utils.helpers import vox2pix_cached, read_calib, compute_transformation, read_poses, read_rgb
 from scenerf.data.semantic_kitti.params import val_error_frames
-import scenerf.data.semantic_kitti.io_data as SemanticKittiIO
+from scenerf.data.semantic_kitti.transform_store import TransformStore, transform_store_path
+from scenerf.data.utils.lazy_sequence import LazySequence
+from scenerf.data.utils.frame_stats import load_error_frames
+from scenerf.data.semantic_kitti.label_store import LabelStore, read_semKITTI_label
+
+
+to_tensor = transforms.ToTensor()
+to_tensor_normalized = transforms.Compose(
+    [
+        transforms.ToTensor(),
+        transforms.Normalize(
+            mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
+        ),
+    ]
+)
+
+
+def read_rgb_tensor(path, normalize=False):
+    img = read_rgb(path)
+    if normalize:
+        return to_tensor_normalized(img)
+    return to_tensor(img)
+
+
+def get_depth_from_lidar(lidar_path, P, T_velo_2_cam, image_size, eval_depth):
+    scan = np.fromfile(lidar_path, dtype=np.float32)
+    scan = scan.reshape((-1, 4))
+    points = scan[:, :3]
+
+    keep_idx = points[:, 0] > 0  # only keep point in front of the vehicle
+    points_hcoords = np.concatenate([points[keep_idx], np.ones([keep_idx.sum(), 1], dtype=np.float32)], axis=1)
+
+    pts_cam = (T_velo_2_cam @ points_hcoords.T).T
+    mask = (pts_cam[:, 2] <= eval_depth) & (pts_cam[:, 2] > 0)  # get points with depth < max_sample_depth
+    pts_cam = pts_cam[mask, :3]
+
+    img_points = (P[0:3, 0:3] @ pts_cam.T).T
+
+    img_points = img_points[:, :2] / np.expand_dims(img_points[:, 2], axis=1)  # scale 2D points
+    img_points = np.round(img_points).astype(int)
+    keep_idx_img_pts = (img_points[:, 0] > 0) & \
+                       (img_points[:, 1] > 0) & \
+                       (img_points[:, 0] < image_size[0]) & \
+                       (img_points[:, 1] < image_size[1])
+
+    img_points = img_points[keep_idx_img_pts, :]
+
+    pts_cam = pts_cam[keep_idx_img_pts, :]
+
+    depths = pts_cam[:, 2]
+
+    return img_points, depths, pts_cam
+
+
+# Sparse depth of a lidar scan projected in the image
+LIDAR_DEPTH_DTYPE = np.dtype([("u", np.uint16), ("v", np.uint16), ("depth", np.float32)])
+
+
+def lidar_depth_path(depth_preprocess_root, sequence, frame_id):
+    return os.path.join(depth_preprocess_root, sequence, "{}.npy".format(frame_id))
+
+
+def save_lidar_depth(lidar_path, P, T_velo_2_cam, image_size, out_path):
+    """
+    Store all the lidar points projected in the image, the eval_depth cut-off is applied when reading
+    so that the same store serves every eval_depth.
+    The points are kept in the order of get_depth_from_lidar.
+    """
+    loc2d_with_depth, lidar_depth, _ = get_depth_from_lidar(lidar_path, P, T_velo_2_cam,
+                                                            image_size, np.inf)
+    pts = np.empty(lidar_depth.shape[0], dtype=LIDAR_DEPTH_DTYPE)
+    pts["u"] = loc2d_with_depth[:, 0]
+    pts["v"] = loc2d_with_depth[:, 1]
+    pts["depth"] = lidar_depth
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    # write then rename so that a reader never sees a partial file
+    tmp_path = out_path + ".{}.tmp".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.save(f, pts)
+    os.replace(tmp_path, out_path)
+    return pts.shape[0]
+
+
+def load_lidar_depth(path, eval_depth):
+    pts = np.load(path)
+    pts = pts[pts["depth"] <= eval_depth]
+    loc2d_with_depth = np.stack([pts["u"], pts["v"]], axis=1).astype(int)
+    return loc2d_with_depth, pts["depth"]
+
+
+def compute_source_transformation(scan, source_id, infer_id=0):
+    """
+    Transformations from the source frame to the infer (first) and target (previous) frames of a scan,
+    refined with ICP on the lidar scans
+    """
+    target_id = source_id - 1
+    poses = scan["poses"]
+    lidar_paths = scan["lidar_paths"]
+    return compute_transformation(
+        lidar_paths[source_id], lidar_paths[infer_id], lidar_paths[target_id],
+        poses[source_id], poses[infer_id], poses[target_id],
+        scan["T_velo_2_cam"], scan["T_cam0_2_cam2"])
+
+
+def read_lidar_depth(lidar_path, P, T_velo_2_cam, image_size, eval_depth, n_rays, depth_path=None):
+    """
+    Project the lidar scan in the image and keep at most n_rays random points.
+    The projection is read from the precomputed store at depth_path when it exists.
+    ------
+    return
+    loc2d_with_depth: (n_pts, 2) tensor
+    lidar_depth: (n_pts,) tensor
+    """
+    if depth_path is not None and os.path.exists(depth_path):
+        loc2d_with_depth, lidar_depth = load_lidar_depth(depth_path, eval_depth)
+    else:
+        loc2d_with_depth, lidar_depth, _ = get_depth_from_lidar(lidar_path, P, T_velo_2_cam,
+                                                                image_size, eval_depth)
+
+    if n_rays < lidar_depth.shape[0]:
+        idx = np.random.choice(lidar_depth.shape[0], size=n_rays, replace=False)
+        loc2d_with_depth = loc2d_with_depth[idx, :]
+        lidar_depth = lidar_depth[idx]
+
+    return torch.from_numpy(loc2d_with_depth), torch.from_numpy(lidar_depth)
+
+
+def list_image_frames(image_dir):
+    """
+    return
+    (max_frame_id + 1,) bool array, True if image_dir contains the image of the frame
+    """
+    frame_ids = [int(filename[:-4]) for filename in os.listdir(image_dir) if filename.endswith(".png")]
+    image_exists = np.zeros(max(frame_ids, default=-1) + 1, dtype=bool)
+    image_exists[frame_ids] = True
+    return image_exists
+
+
+def build_windows(positions, start_ids, image_exists, frames_interval, sequence_distance):
+    """
+    Select the frames of the window starting at each of start_ids.
+    A frame is kept when its XZ distance to the last kept frame is at least frames_interval,
+    the distance of every visited frame to the last kept frame is accumulated and the window ends
+    before the first kept frame farther than sequence_distance, or at the first missing image.
+    All the windows of the sequence are grown together, one frame per step.
+    positions: (n_frames, 3) camera positions
+    start_ids: (n_windows,) first frame of each window
+    image_exists: (n,) bool, from list_image_frames
+    ------
+    return
+    list of (frame_ids, distances, should_add) per window,
+    should_add is False for the windows which reached a missing image
+    """
+    start_ids = np.asarray(start_ids, dtype=np.int64).reshape(-1)
+    n_windows = start_ids.shape[0]
+
+    def exists(frame_ids):
+        out = np.zeros(frame_ids.shape[0], dtype=bool)
+        in_range = frame_ids < image_exists.shape[0]
+        out[in_range] = image_exists[frame_ids[in_range]]
+        return out
+
+    active = exists(start_ids)
+    should_add = active.copy()
+    last_ids = start_ids.copy()
+    distance = np.zeros(n_windows)
+
+    window_rows = [np.nonzero(active)[0]]
+    window_ids = [start_ids[active]]
+    window_distances = [distance[active]]
+    step = 0
+    while active.any():
+        step += 1
+        rows = np.nonzero(active)[0]
+        current_ids = start_ids[rows] + step
+
+        found = exists(current_ids)
+        should_add[rows[~found]] = False
+        active[rows[~found]] = False
+        rows, current_ids = rows[found], current_ids[found]
+
+        prev_xyz = positions[last_ids[rows]]
+        current_xyz = positions[current_ids]
+        rel_distance = np.sqrt(
+            (prev_xyz[:, 0] - current_xyz[:, 0]) ** 2 + (prev_xyz[:, 2] - current_xyz[:, 2]) ** 2)
+        distance[rows] += rel_distance
+
+        keep = ~(rel_distance < frames_interval)
+        rows, current_ids = rows[keep], current_ids[keep]
+        stop = distance[rows] > sequence_distance
+        active[rows[stop]] = False
+        rows, current_ids = rows[~stop], current_ids[~stop]
+
+        last_ids[rows] = current_ids
+        window_rows.append(rows)
+        window_ids.append(current_ids)
+        window_distances.append(distance[rows])
+
+    window_rows = np.concatenate(window_rows)
+    order = np.argsort(window_rows, kind="stable")
+    splits = np.cumsum(np.bincount(window_rows, minlength=n_windows))[:-1]
+    window_ids = np.split(np.concatenate(window_ids)[order], splits)
+    window_distances = np.split(np.concatenate(window_distances)[order], splits)
+    return [
+        (window_ids[i].tolist(), window_distances[i].tolist(), bool(should_add[i]))
+        for i in range(n_windows)
+    ]
 
 
 class KittiDataset(Dataset):
@@ -24,12 +231,19 @@ class KittiDataset(Dataset):
             sequences=None,
             selected_frames=None, 
             n_rays=1200,
+            lazy_sources=False,
     ):
         super().__init__()
+        # Return the source images and lidar depths as LazySequence loaded on access
+        self.lazy_sources = lazy_sources
         self.root = root
         self.preprocess_root = preprocess_root
         self.depth_preprocess_root = os.path.join(preprocess_root, "depth")
         self.transform_preprocess_root = os.path.join(preprocess_root, "transform")
+        self.label_store = LabelStore(os.path.join(preprocess_root, "labels"))
+        self.scanned_error_frames = load_error_frames(preprocess_root)
+        self.transform_store = TransformStore(
+            transform_store_path(self.transform_preprocess_root, frames_interval))
         self.n_classes = 20
         self.n_sources = n_sources
         self.eval_depth = eval_depth
@@ -60,6 +274,7 @@ class KittiDataset(Dataset):
       
         start_time = time.time()
         self.scans = []
+        self.calibs = {}
 
         for sequence in self.sequences:
             pose_path = os.path.join(self.root, "dataset", "poses", sequence + ".txt")
@@ -73,6 +288,7 @@ class KittiDataset(Dataset):
             T_cam0_2_cam2 = calib['T_cam0_2_cam2']
             T_cam2_2_cam0 = np.linalg.inv(T_cam0_2_cam2)
             T_velo_2_cam = T_cam0_2_cam2 @ calib["Tr"]
+            self.calibs[sequence] = (T_velo_2_cam, P[0:3, 0:3])
             
             if split == "val":
                 glob_path = os.path.join(
@@ -86,62 +302,33 @@ class KittiDataset(Dataset):
 
             
             seq_img_paths = glob.glob(glob_path)
+            frame_ids = [os.path.splitext(os.path.basename(p))[0] for p in seq_img_paths]
+            if split == "val":
+                frame_ids = [frame_id for frame_id in frame_ids if float(frame_id) % 5 == 0]
+
+            image_dir = os.path.join(self.root, "dataset", "sequences", sequence, "image_2")
+            image_exists = list_image_frames(image_dir)
+            # The frames flagged by scripts/scan_frames.py end the windows like missing images
+            error_ids = [int(f) for s, f in self.scanned_error_frames if s == sequence and int(f) < len(image_exists)]
+            image_exists[error_ids] = False
+            windows = build_windows(
+                np.stack(gt_global_poses)[:, :3, 3],
+                [int(frame_id) for frame_id in frame_ids],
+                image_exists,
+                frames_interval, self.sequence_distance)
 
             max_length = 0
             min_length = 50
-            for seq_img_path in seq_img_paths:
-                filename = os.path.basename(seq_img_path)
-                frame_id = os.path.splitext(filename)[0]
-                if split == "val" and float(frame_id) % 5 != 0:
-                    continue
-                            
-                rel_frame_ids = []
-
-                img_paths = []
+            for frame_id, (window_ids, distances, should_add) in zip(frame_ids, windows):
+                rel_frame_ids = ["{:06d}".format(i) for i in window_ids]
+                img_paths = [os.path.join(image_dir, i + ".png") for i in rel_frame_ids]
                 seg2d_paths = []
-                lidar_paths = []
-                poses = []
-                distances = []
-
-
-                distance = 0
-                cnt = -1
-            
-                while True:
-                    cnt += 1
-                    rel_frame_id = "{:06d}".format(int(frame_id) + cnt)
-
-                    img_path = os.path.join(
-                        self.root, "dataset", "sequences", sequence, "image_2", rel_frame_id + ".png"
-                    )
-
-                    should_add = os.path.exists(img_path)
-                    if not should_add:
-                        break
-   
-                    current_pose = gt_global_poses[int(rel_frame_id)]
-                    if len(poses) > 0:
-                        prev_pose = poses[-1]
-                        prev_xyz = dump_xyz(prev_pose)
-                        current_xyz = dump_xyz(current_pose)
-                        rel_distance = np.sqrt(
-                            (prev_xyz[0] - current_xyz[0]) ** 2 + (prev_xyz[2] - current_xyz[2]) ** 2)
-                        distance += rel_distance
-                        if rel_distance < frames_interval:
-                            continue
-                        if distance > self.sequence_distance:
-                            break
-
-                    rel_frame_ids.append(rel_frame_id)
-                    img_paths.append(img_path)
-                    poses.append(current_pose)
-                    distances.append(distance)
-
-                    # We use lidar for evaluation only
-                    lidar_path = os.path.join(self.root, "dataset", "sequences", sequence, "velodyne",
-                                              rel_frame_id + ".bin")
-                    lidar_paths.append(lidar_path)
-
+                # We use lidar for evaluation only
+                lidar_paths = [
+                    os.path.join(self.root, "dataset", "sequences", sequence, "velodyne", i + ".bin")
+                    for i in rel_frame_ids
+                ]
+                poses = [gt_global_poses[i] for i in window_ids]
 
                 if len(poses) == 1:
                     should_add = False
@@ -195,38 +382,11 @@ class KittiDataset(Dataset):
             transforms.ToTensor()
         ])
         print("Preprocess time: --- %s seconds ---" % (time.time() - start_time))
+        print("{} precomputed transformations in {}".format(len(self.transform_store), self.transform_store.path))
 
 
     def get_depth_from_lidar(self, lidar_path, P, T_velo_2_cam, image_size):
-        scan = np.fromfile(lidar_path, dtype=np.float32)
-        scan = scan.reshape((-1, 4))
-        points = scan[:, :3]
-
-        keep_idx = points[:, 0] > 0  # only keep point in front of the vehicle
-        points_hcoords = np.concatenate([points[keep_idx], np.ones([keep_idx.sum(), 1], dtype=np.float32)], axis=1)
-
-        pts_cam = (T_velo_2_cam @ points_hcoords.T).T
-        # print(pts_cam[:, 2].min(), pts_cam[:, 2].max())
-        mask = (pts_cam[:, 2] <= self.eval_depth) & (pts_cam[:, 2] > 0)  # get points with depth < max_sample_depth
-        pts_cam = pts_cam[mask, :3]
-
-        img_points = (P[0:3, 0:3] @ pts_cam.T).T
-
-        img_points = img_points[:, :2] / np.expand_dims(img_points[:, 2], axis=1)  # scale 2D points
-        img_points = np.round(img_points).astype(int)
-        keep_idx_img_pts = (img_points[:, 0] > 0) & \
-                           (img_points[:, 1] > 0) & \
-                           (img_points[:, 0] < image_size[0]) & \
-                           (img_points[:, 1] < image_size[1])
-
- 
-        img_points = img_points[keep_idx_img_pts, :]
-
-        pts_cam = pts_cam[keep_idx_img_pts, :]
-
-        depths = pts_cam[:, 2]
-
-        return img_points, depths, pts_cam
+        return get_depth_from_lidar(lidar_path, P, T_velo_2_cam, image_size, self.eval_depth)
 
     def __getitem__(self, index):
         scan = self.scans[index]
@@ -256,7 +416,10 @@ class KittiDataset(Dataset):
 
         
         n_sources = min(len(distances) - 1, self.n_sources)
-        
+        source_args = []
+        target_args = []
+        lidar_args = []
+
         for d_id in range(n_sources):
             if self.n_sources < len(distances):    
                 source_id = np.random.randint(1, len(distances))
@@ -272,71 +435,45 @@ class KittiDataset(Dataset):
 
             target_id = source_id - 1
 
-            img_input_source = self.to_tensor_normalized(read_rgb(img_paths[source_id]))
-            img_input_sources.append(img_input_source)
+            source_args.append((img_paths[source_id],))
+            target_args.append((img_paths[target_id],))
+            depth_path = lidar_depth_path(self.depth_preprocess_root, sequence, rel_frame_id)
+            lidar_args.append((lidar_paths[source_id], P, T_velo_2_cam,
+                               (self.img_W, self.img_H), self.eval_depth, self.n_rays, depth_path))
+            if not self.lazy_sources:
+                img_input_source = self.to_tensor_normalized(read_rgb(img_paths[source_id]))
+                img_input_sources.append(img_input_source)
 
-       
-            img_source = self.to_tensor(read_rgb(img_paths[source_id]))
-            img_target = self.to_tensor(read_rgb(img_paths[target_id]))
+                img_source = self.to_tensor(read_rgb(img_paths[source_id]))
+                img_target = self.to_tensor(read_rgb(img_paths[target_id]))
 
+                loc2d_with_depth, lidar_depth = read_lidar_depth(*lidar_args[-1])
 
-            lidar_path = lidar_paths[source_id]
-            loc2d_with_depth, lidar_depth, _ = self.get_depth_from_lidar(lidar_path, P, T_velo_2_cam,
-                                                                         (self.img_W, self.img_H))
-
-            if self.n_rays  < lidar_depth.shape[0]:
-                idx = np.random.choice(lidar_depth.shape[0], size=self.n_rays, replace=False)
-                loc2d_with_depth = loc2d_with_depth[idx, :]
-                lidar_depth = lidar_depth[idx]
-
-            img_sources.append(img_source)
-            img_targets.append(img_target)
-            lidar_depths.append(torch.from_numpy(lidar_depth))
-            loc2d_with_depths.append(torch.from_numpy(loc2d_with_depth))
+                img_sources.append(img_source)
+                img_targets.append(img_target)
+                lidar_depths.append(lidar_depth)
+                loc2d_with_depths.append(loc2d_with_depth)
 
             # Get transformation from source to target coord
-            transform_dir = os.path.join(self.transform_preprocess_root,
-                                         "{}_{}_all".format(sequence, self.frames_interval))
-            os.makedirs(transform_dir, exist_ok=True)
-
-            transform_path = os.path.join(transform_dir, "{}.pkl".format(frame_id))
-
-            
-            if os.path.exists(transform_path):
-                try:
-                    with open(transform_path, "rb") as input_file:
-                        transform_data = pickle.load(input_file)
-                except EOFError:
-                    transform_data = {}
-            else:
-                transform_data = {}
-
-            if '{}'.format(source_id) in transform_data:
-                T_out_dict = transform_data['{}'.format(source_id)]
-            else:
-                poses = scan["poses"]
-                pose_source = poses[source_id]
-                pose_infer = poses[infer_id]
-                pose_target = poses[target_id]
-                lidar_path_source = lidar_paths[source_id]
-                lidar_path_target = lidar_paths[target_id]
-                lidar_path_infer = lidar_paths[infer_id]
-
-                T_out_dict = compute_transformation(
-                    lidar_path_source, lidar_path_infer, lidar_path_target,
-                    pose_source, pose_infer, pose_target,
-                    T_velo_2_cam, scan['T_cam0_2_cam2'])
-
-                transform_data['{}'.format(source_id)] = T_out_dict
-                with open(transform_path, "wb") as input_file:
-                    pickle.dump(transform_data, input_file)
-                    print("{}: saved {} to {}".format(frame_id, source_id, transform_path))
+            T_out_dict = self.transform_store.get(sequence, frame_id, source_id)
+            if T_out_dict is None:
+                # Not precomputed, run the ICPs without caching the result
+                T_out_dict = compute_source_transformation(scan, source_id)
 
             T_source2infer = T_out_dict['T_source2infer']
             T_source2target = T_out_dict['T_source2target']
             T_source2infers.append(torch.from_numpy(T_source2infer).float())
             T_source2targets.append(torch.from_numpy(T_source2target).float())
-           
+
+        if self.lazy_sources:
+            img_input_sources = LazySequence(
+                read_rgb_tensor, [args + (True,) for args in source_args])
+            img_sources = LazySequence(read_rgb_tensor, source_args)
+            img_targets = LazySequence(read_rgb_tensor, target_args)
+            # the points and depths are read from the same lidar scan
+            lidar = LazySequence(read_lidar_depth, lidar_args)
+            loc2d_with_depths = lidar.map(itemgetter(0))
+            lidar_depths = lidar.map(itemgetter(1))
 
 
         data = {
@@ -368,56 +505,52 @@ class KittiDataset(Dataset):
         data["scale_3ds"] = scale_3ds
         cam_K = P[0:3, 0:3]
         data["cam_K"] = cam_K
-        for scale_3d in scale_3ds:
-            # compute the 3D-2D mapping
-           
-            projected_pix, fov_mask, sensor_distance = vox2pix(
-                T_velo_2_cam,
-                cam_K,
-                self.vox_origin,
-                self.voxel_size * scale_3d,
-                self.img_W,
-                self.img_H,
-                self.scene_size,
-            )
-           
-            data["projected_pix_{}".format(scale_3d)] = projected_pix
-            data["sensor_distance_{}".format(scale_3d)] = sensor_distance
-            data["fov_mask_{}".format(scale_3d)] = fov_mask
-        
+        # The 3D-2D mapping only depends on the sequence calibration,
+        # it is not shipped with the items, use get_vox2pix(sequence, scale_3d)
+
         img_input = read_rgb(img_paths[infer_id])
 
         img_input = self.to_tensor_normalized(img_input)
         data["img_input"] = img_input
         
 
-        label_path = os.path.join(
-            self.root, "dataset", "sequences", sequence, "voxels", "{}.label".format(frame_id)
-        )
-        invalid_path = os.path.join(
-            self.root, "dataset", "sequences", sequence, "voxels", "{}.invalid".format(frame_id)
-        )
-        data['target_1_1'] = self.read_semKITTI_label(label_path, invalid_path)
+        target = self.label_store.get(sequence, frame_id)
+        if target is None:
+            label_path = os.path.join(
+                self.root, "dataset", "sequences", sequence, "voxels", "{}.label".format(frame_id)
+            )
+            invalid_path = os.path.join(
+                self.root, "dataset", "sequences", sequence, "voxels", "{}.invalid".format(frame_id)
+            )
+            target = self.read_semKITTI_label(label_path, invalid_path)
+        data['target_1_1'] = target
         
         
         return data
 
 
+    def get_vox2pix(self, sequence, scale_3d=1):
+        """
+        Projection of the voxel centroids of the sequence in the image, computed once per process
+        ------
+        return
+        projected_pix: (N, 2), fov_mask: (N,), sensor_distance: (N,) read-only arrays
+        """
+        T_velo_2_cam, cam_K = self.calibs[sequence]
+        return vox2pix_cached(
+            T_velo_2_cam,
+            cam_K,
+            self.vox_origin,
+            self.voxel_size * scale_3d,
+            self.img_W,
+            self.img_H,
+            self.scene_size,
+        )
+
     @staticmethod
     def read_semKITTI_label(label_path, invalid_path):
-        remap_lut = SemanticKittiIO.get_remap_lut("./scenerf/data/semantic_kitti/semantic-kitti.yaml")
-        LABEL = SemanticKittiIO._read_label_SemKITTI(label_path)
-        INVALID = SemanticKittiIO._read_invalid_SemKITTI(invalid_path)
-        LABEL = remap_lut[LABEL.astype(np.uint16)].astype(
-            np.float32
-        )  # Remap 20 classes semanticKITTI SSC
-       
-        LABEL[
-            np.isclose(INVALID, 1)
-        ] = 255  # Setting to unknown all voxels marked on invalid mask...
-        
-        LABEL = LABEL.reshape(256,256, 32)
-        return LABEL
+        """(256, 256, 32) uint8 labels, 255 for the invalid voxels"""
+        return read_semKITTI_label(label_path, invalid_path)
 
     def __len__(self):
         return len(self.scans)
@@ -1,8 +1,9 @@
 import pytorch_lightning as pl
 from torch.utils.data.dataloader import DataLoader
 
-from scenerf.data.semantic_kitti.collate import collate_fn
+from scenerf.data.semantic_kitti.collate import collate_fn, collate_stacked_fn
 from scenerf.data.semantic_kitti.kitti_dataset import KittiDataset
+from scenerf.data.utils.sequence_sampler import SequenceShardSampler
 from scenerf.data.utils.torch_util import worker_init_fn
 
 
@@ -19,7 +20,10 @@ class KittiDataModule(pl.LightningDataModule):
         frames_interval=0.4,
         n_sources=1,
         n_rays=1200,
-        selected_frames=None
+        selected_frames=None,
+        stack_sources=False,
+        lazy_sources=False,
+        shard_by_sequence=False,
     ):
         super().__init__()
         self.root = root
@@ -33,6 +37,12 @@ class KittiDataModule(pl.LightningDataModule):
         self.n_rays = n_rays
         self.selected_frames = selected_frames
         self.n_sources = n_sources
+        # Stack the sources into padded (B, S, ...) tensors instead of lists
+        self.collate_fn = collate_stacked_fn if stack_sources else collate_fn
+        # Load the source images and lidar depths on access (evaluation with all the sources)
+        self.lazy_sources = lazy_sources
+        # Sample contiguous frames of a few sequences on each rank for the cache locality
+        self.shard_by_sequence = shard_by_sequence
 
     def setup_train_ds(self):
         self.train_ds = KittiDataset(
@@ -44,7 +54,8 @@ class KittiDataModule(pl.LightningDataModule):
             frames_interval=self.frames_interval,
             selected_frames=self.selected_frames,
             eval_depth=self.eval_depth,
-            n_rays=self.n_rays
+            n_rays=self.n_rays,
+            lazy_sources=self.lazy_sources
         )
 
     def setup_val_ds(self):
@@ -57,7 +68,8 @@ class KittiDataModule(pl.LightningDataModule):
             eval_depth=self.eval_depth,
             frames_interval=self.frames_interval,
             selected_frames=self.selected_frames,
-            n_rays=self.n_rays
+            n_rays=self.n_rays,
+            lazy_sources=self.lazy_sources
         )
 
     def setup(self, stage=None):
@@ -65,15 +77,20 @@ class KittiDataModule(pl.LightningDataModule):
         self.setup_val_ds()
 
     def train_dataloader(self):
+        sampler = None
+        if self.shard_by_sequence:
+            sampler = SequenceShardSampler(
+                self.train_ds, [(scan["sequence"], int(scan["frame_id"])) for scan in self.train_ds.scans])
         return DataLoader(
             self.train_ds,
             batch_size=self.batch_size,
             drop_last=True,
             num_workers=self.num_workers,
-            shuffle=True,
+            shuffle=sampler is None,
+            sampler=sampler,
             pin_memory=True,
             worker_init_fn=worker_init_fn,
-            collate_fn=collate_fn,
+            collate_fn=self.collate_fn,
         )
 
     def val_dataloader(self):
@@ -85,6 +102,6 @@ class KittiDataModule(pl.LightningDataModule):
             shuffle=False,
             pin_memory=True,
             worker_init_fn=worker_init_fn,
-            collate_fn=collate_fn,
+            collate_fn=self.collate_fn,
         )
 
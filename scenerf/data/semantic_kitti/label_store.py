@@ -0,0 +1,81 @@
+import os
+import zipfile
+
+import numpy as np
+
+import scenerf.data.semantic_kitti.io_data as SemanticKittiIO
+
+
+REMAP_LUT_PATH = os.path.join(os.path.dirname(__file__), "semantic-kitti.yaml")
+
+
+def read_semKITTI_label(label_path, invalid_path):
+    """
+    Remapped semantic KITTI voxel labels, 255 for the invalid voxels
+    ------
+    return
+    (256, 256, 32) uint8 array
+    """
+    remap_lut = SemanticKittiIO.get_remap_lut(REMAP_LUT_PATH)
+    LABEL = np.fromfile(label_path, dtype=np.uint16)
+    INVALID = SemanticKittiIO._read_invalid_SemKITTI(invalid_path)
+    LABEL = remap_lut[LABEL].astype(np.uint8)  # Remap 20 classes semanticKITTI SSC
+    LABEL[INVALID == 1] = 255  # Setting to unknown all voxels marked on invalid mask...
+    return LABEL.reshape(256, 256, 32)
+
+
+def label_store_path(label_preprocess_root, sequence):
+    return os.path.join(label_preprocess_root, "{}.npz".format(sequence))
+
+
+def save_sequence_labels(frames, out_path):
+    """
+    Write the remapped labels of a sequence into a compressed .npz archive, one member per frame.
+    The frames are written one at a time so that the sequence never has to fit in memory.
+    frames: list of (frame_id, label_path, invalid_path)
+    """
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = out_path + ".{}.tmp".format(os.getpid())
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for frame_id, label_path, invalid_path in frames:
+            label = read_semKITTI_label(label_path, invalid_path)
+            with archive.open("{}.npy".format(frame_id), "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, label, allow_pickle=False)
+    os.replace(tmp_path, out_path)
+    return len(frames)
+
+
+class LabelStore:
+    """
+    Read-only access to the per sequence label archives written by `preprocess_kitti.py precompute-labels`.
+    Each frame is decompressed on access. The archives are opened lazily in each process,
+    a file handle must not be shared between the dataloader workers.
+    """
+
+    def __init__(self, label_preprocess_root):
+        self.label_preprocess_root = label_preprocess_root
+        self._archives = {}
+        self._pid = None
+
+    def get(self, sequence, frame_id):
+        """
+        return
+        (256, 256, 32) uint8 label of the frame, None if it is not in the store
+        """
+        if self._pid != os.getpid():
+            self._archives = {}
+            self._pid = os.getpid()
+        if sequence not in self._archives:
+            path = label_store_path(self.label_preprocess_root, sequence)
+            self._archives[sequence] = np.load(path) if os.path.exists(path) else None
+
+        archive = self._archives[sequence]
+        if archive is None or frame_id not in archive.files:
+            return None
+        return archive[frame_id]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_archives"] = {}
+        state["_pid"] = None
+        return state
@@ -0,0 +1,114 @@
+import glob
+import os
+import shutil
+
+import numpy as np
+
+
+TRANSFORM_DTYPE = np.dtype([
+    ("key", np.int64),
+    ("T_source2infer", np.float64, (4, 4)),
+    ("T_source2target", np.float64, (4, 4)),
+])
+
+
+def transform_store_path(transform_preprocess_root, frames_interval):
+    return os.path.join(transform_preprocess_root, "transforms_{}.npy".format(frames_interval))
+
+
+def transform_key(sequence, frame_id, source_id):
+    """
+    Unique int64 key of the transformations of (sequence, frame_id, source_id).
+    source_id is the index of the source in the window of frame_id, as in KittiDataset
+    """
+    return (int(sequence) * 1000000 + int(frame_id)) * 1000 + int(source_id)
+
+
+def make_records(keys, T_source2infers, T_source2targets):
+    records = np.empty(len(keys), dtype=TRANSFORM_DTYPE)
+    records["key"] = keys
+    records["T_source2infer"] = T_source2infers
+    records["T_source2target"] = T_source2targets
+    return records
+
+
+def _save_atomic(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".{}.tmp".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp_path, path)
+
+
+class TransformStore:
+    """
+    Read-only store of the source to infer / source to target transformations of KITTI.
+    A single .npy file of records sorted by key, written by `preprocess_kitti.py precompute-transforms`.
+    The transformations are memory mapped, only the keys are loaded in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            self.records = np.load(path, mmap_mode="r")
+            self.keys = np.array(self.records["key"])
+        else:
+            self.records = np.empty(0, dtype=TRANSFORM_DTYPE)
+            self.keys = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = np.searchsorted(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def get(self, sequence, frame_id, source_id):
+        """
+        return
+        the dict {T_source2infer, T_source2target} as computed by compute_transformation, None if missing
+        """
+        key = transform_key(sequence, frame_id, source_id)
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        record = self.records[i]
+        return {
+            "T_source2infer": np.array(record["T_source2infer"]),
+            "T_source2target": np.array(record["T_source2target"]),
+        }
+
+    # ==== Writing, only used by the offline precompute ====
+
+    @staticmethod
+    def parts_dir(path):
+        return path + ".parts"
+
+    @staticmethod
+    def save_part(path, records):
+        """Save a chunk of new records next to the store, merged later by `merge`"""
+        parts_dir = TransformStore.parts_dir(path)
+        part_id = len(glob.glob(os.path.join(parts_dir, "*.npy")))
+        _save_atomic(os.path.join(parts_dir, "{:06d}.npy".format(part_id)), records)
+
+    @staticmethod
+    def merge(path, extra_records=None):
+        """
+        Merge the store, its saved parts and extra_records into a new store, sorted and without duplicated keys.
+        The new store replaces the old one atomically, then the parts are removed.
+        """
+        parts_dir = TransformStore.parts_dir(path)
+        chunks = []
+        if os.path.exists(path):
+            chunks.append(np.load(path))
+        for part_path in sorted(glob.glob(os.path.join(parts_dir, "*.npy"))):
+            chunks.append(np.load(part_path))
+        if extra_records is not None:
+            chunks.append(extra_records)
+
+        records = np.concatenate(chunks) if len(chunks) > 0 else np.empty(0, dtype=TRANSFORM_DTYPE)
+        _, idx = np.unique(records["key"], return_index=True)
+        records = records[idx]
+        _save_atomic(path, records)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        return len(records)
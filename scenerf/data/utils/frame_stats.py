@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+
+FRAME_STATS_NAME = "frame_stats.npy"
+ERROR_FRAMES_NAME = "error_frames.txt"
+FRAME_STATS_DTYPE = np.dtype([
+    ("sequence", "U64"),
+    ("frame_id", "U6"),
+    ("error", "U128"),  # empty for the valid frames
+    ("n_depth", np.int64),  # valid depth pixels, or lidar points projected in the image
+    ("depth_min", np.float32),
+    ("depth_max", np.float32),
+    ("depth_mean", np.float32),
+])
+
+
+def frame_stats_path(out_dir):
+    return os.path.join(out_dir, FRAME_STATS_NAME)
+
+
+def make_record(sequence, frame_id, error="", depths=None):
+    """
+    Stats record of a frame, depths: (n,) valid depths in meters
+    """
+    record = np.zeros((), dtype=FRAME_STATS_DTYPE)
+    record["sequence"] = sequence
+    record["frame_id"] = frame_id
+    record["error"] = error[:128]
+    record["depth_min"] = record["depth_max"] = record["depth_mean"] = np.nan
+    if depths is not None and depths.shape[0] > 0:
+        record["n_depth"] = depths.shape[0]
+        record["depth_min"] = depths.min()
+        record["depth_max"] = depths.max()
+        record["depth_mean"] = depths.mean()
+    return record
+
+
+def read_image(path):
+    """Decode the whole image, PIL only reads the header on open"""
+    with Image.open(path) as img:
+        img.load()
+        return np.asarray(img)
+
+
+def check_bf_frame(scene_dir, sequence, frame_id, depth_shift=1000.0):
+    """
+    Check that the color, depth and pose of a Bundlefusion frame can be read and that the pose is finite
+    ------
+    return
+    FRAME_STATS_DTYPE record
+    """
+    prefix = os.path.join(scene_dir, "frame-{}".format(frame_id))
+    try:
+        read_image(prefix + ".color.jpg")
+        depth = read_image(prefix + ".depth.png")
+        pose = np.loadtxt(prefix + ".pose.txt", ndmin=2)
+    except Exception as e:
+        return make_record(sequence, frame_id, "{}: {}".format(type(e).__name__, e))
+
+    if depth.ndim != 2:
+        return make_record(sequence, frame_id, "depth of shape {}".format(depth.shape))
+    if pose.shape != (4, 4):
+        return make_record(sequence, frame_id, "pose of shape {}".format(pose.shape))
+    if not np.isfinite(pose).all():
+        return make_record(sequence, frame_id, "non-finite pose")
+    depth = depth[depth > 0] / depth_shift
+    return make_record(sequence, frame_id, depths=depth)
+
+
+def check_kitti_frame(seq_dir, sequence, frame_id, pose, P, T_velo_2_cam, image_size=(1220, 370)):
+    """
+    Check that the image and the lidar scan of a KITTI frame can be read, and that the scan and the pose are finite.
+    The depths are those of the lidar points projected in the image.
+    ------
+    return
+    FRAME_STATS_DTYPE record
+    """
+    # Late import, kitti_dataset imports the open3d based helpers
+    from scenerf.data.semantic_kitti.kitti_dataset import get_depth_from_lidar
+
+    if pose is None:
+        return make_record(sequence, frame_id, "missing pose")
+    if not np.isfinite(pose).all():
+        return make_record(sequence, frame_id, "non-finite pose")
+    lidar_path = os.path.join(seq_dir, "velodyne", frame_id + ".bin")
+    try:
+        read_image(os.path.join(seq_dir, "image_2", frame_id + ".png"))
+        if os.path.getsize(lidar_path) % 16 != 0:
+            return make_record(sequence, frame_id, "truncated lidar scan")
+        scan = np.fromfile(lidar_path, dtype=np.float32)
+    except Exception as e:
+        return make_record(sequence, frame_id, "{}: {}".format(type(e).__name__, e))
+
+    if scan.shape[0] == 0:
+        return make_record(sequence, frame_id, "empty lidar scan")
+    if not np.isfinite(scan).all():
+        return make_record(sequence, frame_id, "non-finite lidar points")
+    _, depths, _ = get_depth_from_lidar(lidar_path, P, T_velo_2_cam, image_size, np.inf)
+    return make_record(sequence, frame_id, depths=depths)
+
+
+def save_frame_stats(out_dir, records):
+    """
+    Write the stats sidecar of all the frames and the list of the invalid frames,
+    one <sequence>_<frame_id> per line as in bundlefusion/error_frames.txt
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    records = np.sort(np.asarray(records, dtype=FRAME_STATS_DTYPE), order=["sequence", "frame_id"])
+    path = frame_stats_path(out_dir)
+    tmp_path = path + ".{}.tmp".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp_path, path)
+
+    with open(os.path.join(out_dir, ERROR_FRAMES_NAME), "w") as f:
+        for record in records[records["error"] != ""]:
+            f.write("{}_{}\n".format(record["sequence"], record["frame_id"]))
+    return records
+
+
+def load_error_frames(out_dir):
+    """
+    return
+    set of the (sequence, frame_id) flagged by the scan of out_dir, empty if it was not scanned
+    """
+    path = frame_stats_path(out_dir)
+    if not os.path.exists(path):
+        return set()
+    records = np.load(path)
+    records = records[records["error"] != ""]
+    return set(zip(records["sequence"].tolist(), records["frame_id"].tolist()))
@@ -1,6 +1,15 @@
 """
 Code adapted from https://github.com/andyzeng/tsdf-fusion-python/blob/master/fusion.py
 """
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
 import numpy as np
 
 from numba import njit, prange
@@ -20,14 +29,21 @@ except Exception as err:
 class TSDFVolume:
   """Volumetric TSDF Fusion of RGB-D Images.
   """
-  def __init__(self, vol_bnds, voxel_size, trunc_margin=10, use_gpu=True):
+  def __init__(self, vol_bnds, voxel_size, trunc_margin=10, use_gpu=True, frustum_culling=True,
+               cpu_kernel="fused"):
     """Constructor.
 
     Args:
       vol_bnds (ndarray): An ndarray of shape (3, 2). Specifies the
         xyz bounds (min/max) in meters.
       voxel_size (float): The volume discretization in meters.
+      frustum_culling (bool): In CPU mode, only integrate the blocks of
+        voxels which intersect the view frustum of each frame.
+      cpu_kernel (str): CPU integration, "fused": a single parallel pass
+        updating each voxel in place, "numpy": vectorized NumPy steps.
+        Both give identical volumes.
     """
+    assert cpu_kernel in ("fused", "numpy"), cpu_kernel
     vol_bnds = np.asarray(vol_bnds)
     assert vol_bnds.shape == (3, 2), "[!] `vol_bnds` should be of shape (3, 2)."
 
@@ -37,7 +53,6 @@ class TSDFVolume:
     # self._trunc_margin = 10 * self._voxel_size  # truncation on SDF
     # self._trunc_margin = 10 * self._voxel_size  # truncation on SDF
     self._trunc_margin = trunc_margin 
-    self._color_const = 256 * 256
 
     # Adjust volume bounds and ensure C-order contiguous
     self._vol_dim = np.ceil((self._vol_bnds[:,1]-self._vol_bnds[:,0])/self._voxel_size).copy(order='C').astype(int)
@@ -55,7 +70,8 @@ class TSDFVolume:
     self._tsdf_vol_cpu = np.zeros(self._vol_dim).astype(np.float32) + 255 
     # for computing the cumulative moving average of observations per voxel
     self._weight_vol_cpu = np.zeros(self._vol_dim).astype(np.float32)
-    self._color_vol_cpu = np.zeros(self._vol_dim).astype(np.float32)
+    # RGB channels
+    self._color_vol_cpu = np.zeros(tuple(self._vol_dim) + (3,), dtype=np.uint8)
 
     self.gpu_mode = use_gpu and FUSION_GPU_MODE
 
@@ -65,8 +81,9 @@ class TSDFVolume:
       cuda.memcpy_htod(self._tsdf_vol_gpu,self._tsdf_vol_cpu)
       self._weight_vol_gpu = cuda.mem_alloc(self._weight_vol_cpu.nbytes)
       cuda.memcpy_htod(self._weight_vol_gpu,self._weight_vol_cpu)
-      self._color_vol_gpu = cuda.mem_alloc(self._color_vol_cpu.nbytes)
-      cuda.memcpy_htod(self._color_vol_gpu,self._color_vol_cpu)
+      # The CUDA kernel averages the colors folded into single floats
+      self._color_vol_gpu = cuda.mem_alloc(self._tsdf_vol_cpu.nbytes)
+      cuda.memcpy_htod(self._color_vol_gpu,np.zeros(self._vol_dim, dtype=np.float32))
 
       # Cuda kernel function (C++)
       self._cuda_src_mod = SourceModule("""
@@ -169,9 +186,29 @@ class TSDFVolume:
         yv.reshape(1,-1),
         zv.reshape(1,-1)
       ], axis=0).astype(int).T
+      # Blocks of block_size^3 voxels, the frustum culling keeps or drops whole blocks
+      self._block_size = B = 8
+      self._n_blocks = np.ceil(self._vol_dim / B).astype(int)
+      coords = np.indices(self._n_blocks * B).reshape(3, self._n_blocks[0], B, self._n_blocks[1], B, self._n_blocks[2], B)
+      coords = coords.transpose(0, 1, 3, 5, 2, 4, 6).reshape(3, -1, B ** 3).transpose(1, 2, 0)
+      self._block_corners = block_corners(
+        np.indices(self._n_blocks).reshape(3, -1).T, B, self._vol_dim, self._vol_origin, self._voxel_size)
+
+      if cpu_kernel == "numpy":
+        # Voxels of the blocks beyond the volume, when its dimensions are not multiples of block_size
+        self._block_vox_valid = np.all(coords < self._vol_dim, axis=-1)
+        if self._block_vox_valid.all():
+          self._block_vox_valid = None
+        self._block_vox_coords = np.minimum(coords, self._vol_dim - 1).astype(np.int32)
+        # World coordinates of the voxels computed once for all the frames, stored by blocks
+        # so that the frustum culling copies whole blocks
+        self._block_world_pts = self.vox2world(
+          self._vol_origin, self._block_vox_coords.reshape(-1, 3), self._voxel_size).reshape(coords.shape)
+    self.frustum_culling = frustum_culling
+    self.cpu_kernel = cpu_kernel
 
   @staticmethod
-  @njit(parallel=True)
+  @njit(parallel=True, nogil=True)
   def vox2world(vol_origin, vox_coords, vox_size):
     """Convert voxel grid coordinates to world coordinates.
     """
@@ -184,7 +221,18 @@ class TSDFVolume:
     return cam_pts
 
   @staticmethod
-  @njit(parallel=True)
+  @njit(parallel=True, nogil=True)
+  def world2cam(world_pts, cam_pose_inv):
+    """Convert world coordinates to camera coordinates, with the arithmetic of integrate_fused.
+    """
+    cam_pts = np.empty(world_pts.shape, dtype=np.float64)
+    for i in prange(world_pts.shape[0]):
+      for j in range(3):
+        cam_pts[i, j] = _transform_coord(cam_pose_inv, j, world_pts[i, 0], world_pts[i, 1], world_pts[i, 2])
+    return cam_pts
+
+  @staticmethod
+  @njit(parallel=True, nogil=True)
   def cam2pix(cam_pts, intr):
     """Convert camera coordinates to pixel coordinates.
     """
@@ -198,7 +246,7 @@ class TSDFVolume:
     return pix
 
   @staticmethod
-  @njit(parallel=True)
+  @njit(parallel=True, nogil=True)
   def integrate_tsdf(tsdf_vol, dist, w_old, obs_weight):
     """Integrate the TSDF volume.
     """
@@ -216,6 +264,37 @@ class TSDFVolume:
         mask[i] = 1
     return tsdf_vol_int, w_new, mask
 
+  @staticmethod
+  @njit(parallel=True, nogil=True)
+  def integrate_fused(tsdf_vol, weight_vol, color_vol, block_ids, block_frames, n_blocks, block_size,
+                      vol_origin, vox_size, cam_poses_inv, intr, color_ims, depth_ims,
+                      trunc_margin, obs_weight):
+    """Integrate a stack of frames in a single pass over the voxels of the given blocks, in place.
+
+    Each voxel integrates the frames in order, block_frames[n, f] tells whether the
+    block block_ids[n] is seen by the frame f. Same arithmetic as the NumPy steps of
+    integrate applied frame by frame.
+    """
+    vol_origin = vol_origin.astype(np.float32)
+    intr = intr.astype(np.float32)
+    fx, fy = intr[0, 0], intr[1, 1]
+    cx, cy = intr[0, 2], intr[1, 2]
+    dim_x, dim_y, dim_z = tsdf_vol.shape
+    for n in prange(block_ids.shape[0]):
+      x0, y0, z0 = _block_origin(block_ids[n], n_blocks, block_size)
+      for x in range(x0, min(x0 + block_size, dim_x)):
+        for y in range(y0, min(y0 + block_size, dim_y)):
+          for z in range(z0, min(z0 + block_size, dim_z)):
+            tsdf, weight, observed, f, pix_y, pix_x = _integrate_voxel(
+              x, y, z, tsdf_vol[x, y, z], weight_vol[x, y, z], block_frames, n,
+              vol_origin, vox_size, cam_poses_inv, fx, fy, cx, cy, depth_ims,
+              trunc_margin, obs_weight)
+            if observed:
+              tsdf_vol[x, y, z], weight_vol[x, y, z] = tsdf, weight
+              if f >= 0:
+                for c in range(3):
+                  color_vol[x, y, z, c] = color_ims[f, pix_y, pix_x, c]
+
   def integrate(self, color_im, depth_im, cam_intr, cam_pose, obs_weight=1.):
     """Integrate an RGB-D frame into the TSDF volume.
 
@@ -229,9 +308,7 @@ class TSDFVolume:
     """
     im_h, im_w = depth_im.shape
 
-    # Fold RGB color image into a single channel image
-    color_im = color_im.astype(np.float32)
-    color_im = np.floor(color_im[...,2]*self._color_const + color_im[...,1]*256 + color_im[...,0])
+    color_im = quantize_color(color_im)
 
     if self.gpu_mode:  # GPU mode: integrate voxel volume (calls CUDA kernel)
       for gpu_loop_idx in range(self._n_gpu_loops):
@@ -250,7 +327,7 @@ class TSDFVolume:
                               self._trunc_margin,
                               obs_weight
                             ], np.float32)),
-                            cuda.InOut(color_im.reshape(-1).astype(np.float32)),
+                            cuda.InOut(fold_color(color_im).reshape(-1)),
                             cuda.InOut(depth_im.reshape(-1).astype(np.float32)),
                             block=(self._max_gpu_threads_per_block,1,1),
                             grid=(
@@ -259,10 +336,32 @@ class TSDFVolume:
                               int(self._max_gpu_grid_dim[2]),
                             )
         )
-    else:  # CPU mode: integrate voxel volume (vectorized implementation)
+    else:  # CPU mode: integrate voxel volume
+      if self.frustum_culling:
+        block_ids = self.frustum_block_ids(depth_im, cam_intr, cam_pose)
+      else:
+        block_ids = np.arange(len(self._block_corners) // 8)
+      if len(block_ids) == 0:
+        return
+      cam_pose_inv = np.linalg.inv(cam_pose)
+
+      if self.cpu_kernel == "fused":
+        self.integrate_fused(self._tsdf_vol_cpu, self._weight_vol_cpu, self._color_vol_cpu,
+                             block_ids, np.ones((len(block_ids), 1), dtype=np.bool_),
+                             self._n_blocks, self._block_size, self._vol_origin, self._voxel_size,
+                             cam_pose_inv[None], cam_intr, color_im[None], depth_im[None],
+                             self._trunc_margin, obs_weight)
+        return
+
+      # Vectorized implementation
+      vox_coords = self._block_vox_coords[block_ids].reshape(-1, 3)
+      world_pts = self._block_world_pts[block_ids].reshape(-1, 3)
+      if self._block_vox_valid is not None:
+        vox_valid = self._block_vox_valid[block_ids].reshape(-1)
+        vox_coords, world_pts = vox_coords[vox_valid], world_pts[vox_valid]
+
       # Convert voxel grid coordinates to pixel coordinates
-      cam_pts = self.vox2world(self._vol_origin, self.vox_coords, self._voxel_size)
-      cam_pts = rigid_transform(cam_pts, np.linalg.inv(cam_pose))
+      cam_pts = self.world2cam(world_pts, cam_pose_inv)
       
       pix_z = cam_pts[:, 2]
       
@@ -296,9 +395,9 @@ class TSDFVolume:
     #   valid_pts = np.logical_and(depth_val > 0, depth_diff >= -_trunc_margin)
     #   dist = np.minimum(1, depth_diff / _trunc_margin)
       
-      valid_vox_x = self.vox_coords[valid_pts, 0]
-      valid_vox_y = self.vox_coords[valid_pts, 1]
-      valid_vox_z = self.vox_coords[valid_pts, 2]
+      valid_vox_x = vox_coords[valid_pts, 0]
+      valid_vox_y = vox_coords[valid_pts, 1]
+      valid_vox_z = vox_coords[valid_pts, 2]
       w_old = self._weight_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z]
       tsdf_vals = self._tsdf_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z]
       valid_dist = dist[valid_pts]
@@ -306,77 +405,717 @@ class TSDFVolume:
       self._weight_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z] = w_new
       self._tsdf_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z] = tsdf_vol_new
 
-      # Integrate color
-      old_color = self._color_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z]
-      old_b = np.floor(old_color / self._color_const)
-      old_g = np.floor((old_color-old_b*self._color_const)/256)
-      old_r = old_color - old_b*self._color_const - old_g*256
-
-      new_color = color_im[pix_y[valid_pts],pix_x[valid_pts]]
-      new_b = np.floor(new_color / self._color_const)
-      new_g = np.floor((new_color - new_b*self._color_const) /256)
-      new_r = new_color - new_b*self._color_const - new_g*256
-      # new_b = np.minimum(255., np.round((w_old*old_b + obs_weight*new_b) / w_new))
-      # new_g = np.minimum(255., np.round((w_old*old_g + obs_weight*new_g) / w_new))
-      # new_r = np.minimum(255., np.round((w_old*old_r + obs_weight*new_r) / w_new))
-      
-      new_colors = new_b*self._color_const + new_g*256 + new_r
-      self._color_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z] = self._color_vol_cpu[valid_vox_x, valid_vox_y, valid_vox_z] * (1 - mask) + new_colors * mask
+      # Integrate color, the color of the observation closest to the surface is kept
+      mask = mask.astype(bool)
+      self._color_vol_cpu[valid_vox_x[mask], valid_vox_y[mask], valid_vox_z[mask]] = \
+        color_im[pix_y[valid_pts][mask], pix_x[valid_pts][mask]]
       # pdb.set_trace()
 
+  def integrate_many(self, color_ims, depth_ims, cam_intr, cam_poses, obs_weight=1.):
+    """Integrate a stack of RGB-D frames into the TSDF volume.
+
+    Gives the volume of calling integrate on the frames in order. With the fused CPU
+    kernel, the frames are integrated in a single pass over the voxels, each voxel
+    updated by the frames in order; otherwise integrate is called on each frame.
+
+    Args:
+      color_ims (ndarray): RGB images of shape (N, H, W, 3), or a list of N images.
+      depth_ims (ndarray): Depth images of shape (N, H, W), or a list of N images.
+      cam_intr (ndarray): The camera intrinsics matrix of shape (3, 3), shared by the frames.
+      cam_poses (ndarray): The camera poses of shape (N, 4, 4).
+      obs_weight (float): The weight to assign for each observation.
+    """
+    if self.gpu_mode or self.cpu_kernel != "fused":
+      for color_im, depth_im, cam_pose in zip(color_ims, depth_ims, cam_poses):
+        self.integrate(color_im, depth_im, cam_intr, cam_pose, obs_weight=obs_weight)
+      return
+
+    depth_ims = np.stack(depth_ims)
+    cam_poses = np.stack(cam_poses)
+    color_ims = np.stack([quantize_color(im) for im in color_ims])
+    if len(depth_ims) == 0:
+      return
+
+    n_blocks = len(self._block_corners) // 8
+    block_frames = np.zeros((n_blocks, len(depth_ims)), dtype=np.bool_)
+    for f, (depth_im, cam_pose) in enumerate(zip(depth_ims, cam_poses)):
+      if self.frustum_culling:
+        block_frames[self.frustum_block_ids(depth_im, cam_intr, cam_pose), f] = True
+      else:
+        block_frames[:, f] = True
+    block_ids = np.flatnonzero(block_frames.any(axis=1))
+    if len(block_ids) == 0:
+      return
+    self.integrate_fused(self._tsdf_vol_cpu, self._weight_vol_cpu, self._color_vol_cpu,
+                         block_ids, block_frames[block_ids], self._n_blocks, self._block_size,
+                         self._vol_origin, self._voxel_size, np.linalg.inv(cam_poses), cam_intr,
+                         color_ims, depth_ims, self._trunc_margin, obs_weight)
+
+  def frustum_block_ids(self, depth_im, cam_intr, cam_pose):
+    """Indices of the blocks of voxels which intersect the view frustum.
+
+    A block is dropped when its 8 corners are on the outer side of one of the planes
+    of the frustum: behind the camera, beyond the largest depth plus the truncation
+    margin, or out of the image borders. The blocks are padded by half a voxel and
+    the image by a pixel, so the dropped voxels are exactly voxels which would not
+    be integrated.
+    """
+    if np.max(depth_im) <= 0:
+      return np.zeros(0, dtype=int)
+    outside = blocks_outside_frustum(self._block_corners, depth_im, cam_intr, cam_pose, self._trunc_margin)
+    return np.flatnonzero(~outside)
+
   def get_volume(self):
     if self.gpu_mode:
       cuda.memcpy_dtoh(self._tsdf_vol_cpu, self._tsdf_vol_gpu)
-      cuda.memcpy_dtoh(self._color_vol_cpu, self._color_vol_gpu)
+      color_vol = np.empty(self._vol_dim, dtype=np.float32)
+      cuda.memcpy_dtoh(color_vol, self._color_vol_gpu)
+      self._color_vol_cpu = unfold_color(color_vol)
     return self._tsdf_vol_cpu, self._color_vol_cpu
 
-  def get_point_cloud(self):
-    
-    """Extract a point cloud from the voxel volume.
+  def get_point_cloud(self, chunk_size=None, n_workers=0):
+    """Extract a point cloud from the voxel volume, the vertices of get_mesh.
     """
-
-    tsdf_vol, color_vol = self.get_volume()
-
-    # Marching cubes
-    verts = measure.marching_cubes_lewiner(tsdf_vol, level=0)[0]
-    verts_ind = np.round(verts).astype(int)
-    verts = verts*self._voxel_size + self._vol_origin
-
-    # Get vertex colors
-    rgb_vals = color_vol[verts_ind[:, 0], verts_ind[:, 1], verts_ind[:, 2]]
-    colors_b = np.floor(rgb_vals / self._color_const)
-    colors_g = np.floor((rgb_vals - colors_b*self._color_const) / 256)
-    colors_r = rgb_vals - colors_b*self._color_const - colors_g*256
-    colors = np.floor(np.asarray([colors_r, colors_g, colors_b])).T
-    colors = colors.astype(np.uint8)
-    
+    verts, faces, norms, colors = self.get_mesh(chunk_size=chunk_size, n_workers=n_workers)
     # pc = np.hstack([verts, colors])
     return verts, colors
 
-  def get_mesh(self, mask=None):
+  def get_mesh(self, mask=None, chunk_size=None, n_workers=0):
     """Compute a mesh from the voxel volume using marching cubes.
+
+    Args:
+      mask (ndarray): Voxels to mesh, the others are set as free space.
+      chunk_size (int): Marching cubes runs on the whole volume, or with chunk_size on the
+        chunks of chunk_size^3 voxels crossed by the surface and the meshes are stitched.
+      n_workers (int): Processes running the chunks, 0 runs them in this process and
+        None on all the CPUs.
     """
+    if chunk_size is None:
+      tsdf_vol, color_vol = self.get_volume()
+      if mask is not None:
+        tsdf_vol[~mask.reshape(tsdf_vol.shape)] = 1
+      return mesh_from_volume(tsdf_vol, color_vol, self._voxel_size, self._vol_origin)
+    return chunked_mesh(*self._mesh_chunks(mask, chunk_size), self._voxel_size, self._vol_origin, n_workers)
+
+  def write_mesh(self, filename, mask=None, chunk_size=None, n_workers=0, binary=True):
+    """Save the mesh of get_mesh to a polygon .ply file as meshwrite. With chunk_size,
+    the chunks are written as they are extracted, without keeping the whole mesh in memory.
+
+    Returns:
+      Number of vertices and faces.
+    """
+    if chunk_size is None:
+      return write_volume_mesh(filename, self.get_mesh(mask), binary)
+    return write_chunked_mesh(filename, *self._mesh_chunks(mask, chunk_size), self._voxel_size,
+                              self._vol_origin, n_workers, binary)
+
+  def _mesh_chunks(self, mask, chunk_size):
+    """Arguments of iter_mesh_chunks."""
     tsdf_vol, color_vol = self.get_volume()
     if mask is not None:
-      # pdb.set_trace()
-      tsdf_vol[~mask.reshape(tsdf_vol.shape)] = 1
-      
-   
-    # Marching cubes
-    tsdf_vol_copy = np.copy(tsdf_vol)
-    tsdf_vol_copy[tsdf_vol_copy == 255] = 0
-    verts, faces, norms, vals = measure.marching_cubes_lewiner(tsdf_vol, level=0)
-    verts_ind = np.round(verts).astype(int)
-    verts = verts*self._voxel_size+self._vol_origin  # voxel grid coordinates to world coordinates
-
-    # Get vertex colors
-    rgb_vals = color_vol[verts_ind[:,0], verts_ind[:,1], verts_ind[:,2]]
-    colors_b = np.floor(rgb_vals/self._color_const)
-    colors_g = np.floor((rgb_vals-colors_b*self._color_const)/256)
-    colors_r = rgb_vals-colors_b*self._color_const-colors_g*256
-    colors = np.floor(np.asarray([colors_r,colors_g,colors_b])).T
-    colors = colors.astype(np.uint8)
-    return verts, faces, norms, colors
+      mask = mask.reshape(tsdf_vol.shape)
+
+    def read_chunk(vox_min, vox_max):
+      roi = tuple(slice(a, b) for a, b in zip(vox_min, vox_max))
+      tsdf_chunk = tsdf_vol[roi]
+      if mask is not None:
+        tsdf_chunk = np.where(mask[roi], tsdf_chunk, np.float32(1))
+      return tsdf_chunk, color_vol[roi]
+
+    chunk_coords = surface_chunks(*grid_range(tsdf_vol, chunk_size), check_max=mask is None)
+    return read_chunk, chunk_coords, self._vol_dim, chunk_size
+
+
+class SparseTSDFVolume:
+  """Volumetric TSDF Fusion of RGB-D Images, in blocks of 8^3 voxels allocated on first observation.
+
+  Gives the volumes of TSDFVolume in CPU mode, but only the blocks with at least one
+  integrated voxel are stored: a hash map from the block index to a slot of pools of
+  blocks. The memory grows with the observed space instead of the volume bounds, for
+  large scenes, fine voxel sizes or the fusion of whole sequences.
+
+  The blocks seen by a frame are found from the bounding box of its view frustum, so
+  the cost of a frame does not depend on the volume bounds either.
+  """
+  def __init__(self, vol_bnds, voxel_size, trunc_margin=10, block_size=8):
+    """Constructor.
+
+    Args:
+      vol_bnds (ndarray): An ndarray of shape (3, 2). Specifies the
+        xyz bounds (min/max) in meters.
+      voxel_size (float): The volume discretization in meters.
+      block_size (int): Number of voxels of the side of the blocks.
+    """
+    vol_bnds = np.array(vol_bnds, dtype=float)
+    assert vol_bnds.shape == (3, 2), "[!] `vol_bnds` should be of shape (3, 2)."
+
+    # Same volume parameters as TSDFVolume
+    self._voxel_size = float(voxel_size)
+    self._trunc_margin = trunc_margin
+    self._vol_dim = np.ceil((vol_bnds[:,1]-vol_bnds[:,0])/self._voxel_size).copy(order='C').astype(int)
+    vol_bnds[:,1] = vol_bnds[:,0]+self._vol_dim*self._voxel_size
+    self._vol_bnds = vol_bnds
+    self._vol_origin = vol_bnds[:,0].copy(order='C').astype(np.float32)
+
+    self._block_size = block_size
+    self._n_blocks = np.ceil(self._vol_dim / block_size).astype(int)
+    # Block index -> slot in the pools
+    self._slots = {}
+    self._n_allocated = 0
+    self._slot_block_ids = np.zeros(0, dtype=np.int64)
+    self._tsdf_blocks = np.zeros((0,) + (block_size,) * 3, dtype=np.float32)
+    self._weight_blocks = np.zeros((0,) + (block_size,) * 3, dtype=np.float32)
+    self._color_blocks = np.zeros((0,) + (block_size,) * 3 + (3,), dtype=np.uint8)
+
+  @property
+  def n_allocated_blocks(self):
+    return self._n_allocated
+
+  @property
+  def nbytes(self):
+    """Bytes of the allocated blocks and of the pools."""
+    return (self._tsdf_blocks.nbytes + self._weight_blocks.nbytes + self._color_blocks.nbytes +
+            self._slot_block_ids.nbytes)
+
+  @staticmethod
+  @njit(parallel=True, nogil=True)
+  def integrate_blocks(tsdf_blocks, weight_blocks, color_blocks, slots, block_ids, block_frames,
+                       n_blocks, vol_dim, vol_origin, vox_size, cam_poses_inv, intr, color_ims,
+                       depth_ims, trunc_margin, obs_weight):
+    """Integrate a stack of frames into the blocks block_ids stored in the given slots, in place.
+
+    Returns:
+      Whether each block has a voxel observed by a frame.
+    """
+    vol_origin = vol_origin.astype(np.float32)
+    intr = intr.astype(np.float32)
+    fx, fy = intr[0, 0], intr[1, 1]
+    cx, cy = intr[0, 2], intr[1, 2]
+    block_size = tsdf_blocks.shape[1]
+    block_observed = np.zeros(block_ids.shape[0], dtype=np.bool_)
+    for n in prange(block_ids.shape[0]):
+      slot = slots[n]
+      x0, y0, z0 = _block_origin(block_ids[n], n_blocks, block_size)
+      for i in range(min(block_size, vol_dim[0] - x0)):
+        for j in range(min(block_size, vol_dim[1] - y0)):
+          for k in range(min(block_size, vol_dim[2] - z0)):
+            tsdf, weight, observed, f, pix_y, pix_x = _integrate_voxel(
+              x0 + i, y0 + j, z0 + k, tsdf_blocks[slot, i, j, k], weight_blocks[slot, i, j, k],
+              block_frames, n, vol_origin, vox_size, cam_poses_inv,
+              fx, fy, cx, cy, depth_ims, trunc_margin, obs_weight)
+            if observed:
+              tsdf_blocks[slot, i, j, k] = tsdf
+              weight_blocks[slot, i, j, k] = weight
+              if f >= 0:
+                for c in range(3):
+                  color_blocks[slot, i, j, k, c] = color_ims[f, pix_y, pix_x, c]
+              block_observed[n] = True
+    return block_observed
+
+  def integrate(self, color_im, depth_im, cam_intr, cam_pose, obs_weight=1.):
+    """Integrate an RGB-D frame into the TSDF volume, as TSDFVolume.integrate.
+    """
+    self.integrate_many([color_im], [depth_im], cam_intr, [cam_pose], obs_weight=obs_weight)
+
+  def integrate_many(self, color_ims, depth_ims, cam_intr, cam_poses, obs_weight=1.):
+    """Integrate a stack of RGB-D frames into the TSDF volume, as TSDFVolume.integrate_many.
+    """
+    depth_ims = np.stack(depth_ims)
+    cam_poses = np.stack(cam_poses)
+    color_ims = np.stack([quantize_color(im) for im in color_ims])
+
+    frame_block_ids = [self.frustum_block_ids(depth_im, cam_intr, cam_pose)
+                       for depth_im, cam_pose in zip(depth_ims, cam_poses)]
+    if sum(len(ids) for ids in frame_block_ids) == 0:
+      return
+    block_ids = np.unique(np.concatenate(frame_block_ids))
+    block_frames = np.zeros((len(block_ids), len(depth_ims)), dtype=np.bool_)
+    for f, ids in enumerate(frame_block_ids):
+      block_frames[np.searchsorted(block_ids, ids), f] = True
+
+    # The new blocks get slots after the allocated ones, the slots of the blocks left
+    # unobserved are released after the integration
+    slots = np.array([self._slots.get(block_id, -1) for block_id in block_ids.tolist()], dtype=np.int64)
+    new = slots < 0
+    n_new = int(new.sum())
+    self._reserve(self._n_allocated + n_new)
+    slots[new] = np.arange(self._n_allocated, self._n_allocated + n_new)
+
+    observed = self.integrate_blocks(
+      self._tsdf_blocks, self._weight_blocks, self._color_blocks, slots, block_ids, block_frames,
+      self._n_blocks, self._vol_dim, self._vol_origin, self._voxel_size, np.linalg.inv(cam_poses),
+      cam_intr, color_ims, depth_ims, self._trunc_margin, obs_weight)
+
+    kept = observed[new]
+    new_ids, new_slots = block_ids[new][kept], slots[new][kept]
+    dest = np.arange(self._n_allocated, self._n_allocated + len(new_slots))
+    for pool, fill in self._pools():
+      pool[dest] = pool[new_slots]
+      pool[self._n_allocated + len(new_slots):self._n_allocated + n_new] = fill
+    self._slot_block_ids[dest] = new_ids
+    self._slots.update(zip(new_ids.tolist(), dest.tolist()))
+    self._n_allocated += len(new_slots)
+
+  def _pools(self):
+    return [(self._tsdf_blocks, 255), (self._weight_blocks, 0), (self._color_blocks, 0)]
+
+  def _reserve(self, n_slots):
+    """Grow the pools to at least n_slots blocks, the free slots are in the initial state."""
+    capacity = len(self._slot_block_ids)
+    if n_slots <= capacity:
+      return
+    n_added = max(n_slots, 2 * capacity) - capacity
+    self._tsdf_blocks, self._weight_blocks, self._color_blocks = [
+      np.concatenate([pool, np.full((n_added,) + pool.shape[1:], fill, dtype=pool.dtype)])
+      for pool, fill in self._pools()
+    ]
+    self._slot_block_ids = np.concatenate([self._slot_block_ids, np.zeros(n_added, dtype=np.int64)])
+
+  def frustum_block_ids(self, depth_im, cam_intr, cam_pose):
+    """Indices of the blocks of voxels which intersect the view frustum, as TSDFVolume.frustum_block_ids.
+
+    Only the blocks in the bounding box of the frustum are tested.
+    """
+    max_depth = np.max(depth_im)
+    if max_depth <= 0:
+      return np.zeros(0, dtype=int)
+    im_h, im_w = depth_im.shape
+    fx, fy = cam_intr[0, 0], cam_intr[1, 1]
+    cx, cy = cam_intr[0, 2], cam_intr[1, 2]
+
+    # The integrated voxels are in the pyramid of the camera center and of the image
+    # padded by a pixel at the largest depth plus the truncation margin
+    far = max_depth + self._trunc_margin
+    frustum = np.zeros((5, 3))
+    frustum[1:, 0] = (np.array([-1, im_w, -1, im_w]) - cx) * far / fx
+    frustum[1:, 1] = (np.array([-1, -1, im_h, im_h]) - cy) * far / fy
+    frustum[1:, 2] = far
+    frustum = rigid_transform(frustum, cam_pose)
+    vox_min = np.floor((frustum.min(axis=0) - self._vol_origin) / self._voxel_size).astype(int) - 1
+    vox_max = np.ceil((frustum.max(axis=0) - self._vol_origin) / self._voxel_size).astype(int) + 1
+    block_min = np.maximum(vox_min // self._block_size, 0)
+    block_max = np.minimum(vox_max // self._block_size + 1, self._n_blocks)
+    if np.any(block_max <= block_min):
+      return np.zeros(0, dtype=int)
+
+    block_coords = np.indices(block_max - block_min).reshape(3, -1).T + block_min
+    corners = block_corners(block_coords, self._block_size, self._vol_dim, self._vol_origin, self._voxel_size)
+    outside = blocks_outside_frustum(corners, depth_im, cam_intr, cam_pose, self._trunc_margin)
+    return np.ravel_multi_index(block_coords[~outside].T, self._n_blocks)
+
+  def to_dense(self, pool, fill, block_min=None, block_max=None):
+    """Dense volume of one of the pools, over the blocks [block_min, block_max) (all by default).
+    """
+    block_min = np.zeros(3, dtype=int) if block_min is None else np.asarray(block_min)
+    block_max = self._n_blocks if block_max is None else np.asarray(block_max)
+    B = self._block_size
+    n = block_max - block_min
+    vol = np.full(tuple(n * B) + pool.shape[4:], fill, dtype=pool.dtype)
+
+    block_coords = np.stack(np.unravel_index(self._slot_block_ids[:self._n_allocated], self._n_blocks), axis=-1)
+    block_coords -= block_min
+    inside = np.all((block_coords >= 0) & (block_coords < n), axis=1)
+    blocks = vol.reshape((n[0], B, n[1], B, n[2], B) + pool.shape[4:])
+    blocks = blocks.transpose((0, 2, 4, 1, 3, 5) + tuple(range(6, blocks.ndim)))
+    blocks[tuple(block_coords[inside].T)] = pool[:self._n_allocated][inside]
+
+    vox_max = np.minimum(block_max * B, self._vol_dim) - block_min * B
+    return np.ascontiguousarray(vol[:vox_max[0], :vox_max[1], :vox_max[2]])
+
+  def get_volume(self):
+    """Dense TSDF and color volumes, identical to the ones of TSDFVolume.get_volume.
+    """
+    return self.to_dense(self._tsdf_blocks, 255), self.to_dense(self._color_blocks, 0)
+
+  def read_chunk(self, vox_min, vox_max):
+    """Dense TSDF and color volumes of the voxels [vox_min, vox_max).
+    """
+    B = self._block_size
+    vox_min, vox_max = np.asarray(vox_min), np.asarray(vox_max)
+    block_min = vox_min // B
+    block_max = -(-vox_max // B)
+    n = block_max - block_min
+    tsdf_vol = np.full(tuple(n * B), 255, dtype=np.float32)
+    color_vol = np.zeros(tuple(n * B) + (3,), dtype=np.uint8)
+    for block_coord in np.ndindex(*n):
+      block_id = np.ravel_multi_index(tuple(block_min + block_coord), self._n_blocks)
+      slot = self._slots.get(int(block_id))
+      if slot is not None:
+        roi = tuple(slice(a * B, (a + 1) * B) for a in block_coord)
+        tsdf_vol[roi] = self._tsdf_blocks[slot]
+        color_vol[roi] = self._color_blocks[slot]
+    roi = tuple(slice(a, b) for a, b in zip(vox_min - block_min * B, vox_max - block_min * B))
+    return tsdf_vol[roi], color_vol[roi]
+
+  def get_mesh(self, mask=None, chunk_size=None, n_workers=0):
+    """Compute a mesh from the voxel volume using marching cubes, as TSDFVolume.get_mesh.
+
+    With chunk_size=None, only the bounding box of the allocated blocks, padded by a
+    block, is made dense. Otherwise only the chunks of allocated blocks are.
+    """
+    if chunk_size is None:
+      block_min, block_max = np.zeros(3, dtype=int), np.ones(3, dtype=int)
+      if self._n_allocated > 0:
+        block_coords = np.stack(np.unravel_index(self._slot_block_ids[:self._n_allocated], self._n_blocks), axis=-1)
+        block_min = np.maximum(block_coords.min(axis=0) - 1, 0)
+        block_max = np.minimum(block_coords.max(axis=0) + 2, self._n_blocks)
+      tsdf_vol = self.to_dense(self._tsdf_blocks, 255, block_min, block_max)
+      color_vol = self.to_dense(self._color_blocks, 0, block_min, block_max)
+
+      vox_min = block_min * self._block_size
+      if mask is not None:
+        mask = mask.reshape(self._vol_dim)[tuple(slice(a, a + n) for a, n in zip(vox_min, tsdf_vol.shape))]
+        tsdf_vol[~mask] = 1
+      return mesh_from_volume(tsdf_vol, color_vol, self._voxel_size,
+                              self._vol_origin + vox_min * self._voxel_size)
+    return chunked_mesh(*self._mesh_chunks(mask, chunk_size), self._voxel_size, self._vol_origin, n_workers)
+
+  def get_point_cloud(self, chunk_size=None, n_workers=0):
+    """Extract a point cloud from the voxel volume, as TSDFVolume.get_point_cloud.
+    """
+    verts, faces, norms, colors = self.get_mesh(chunk_size=chunk_size, n_workers=n_workers)
+    return verts, colors
+
+  def write_mesh(self, filename, mask=None, chunk_size=None, n_workers=0, binary=True):
+    """Save the mesh of get_mesh to a polygon .ply file, as TSDFVolume.write_mesh.
+    """
+    if chunk_size is None:
+      return write_volume_mesh(filename, self.get_mesh(mask), binary)
+    return write_chunked_mesh(filename, *self._mesh_chunks(mask, chunk_size), self._voxel_size,
+                              self._vol_origin, n_workers, binary)
+
+  def _mesh_chunks(self, mask, chunk_size):
+    """Arguments of iter_mesh_chunks, the chunks are found from the blocks."""
+    assert chunk_size % self._block_size == 0, "chunk_size should be a multiple of the block size"
+    block_min = np.full(self._n_blocks, 255, dtype=np.float32)
+    block_max = np.full(self._n_blocks, 255, dtype=np.float32)
+    if self._n_allocated > 0:
+      blocks = self._tsdf_blocks[:self._n_allocated].reshape(self._n_allocated, -1)
+      block_coords = np.unravel_index(self._slot_block_ids[:self._n_allocated], self._n_blocks)
+      block_min[block_coords] = blocks.min(axis=1)
+      block_max[block_coords] = blocks.max(axis=1)
+    if mask is not None:
+      mask = mask.reshape(self._vol_dim)
+
+    def read_chunk(vox_min, vox_max):
+      tsdf_chunk, color_chunk = self.read_chunk(vox_min, vox_max)
+      if mask is not None:
+        roi = tuple(slice(a, b) for a, b in zip(vox_min, vox_max))
+        tsdf_chunk[~mask[roi]] = 1
+      return tsdf_chunk, color_chunk
+
+    stride = chunk_size // self._block_size
+    chunk_coords = surface_chunks(grid_range(block_min, stride)[0], grid_range(block_max, stride)[1],
+                                  check_max=mask is None)
+    return read_chunk, chunk_coords, self._vol_dim, chunk_size
+
+
+class IntegrationWorker:
+  """Integrate RGB-D frames into a TSDF volume in a background thread.
+
+  The frames are passed through a queue of at most max_queued frames: put returns
+  as soon as the frame is queued, so that producing the next frame (e.g. rendering
+  it on the GPU) overlaps the integration of the previous ones, and blocks when the
+  queue is full. The numba kernels release the GIL. Use a CPU volume, the CUDA
+  context of PyCUDA belongs to the thread which created it.
+
+  Args:
+    tsdf_vol: TSDFVolume or SparseTSDFVolume.
+    cam_intr (ndarray): The camera intrinsics matrix of shape (3, 3).
+    max_queued (int): Maximum number of frames waiting for integration.
+    obs_weight (float): The weight to assign for each observation.
+  """
+  def __init__(self, tsdf_vol, cam_intr, max_queued=2, obs_weight=1.):
+    self.tsdf_vol = tsdf_vol
+    self.cam_intr = cam_intr
+    self.obs_weight = obs_weight
+    self.n_integrated = 0
+    self._queue = queue.Queue(maxsize=max_queued)
+    self._error = None
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def _run(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        return
+      if self._error is not None:
+        continue  # Drain the queue so that put does not block
+      color_im, depth_im, cam_pose, callback = item
+      try:
+        if callback is not None:
+          callback()
+        self.tsdf_vol.integrate(color_im, depth_im, self.cam_intr, cam_pose, obs_weight=self.obs_weight)
+        self.n_integrated += 1
+      except BaseException as err:
+        self._error = err
+
+  def put(self, color_im, depth_im, cam_pose, callback=None):
+    """Queue a frame, callback is called in the worker thread before its integration (e.g. to save it).
+    """
+    if self._error is not None:
+      raise self._error
+    self._queue.put((color_im, depth_im, cam_pose, callback))
+
+  def close(self):
+    """Wait for the integration of the queued frames."""
+    if self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+    if self._error is not None:
+      raise self._error
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    if exc_type is None:
+      self.close()
+      return
+    # The exception of the producer propagates, the queued frames are skipped
+    if self._error is None:
+      self._error = exc
+    if self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+
+
+def quantize_color(color_im):
+  """RGB image of shape (H, W, 3) with values in [0, 255] to uint8 channels.
+  """
+  color_im = np.asarray(color_im)
+  if color_im.dtype == np.uint8:
+    return color_im
+  return np.clip(np.round(color_im), 0, 255).astype(np.uint8)
+
+
+def fold_color(color_im):
+  """Fold a uint8 (..., 3) RGB image into the float32 values b * 256^2 + g * 256 + r of the CUDA kernel.
+  """
+  color_im = color_im.astype(np.float32)
+  return color_im[...,2]*256*256 + color_im[...,1]*256 + color_im[...,0]
+
+
+def unfold_color(color_vol):
+  """Inverse of fold_color, the channels are rounded.
+  """
+  color_vol = np.round(color_vol).astype(np.int64)
+  return np.stack([color_vol % 256, color_vol // 256 % 256, color_vol // (256 * 256)], axis=-1).astype(np.uint8)
+
+
+def mesh_from_volume(tsdf_vol, color_vol, voxel_size, vol_origin):
+  """Compute a mesh from TSDF and RGB color volumes using marching cubes.
+  """
+  verts, faces, norms, vals = measure.marching_cubes_lewiner(tsdf_vol, level=0)
+  verts_ind = np.round(verts).astype(int)
+  verts = verts*voxel_size+vol_origin  # voxel grid coordinates to world coordinates
+
+  # Get vertex colors
+  colors = color_vol[verts_ind[:,0], verts_ind[:,1], verts_ind[:,2]]
+  return verts, faces, norms, colors
+
+
+@njit(parallel=True, nogil=True)
+def grid_range(vol, stride):
+  """Minimum and maximum of the cubes of stride^3 voxels of a volume."""
+  n0 = (vol.shape[0] + stride - 1) // stride
+  n1 = (vol.shape[1] + stride - 1) // stride
+  n2 = (vol.shape[2] + stride - 1) // stride
+  vol_min = np.full((n0, n1, n2), np.inf, dtype=np.float32)
+  vol_max = np.full((n0, n1, n2), -np.inf, dtype=np.float32)
+  for c0 in prange(n0):
+    for x in range(c0 * stride, min((c0 + 1) * stride, vol.shape[0])):
+      for y in range(vol.shape[1]):
+        c1 = y // stride
+        for z in range(vol.shape[2]):
+          c2 = z // stride
+          val = vol[x, y, z]
+          if val < vol_min[c0, c1, c2]:
+            vol_min[c0, c1, c2] = val
+          if val > vol_max[c0, c1, c2]:
+            vol_max[c0, c1, c2] = val
+  return vol_min, vol_max
+
+
+def surface_chunks(chunk_min, chunk_max, check_max=True):
+  """Coordinates of the chunks of marching cubes which may contain a part of the surface.
+
+  Args:
+    chunk_min, chunk_max (ndarray): Minimum and maximum TSDF of the voxels of each chunk.
+    check_max (bool): False when values were raised by a mask, then only the
+      minimum is checked.
+
+  Chunk c runs marching cubes on the voxels [c * chunk_size, (c + 1) * chunk_size],
+  which spill over the chunks c + (0|1, 0|1, 0|1): the chunk is kept if their
+  minimum is <= 0 and their maximum is >= 0.
+  """
+  n_chunks = chunk_min.shape
+  reduced = []
+  for grid, reduce, pad in [(chunk_min, np.minimum, np.inf), (chunk_max, np.maximum, -np.inf)]:
+    grid = np.pad(grid, [(0, 1)] * 3, constant_values=pad)
+    dilated = grid[:-1, :-1, :-1]
+    for offset in np.ndindex(2, 2, 2):
+      dilated = reduce(dilated, grid[offset[0]:offset[0] + n_chunks[0],
+                                     offset[1]:offset[1] + n_chunks[1],
+                                     offset[2]:offset[2] + n_chunks[2]])
+    reduced.append(dilated)
+  keep = reduced[0] <= 0
+  if check_max:
+    keep &= reduced[1] >= 0
+  return np.argwhere(keep)
+
+
+def mesh_chunk(tsdf_chunk, color_chunk, vox_min, cell_min, cell_max):
+  """Marching cubes on a chunk of the TSDF and color volumes starting at voxel vox_min.
+
+  Only the faces in the cells [cell_min, cell_max) are kept, the chunk is read with a
+  margin of a voxel so that the normals are the ones of marching cubes on the whole volume.
+
+  Returns:
+    verts: Voxel coordinates in the whole volume (float64).
+    faces, norms, colors: As mesh_from_volume, faces index verts.
+  """
+  empty = (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64), np.zeros((0, 3), dtype=np.float32),
+           np.zeros((0, 3), dtype=color_chunk.dtype))
+  if min(tsdf_chunk.shape) < 2 or tsdf_chunk.min() > 0 or tsdf_chunk.max() < 0:
+    return empty
+  verts, faces, norms, vals = measure.marching_cubes_lewiner(tsdf_chunk, level=0)
+  # Rounded as the float32 coordinates of marching cubes on the whole volume
+  verts_ind = np.round(verts + vox_min.astype(np.float32)).astype(int) - vox_min
+  verts = verts.astype(np.float64) + vox_min
+
+  cells = np.floor(verts[faces].mean(axis=1))
+  faces = faces[np.all((cells >= cell_min) & (cells < cell_max), axis=1)]
+  if len(faces) == 0:
+    return empty
+  used, faces = np.unique(faces, return_inverse=True)
+  faces = faces.reshape(-1, 3)
+  verts_ind = verts_ind[used]
+  colors = color_chunk[verts_ind[:,0], verts_ind[:,1], verts_ind[:,2]]
+  return verts[used], faces, norms[used], colors
+
+
+def iter_mesh_chunks(read_chunk, chunk_coords, vol_dim, chunk_size, n_workers=None):
+  """Run mesh_chunk on chunks of a volume, n_workers processes at a time (in this
+  process if n_workers <= 1). The results are yielded in the order of chunk_coords.
+
+  Args:
+    read_chunk (callable): (vox_min, vox_max) -> TSDF and color volumes of the voxels
+      [vox_min, vox_max).
+  """
+  if n_workers is None:
+    n_workers = os.cpu_count()
+
+  def args(c):
+    vox_min = np.maximum(c * chunk_size - 1, 0)
+    vox_max = np.minimum((c + 1) * chunk_size + 2, vol_dim)
+    return read_chunk(vox_min, vox_max) + (vox_min, c * chunk_size, (c + 1) * chunk_size)
+
+  if n_workers <= 1:
+    for c in chunk_coords:
+      yield mesh_chunk(*args(c))
+    return
+
+  # The workers are not forked from this process, whose numba threads are not fork safe.
+  # Only a few chunks are read ahead, so that the volume is never copied as a whole
+  forkserver = multiprocessing.get_context("forkserver")
+  with concurrent.futures.ProcessPoolExecutor(n_workers, mp_context=forkserver) as executor:
+    futures = collections.deque()
+    for c in chunk_coords:
+      futures.append(executor.submit(mesh_chunk, *args(c)))
+      if len(futures) >= 2 * n_workers:
+        yield futures.popleft().result()
+    while futures:
+      yield futures.popleft().result()
+
+
+class MeshStitcher:
+  """Merge the meshes of the chunks of iter_mesh_chunks into a single mesh.
+
+  The vertices on the planes between chunks are shared by the meshes of the chunks on
+  both sides. Along the edge of such a vertex, these chunks start at the same voxel, so
+  marching cubes gives the same coordinates and they are merged on their coordinates.
+  """
+  def __init__(self, chunk_size):
+    self._chunk_size = chunk_size
+    self._shared = {}
+    self.n_verts = 0
+
+  def add(self, verts, faces):
+    """Global indices of a chunk mesh.
+
+    Returns:
+      Mask of the vertices not added by the previous chunks, faces with the global indices.
+    """
+    index = np.empty(len(verts), dtype=np.int64)
+    new = np.ones(len(verts), dtype=bool)
+    plane_rows = np.flatnonzero(np.any(verts % self._chunk_size == 0, axis=1))
+    plane_keys = list(map(tuple, verts[plane_rows].tolist()))
+    for row, key in zip(plane_rows.tolist(), plane_keys):
+      if key in self._shared:
+        index[row] = self._shared[key]
+        new[row] = False
+    index[new] = self.n_verts + np.arange(new.sum())
+    for row, key in zip(plane_rows.tolist(), plane_keys):
+      if new[row]:
+        self._shared[key] = index[row]
+    self.n_verts += int(new.sum())
+    return new, index[faces]
+
+
+def chunked_mesh(read_chunk, chunk_coords, vol_dim, chunk_size, voxel_size, vol_origin, n_workers=None):
+  """Mesh of the volume from marching cubes on the chunks chunk_coords, as mesh_from_volume.
+  """
+  stitcher = MeshStitcher(chunk_size)
+  meshes = []
+  for verts, faces, norms, colors in iter_mesh_chunks(read_chunk, chunk_coords, vol_dim, chunk_size, n_workers):
+    new, faces = stitcher.add(verts, faces)
+    meshes.append((verts[new], faces, norms[new], colors[new]))
+  if not meshes:
+    meshes.append(mesh_chunk(np.ones((2, 2, 2), dtype=np.float32), np.zeros((2, 2, 2, 3), dtype=np.uint8),
+                             np.zeros(3), 0, 0))
+  verts, faces, norms, colors = [np.concatenate(x) for x in zip(*meshes)]
+  verts = verts.astype(np.float32)*voxel_size+vol_origin  # voxel grid coordinates to world coordinates
+  return verts, faces.astype(np.int32), norms, colors
+
+
+def write_volume_mesh(filename, mesh, binary=True):
+  """Write a mesh of get_mesh with meshwrite.
+
+  Returns:
+    Number of vertices and faces.
+  """
+  meshwrite(filename, *mesh, binary=binary)
+  return len(mesh[0]), len(mesh[1])
+
+
+def write_chunked_mesh(filename, read_chunk, chunk_coords, vol_dim, chunk_size, voxel_size, vol_origin,
+                       n_workers=None, binary=True):
+  """Write the mesh of chunked_mesh to a .ply file as meshwrite, the chunks are written
+  as soon as they are extracted so the mesh is never in memory as a whole.
+
+  Returns:
+    Number of vertices and faces.
+  """
+  stitcher = MeshStitcher(chunk_size)
+  n_faces = 0
+  with tempfile.TemporaryFile() as verts_file, tempfile.TemporaryFile() as faces_file:
+    for verts, faces, norms, colors in iter_mesh_chunks(read_chunk, chunk_coords, vol_dim, chunk_size, n_workers):
+      new, faces = stitcher.add(verts, faces)
+      verts = verts[new].astype(np.float32)*voxel_size+vol_origin
+      vertex_records, face_records = mesh_records(verts, faces, norms[new], colors[new])
+      write_ply_records(verts_file, vertex_records, binary)
+      write_ply_records(faces_file, face_records, binary)
+      n_faces += len(faces)
+
+    with open(filename, 'wb') as ply_file:
+      write_ply_header(ply_file, [("vertex", PLY_MESH_VERTEX, stitcher.n_verts), ("face", PLY_FACE, n_faces)],
+                       binary)
+      for body in [verts_file, faces_file]:
+        body.seek(0)
+        shutil.copyfileobj(body, ply_file)
+  return stitcher.n_verts, n_faces
 
 
 def rigid_transform(xyz, transform):
@@ -387,6 +1126,113 @@ def rigid_transform(xyz, transform):
   return xyz_t_h[:, :3]
 
 
+def block_corners(block_coords, block_size, vol_dim, vol_origin, voxel_size):
+  """World coordinates of the corners of blocks of voxels, padded by half a voxel.
+
+  Args:
+    block_coords (ndarray): Block grid coordinates of shape (N, 3).
+
+  Returns:
+    ndarray of shape (N * 8, 3), the 8 corners of each block.
+  """
+  block_min = (block_coords * block_size)[:, None]
+  block_max = np.minimum(block_min + block_size - 1, vol_dim - 1)
+  offsets = np.stack(np.meshgrid([0, 1], [0, 1], [0, 1], indexing='ij'), axis=-1).reshape(1, 8, 3)
+  corners = np.where(offsets == 0, block_min - 0.5, block_max + 0.5)
+  return (vol_origin + corners * voxel_size).reshape(-1, 3)
+
+
+def blocks_outside_frustum(corners, depth_im, cam_intr, cam_pose, trunc_margin):
+  """Whether blocks of voxels are outside the view frustum of a depth image.
+
+  A block is outside when its 8 corners are on the outer side of one of the planes
+  of the frustum: behind the camera, beyond the largest depth plus the truncation
+  margin, or out of the image borders.
+
+  Args:
+    corners (ndarray): Corners of the blocks of shape (N * 8, 3), as returned by block_corners.
+
+  Returns:
+    Boolean ndarray of shape (N,).
+  """
+  max_depth = np.max(depth_im)
+  im_h, im_w = depth_im.shape
+  fx, fy = cam_intr[0, 0], cam_intr[1, 1]
+  cx, cy = cam_intr[0, 2], cam_intr[1, 2]
+
+  corners = rigid_transform(corners, np.linalg.inv(cam_pose)).reshape(-1, 8, 3)
+  x, y, z = corners[..., 0], corners[..., 1], corners[..., 2]
+  outside = (z <= 0).all(axis=1)
+  outside |= (z > max_depth + trunc_margin).all(axis=1)
+  # Pixel coordinates u = fx * x / z + cx of the integrated voxels are in [-0.5, im_w - 0.5]
+  outside |= (fx * x + (cx + 1) * z < 0).all(axis=1)
+  outside |= (fx * x + (cx - im_w) * z > 0).all(axis=1)
+  outside |= (fy * y + (cy + 1) * z < 0).all(axis=1)
+  outside |= (fy * y + (cy - im_h) * z > 0).all(axis=1)
+  return outside
+
+
+@njit(inline='always')
+def _block_origin(block_id, n_blocks, block_size):
+  """Voxel grid coordinates of the first voxel of a block, blocks are numbered in C order.
+  """
+  x0 = block_id // (n_blocks[1] * n_blocks[2]) * block_size
+  y0 = block_id // n_blocks[2] % n_blocks[1] * block_size
+  z0 = block_id % n_blocks[2] * block_size
+  return x0, y0, z0
+
+
+@njit(inline='always')
+def _integrate_voxel(x, y, z, tsdf, weight, block_frames, n, vol_origin, vox_size, cam_poses_inv,
+                     fx, fy, cx, cy, depth_ims, trunc_margin, obs_weight):
+  """Integrate the frames f with block_frames[n, f] True into the voxel (x, y, z), in order.
+
+  Same arithmetic as the NumPy steps of TSDFVolume.integrate.
+
+  Returns:
+    The new tsdf and weight of the voxel, whether a frame observed it, and the frame and
+    pixel (f, y, x) of its new color, f is -1 when the color is unchanged.
+  """
+  n_frames, im_h, im_w = depth_ims.shape
+  observed = False
+  color_f, color_y, color_x = -1, 0, 0
+  # Voxel grid coordinates to world coordinates, as in vox2world
+  pt_x = np.float32(vol_origin[0] + (vox_size * np.float32(x)))
+  pt_y = np.float32(vol_origin[1] + (vox_size * np.float32(y)))
+  pt_z = np.float32(vol_origin[2] + (vox_size * np.float32(z)))
+  for f in range(n_frames):
+    if not block_frames[n, f]:
+      continue
+    cam_pose_inv = cam_poses_inv[f]
+    cam_z = _transform_coord(cam_pose_inv, 2, pt_x, pt_y, pt_z)
+    if not cam_z > 0:
+      continue
+    cam_x = _transform_coord(cam_pose_inv, 0, pt_x, pt_y, pt_z)
+    cam_y = _transform_coord(cam_pose_inv, 1, pt_x, pt_y, pt_z)
+    pix_x = int(np.round((cam_x * fx / cam_z) + cx))
+    pix_y = int(np.round((cam_y * fy / cam_z) + cy))
+    if pix_x < 0 or pix_x >= im_w or pix_y < 0 or pix_y >= im_h:
+      continue
+    depth_val = np.float64(depth_ims[f, pix_y, pix_x])
+    depth_diff = depth_val - cam_z
+    if not (depth_val > 0 and depth_diff >= -trunc_margin):
+      continue
+    observed = True
+    weight = np.float32(weight + obs_weight)
+    # Keep the observation closest to the surface, with its color
+    if not abs(tsdf) < abs(depth_diff):
+      tsdf = np.float32(depth_diff)
+      color_f, color_y, color_x = f, pix_y, pix_x
+  return tsdf, weight, observed, color_f, color_y, color_x
+
+
+@njit
+def _transform_coord(transform, j, x, y, z):
+  """Coordinate j of the point (x, y, z) transformed by the (4, 4) transform, in a fixed order of operations.
+  """
+  return ((transform[j, 0] * x + transform[j, 1] * y) + transform[j, 2] * z) + transform[j, 3]
+
+
 def get_view_frustum(depth_im, cam_intr, cam_pose):
   """Get corners of 3D camera view frustum of depth image
   """
@@ -402,64 +1248,188 @@ def get_view_frustum(depth_im, cam_intr, cam_pose):
   return view_frust_pts
 
 
-def meshwrite(filename, verts, faces, norms, colors):
-  """Save a 3D mesh to a polygon .ply file.
+# Records of the .ply files of meshwrite and pcwrite
+PLY_MESH_VERTEX = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4'),
+                            ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+PLY_FACE = np.dtype([('n', 'u1'), ('vertex_index', '<i4', (3,))])
+PLY_POINT = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+
+PLY_TYPES = {'i1': 'char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort', 'i4': 'int', 'u4': 'uint',
+             'f4': 'float', 'f8': 'double'}
+PLY_TYPE_ALIASES = {'int8': 'char', 'uint8': 'uchar', 'int16': 'short', 'uint16': 'ushort', 'int32': 'int',
+                    'uint32': 'uint', 'float32': 'float', 'float64': 'double'}
+
+
+def meshwrite(filename, verts, faces, norms, colors, binary=True):
+  """Save a 3D mesh to a polygon .ply file, binary little endian or ASCII.
   """
-  # Write header
-  ply_file = open(filename,'w')
-  ply_file.write("ply\n")
-  ply_file.write("format ascii 1.0\n")
-  ply_file.write("element vertex %d\n"%(verts.shape[0]))
-  ply_file.write("property float x\n")
-  ply_file.write("property float y\n")
-  ply_file.write("property float z\n")
-  ply_file.write("property float nx\n")
-  ply_file.write("property float ny\n")
-  ply_file.write("property float nz\n")
-  ply_file.write("property uchar red\n")
-  ply_file.write("property uchar green\n")
-  ply_file.write("property uchar blue\n")
-  ply_file.write("element face %d\n"%(faces.shape[0]))
-  ply_file.write("property list uchar int vertex_index\n")
-  ply_file.write("end_header\n")
-
-  # Write vertex list
-  for i in range(verts.shape[0]):
-    ply_file.write("%f %f %f %f %f %f %d %d %d\n"%(
-      verts[i,0], verts[i,1], verts[i,2],
-      norms[i,0], norms[i,1], norms[i,2],
-      colors[i,0], colors[i,1], colors[i,2],
-    ))
-
-  # Write face list
-  for i in range(faces.shape[0]):
-    ply_file.write("3 %d %d %d\n"%(faces[i,0], faces[i,1], faces[i,2]))
-
-  ply_file.close()
-
-
-def pcwrite(filename, xyzrgb):
-  """Save a point cloud to a polygon .ply file.
+  vertex_records, face_records = mesh_records(verts, faces, norms, colors)
+  with open(filename, 'wb') as ply_file:
+    write_ply_header(ply_file, [("vertex", PLY_MESH_VERTEX, len(vertex_records)),
+                                ("face", PLY_FACE, len(face_records))], binary)
+    write_ply_records(ply_file, vertex_records, binary)
+    write_ply_records(ply_file, face_records, binary)
+
+
+def pcwrite(filename, xyzrgb, binary=True):
+  """Save a point cloud to a polygon .ply file, binary little endian or ASCII.
+  """
+  records = np.empty(len(xyzrgb), dtype=PLY_POINT)
+  for c, name in enumerate(['x', 'y', 'z']):
+    records[name] = xyzrgb[:, c]
+  for c, name in enumerate(['red', 'green', 'blue']):
+    records[name] = xyzrgb[:, 3 + c].astype(np.uint8)
+  with open(filename, 'wb') as ply_file:
+    write_ply_header(ply_file, [("vertex", PLY_POINT, len(records))], binary)
+    write_ply_records(ply_file, records, binary)
+
+
+def mesh_records(verts, faces, norms, colors):
+  """Vertex and face records of meshwrite.
+  """
+  vertex_records = np.empty(len(verts), dtype=PLY_MESH_VERTEX)
+  for c, name in enumerate(['x', 'y', 'z']):
+    vertex_records[name] = verts[:, c]
+  for c, name in enumerate(['nx', 'ny', 'nz']):
+    vertex_records[name] = norms[:, c]
+  for c, name in enumerate(['red', 'green', 'blue']):
+    vertex_records[name] = colors[:, c]
+  face_records = np.empty(len(faces), dtype=PLY_FACE)
+  face_records['n'] = 3
+  face_records['vertex_index'] = faces
+  return vertex_records, face_records
+
+
+def write_ply_header(ply_file, elements, binary=True):
+  """Write a .ply header to a file opened in binary mode.
+
+  Args:
+    elements (list): (name, dtype, count) of the elements. A field of shape (k,)
+      is a list property of length k, counted by the previous field.
+  """
+  lines = ["ply", "format {} 1.0".format("binary_little_endian" if binary else "ascii")]
+  for name, dtype, count in elements:
+    lines.append("element {} {}".format(name, count))
+    names = dtype.names
+    for f, field in enumerate(names):
+      field_dtype = dtype.fields[field][0]
+      if f + 1 < len(names) and dtype.fields[names[f + 1]][0].shape:
+        continue
+      if field_dtype.shape:
+        lines.append("property list {} {} {}".format(
+          PLY_TYPES[dtype.fields[names[f - 1]][0].str[1:]], PLY_TYPES[field_dtype.base.str[1:]], field))
+      else:
+        lines.append("property {} {}".format(PLY_TYPES[field_dtype.str[1:]], field))
+  lines.append("end_header")
+  ply_file.write(("\n".join(lines) + "\n").encode())
+
+
+def write_ply_records(ply_file, records, binary=True):
+  """Append the records of an element to a .ply file opened in binary mode.
+  """
+  if binary:
+    records.tofile(ply_file)
+    return
+  if len(records) == 0:
+    return
+  columns, fmt = [], []
+  for field in records.dtype.names:
+    values = records[field].reshape(len(records), -1)
+    columns.append(values)
+    fmt += ["%f" if values.dtype.kind == 'f' else "%d"] * values.shape[1]
+  np.savetxt(ply_file, np.hstack(columns), fmt=" ".join(fmt))
+
+
+def read_ply(filename):
+  """Read the elements of a .ply file, binary or ASCII. The lists of an element should
+  all have the same length, as the faces of meshwrite.
+
+  Returns:
+    Dict of element name to record array, a list property is a field of shape (k,).
+  """
+  with open(filename, 'rb') as ply_file:
+    assert ply_file.readline().strip() == b"ply", "[!] {} is not a .ply file.".format(filename)
+    elements = []
+    while True:
+      words = ply_file.readline().decode().split()
+      if not words or words[0] in ("comment", "obj_info"):
+        continue
+      if words[0] == "end_header":
+        break
+      if words[0] == "format":
+        fmt = words[1]
+      elif words[0] == "element":
+        elements.append((words[1], int(words[2]), []))
+      elif words[0] == "property":
+        elements[-1][2].append(words[1:])
+
+    byte_order = '>' if fmt == "binary_big_endian" else '<'
+
+    def ply_dtype(ply_type):
+      ply_type = PLY_TYPE_ALIASES.get(ply_type, ply_type)
+      return np.dtype(byte_order + next(k for k, v in PLY_TYPES.items() if v == ply_type))
+
+    data = {}
+    for name, count, properties in elements:
+      if fmt == "ascii":
+        rows = np.loadtxt(ply_file, max_rows=count, ndmin=2) if count else np.zeros((0, 0))
+      fields, column, offset = [], 0, 0
+      for prop in properties:
+        if prop[0] != "list":
+          fields.append((prop[1], ply_dtype(prop[0])))
+          column, offset = column + 1, offset + fields[-1][1].itemsize
+          continue
+        # Length of the list in the first record
+        count_dtype, item_dtype = ply_dtype(prop[1]), ply_dtype(prop[2])
+        if count == 0:
+          length = 0
+        elif fmt == "ascii":
+          length = int(rows[0, column])
+        else:
+          start = ply_file.tell()
+          length = int(np.frombuffer(ply_file.read(offset + count_dtype.itemsize)[offset:], dtype=count_dtype)[0])
+          ply_file.seek(start)
+        fields.append((prop[3] + "_count", count_dtype))
+        fields.append((prop[3], item_dtype, (length,)))
+        column, offset = column + 1 + length, offset + count_dtype.itemsize + length * item_dtype.itemsize
+
+      if fmt == "ascii":
+        records = np.empty(count, dtype=fields)
+        column = 0
+        for field in fields:
+          n = field[2][0] if len(field) == 3 else 1
+          records[field[0]] = rows[:, column:column + n].reshape(records[field[0]].shape)
+          column += n
+      else:
+        records = np.fromfile(ply_file, dtype=fields, count=count)
+      for field in fields:
+        if len(field) == 3:
+          assert np.all(records[field[0] + "_count"] == field[2][0]), \
+            "[!] the lists {} of {} have different lengths.".format(field[0], filename)
+      data[name] = records[[field[0] for field in fields if not field[0].endswith("_count")]]
+  return data
+
+
+def meshread(filename):
+  """Read a mesh of meshwrite.
+
+  Returns:
+    verts, faces, norms, colors: As TSDFVolume.get_mesh.
+  """
+  data = read_ply(filename)
+  vertex = data["vertex"]
+  verts = np.stack([vertex[c] for c in ['x', 'y', 'z']], axis=-1).astype(np.float32)
+  norms = np.stack([vertex[c] for c in ['nx', 'ny', 'nz']], axis=-1).astype(np.float32)
+  colors = np.stack([vertex[c] for c in ['red', 'green', 'blue']], axis=-1).astype(np.uint8)
+  faces = data["face"]["vertex_index"].astype(np.int32).reshape(-1, 3)
+  return verts, faces, norms, colors
+
+
+def pcread(filename):
+  """Read a point cloud of pcwrite.
+
+  Returns:
+    An (N, 6) array of the xyz coordinates and RGB colors.
   """
-  xyz = xyzrgb[:, :3]
-  rgb = xyzrgb[:, 3:].astype(np.uint8)
-
-  # Write header
-  ply_file = open(filename,'w')
-  ply_file.write("ply\n")
-  ply_file.write("format ascii 1.0\n")
-  ply_file.write("element vertex %d\n"%(xyz.shape[0]))
-  ply_file.write("property float x\n")
-  ply_file.write("property float y\n")
-  ply_file.write("property float z\n")
-  ply_file.write("property uchar red\n")
-  ply_file.write("property uchar green\n")
-  ply_file.write("property uchar blue\n")
-  ply_file.write("end_header\n")
-
-  # Write vertex list
-  for i in range(xyz.shape[0]):
-    ply_file.write("%f %f %f %d %d %d\n"%(
-      xyz[i, 0], xyz[i, 1], xyz[i, 2],
-      rgb[i, 0], rgb[i, 1], rgb[i, 2],
-    ))
+  vertex = read_ply(filename)["vertex"]
+  return np.stack([vertex[c].astype(np.float32) for c in ['x', 'y', 'z', 'red', 'green', 'blue']], axis=-1)
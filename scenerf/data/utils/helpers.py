@@ -190,3 +190,29 @@ def vox2pix(cam_E, cam_K,
 
 
     return projected_pix, fov_mask, sensor_distance
+
+
+_vox2pix_cache = {}
+
+
+def vox2pix_cached(cam_E, cam_K,
+                   vox_origin, voxel_size,
+                   img_W, img_H,
+                   scene_size):
+    """
+    Same as vox2pix, memoized per process on the calibration and the voxel grid.
+    The returned arrays are shared between the callers and read-only.
+    """
+    key = (
+        np.asarray(cam_E, dtype=np.float64).tobytes(),
+        np.asarray(cam_K, dtype=np.float64).tobytes(),
+        np.asarray(vox_origin, dtype=np.float64).tobytes(),
+        float(voxel_size), int(img_W), int(img_H),
+        tuple(float(x) for x in scene_size),
+    )
+    if key not in _vox2pix_cache:
+        out = vox2pix(cam_E, cam_K, vox_origin, voxel_size, img_W, img_H, scene_size)
+        for arr in out:
+            arr.setflags(write=False)
+        _vox2pix_cache[key] = out
+    return _vox2pix_cache[key]
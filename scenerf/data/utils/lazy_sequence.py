@@ -0,0 +1,68 @@
+class LazySequence:
+    """Read-only sequence whose items are loaded on access.
+
+    Used by the evaluation datasets to return lightweight per-source handles
+    instead of decoding every image / depth map of a window in __getitem__.
+    Only the last loaded item is kept, so iterating over the sources keeps
+    the host memory constant whatever the window size.
+
+    The loader and its arguments are pickled with the sequence when it is
+    sent back from a dataloader worker, so they should be module level
+    functions and small arguments (paths, matrices).
+
+    Args:
+        loader: function called as loader(*args[i]) to load the i-th item.
+        args: list of argument tuples, one per item.
+    """
+
+    def __init__(self, loader, args):
+        self.loader = loader
+        self.args = list(args)
+        self._cached_index = None
+        self._cached_item = None
+
+    def __len__(self):
+        return len(self.args)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("LazySequence index out of range")
+        if index != self._cached_index:
+            self._cached_item = self.loader(*self.args[index])
+            self._cached_index = index
+        return self._cached_item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def map(self, fn):
+        """Lazy view applying fn to each item, sharing the loaded item cache.
+        e.g. the lidar points and depths computed from the same scan.
+        """
+        return MappedLazySequence(self, fn)
+
+    def __getstate__(self):
+        # Never ship the loaded item between processes
+        state = self.__dict__.copy()
+        state["_cached_index"] = None
+        state["_cached_item"] = None
+        return state
+
+
+class MappedLazySequence:
+    def __init__(self, parent, fn):
+        self.parent = parent
+        self.fn = fn
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __getitem__(self, index):
+        return self.fn(self.parent[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
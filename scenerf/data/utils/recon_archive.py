@@ -0,0 +1,158 @@
+import os
+import pickle
+import struct
+import zipfile
+
+import numpy as np
+
+
+RECON_MANIFEST_NAME = "manifest.txt"
+
+
+def recon_archive_path(save_dir, frame_id):
+    return os.path.join(save_dir, "{}.npz".format(frame_id))
+
+
+def legacy_pickle_path(save_dir, frame_id):
+    """Path of the per frame pickles written by the previous versions of the reconstruction scripts"""
+    return os.path.join(save_dir, "{}.pkl".format(frame_id))
+
+
+def recon_exists(save_dir, frame_id):
+    return os.path.exists(recon_archive_path(save_dir, frame_id)) or \
+        os.path.exists(legacy_pickle_path(save_dir, frame_id))
+
+
+def save_arrays(path, arrays, stored=(), compresslevel=1):
+    """
+    Write arrays into a .npz archive readable by np.load, one member per array.
+    The members are deflated, except the ones in stored which can then be memory mapped
+    by ArrayArchive.mmap. The archive is written to a temporary file and renamed.
+    arrays: dict of name to array
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".{}.tmp".format(os.getpid())
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+            for name, array in arrays.items():
+                member = "{}.npy".format(name)
+                if name in stored:
+                    member = zipfile.ZipInfo(member, date_time=(1980, 1, 1, 0, 0, 0))
+                    member.compress_type = zipfile.ZIP_STORED
+                with archive.open(member, "w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+    except BaseException:
+        # e.g. object arrays, which are not written without pickle
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+class ArrayArchive:
+    """
+    Read-only access to an archive of save_arrays. Only the index of the archive is read
+    on opening, each array is read (and decompressed) on access, the stored ones can be
+    memory mapped instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self._infos = {os.path.splitext(info.filename)[0]: info for info in self._zip.infolist()}
+
+    @property
+    def files(self):
+        return list(self._infos)
+
+    def __contains__(self, name):
+        return name in self._infos
+
+    def __getitem__(self, name):
+        with self._zip.open(self._infos[name]) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def is_stored(self, name):
+        return self._infos[name].compress_type == zipfile.ZIP_STORED
+
+    def mmap(self, name):
+        """
+        return
+        read-only memory map of a stored array
+        """
+        info = self._infos[name]
+        if not self.is_stored(name):
+            raise ValueError("{} is compressed in {}, it can only be read".format(name, self.path))
+        with open(self.path, "rb") as f:
+            # The local header has its own extra field, of a length which may differ from the index
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                         order="F" if fortran_order else "C")
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def save_recon_arrays(save_dir, frame_id, arrays, stored=("tsdf_grid",)):
+    """
+    Write the reconstruction of a frame, the grids read whole by the evaluation are stored
+    uncompressed to be memory mapped
+    """
+    path = recon_archive_path(save_dir, frame_id)
+    save_arrays(path, arrays, stored=stored)
+    return path
+
+
+def load_recon_arrays(save_dir, frame_id, names, mmap=False):
+    """
+    Arrays of the reconstruction of a frame, from its archive or from its legacy pickle
+    (see migrate_recon_pickles.py)
+    mmap: memory map the arrays stored uncompressed in the archive
+    ------
+    return
+    list of the arrays of names
+    """
+    path = recon_archive_path(save_dir, frame_id)
+    if os.path.exists(path):
+        with ArrayArchive(path) as archive:
+            return [archive.mmap(name) if mmap and archive.is_stored(name) else archive[name] for name in names]
+    with open(legacy_pickle_path(save_dir, frame_id), "rb") as f:
+        data = pickle.load(f)
+    return [data[name] for name in names]
+
+
+def recon_manifest_path(save_dir):
+    """Path of the list of the frames completed by a reconstruction script, one "sequence frame_id" per line"""
+    return os.path.join(save_dir, RECON_MANIFEST_NAME)
+
+
+def read_recon_manifest(save_dir):
+    """
+    return
+    set of the (sequence, frame_id) in the manifest of save_dir
+    """
+    path = recon_manifest_path(save_dir)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        # A line cut by an interrupted run has a single field
+        return {tuple(fields) for fields in (line.split() for line in f) if len(fields) == 2}
+
+
+def append_recon_manifest(manifest_file, sequence, frame_id):
+    """Record a frame whose archive is written, the manifest is appended by a single process"""
+    manifest_file.write("{} {}\n".format(sequence, frame_id))
+    manifest_file.flush()
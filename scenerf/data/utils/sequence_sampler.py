@@ -0,0 +1,86 @@
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data.distributed import DistributedSampler
+
+
+class SequenceShardSampler(DistributedSampler):
+    """
+    Distributed sampler giving each rank the contiguous frames of a few sequences, so that the
+    page cache of its node is reused. The items, ordered by the (sequence, frame) keys, are cut
+    into num_replicas shards which are shuffled within. The order of the sequences and the cuts
+    are drawn again at each epoch from seed, unless reshuffle_shards is False.
+    Lightning keeps it under DDP and calls its set_epoch, outside of a process group it is a
+    single replica.
+    """
+
+    def __init__(self, dataset, keys, num_replicas=None, rank=None, shuffle=True, seed=0,
+                 reshuffle_shards=True):
+        if num_replicas is None and not (dist.is_available() and dist.is_initialized()):
+            num_replicas, rank = 1, 0
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed)
+        assert len(keys) == len(dataset)
+        self.reshuffle_shards = reshuffle_shards
+
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        self.sequence_indices = []
+        for i in order:
+            if len(self.sequence_indices) == 0 or keys[i][0] != keys[self.sequence_indices[-1][-1]][0]:
+                self.sequence_indices.append([])
+            self.sequence_indices[-1].append(i)
+
+    def shard(self, epoch):
+        """
+        return
+        indices of the items of this rank at epoch, in (sequence, frame) order
+        """
+        rng = np.random.RandomState(self.seed + (epoch if self.reshuffle_shards else 0))
+        sequence_order = np.arange(len(self.sequence_indices))
+        if self.shuffle:
+            sequence_order = rng.permutation(sequence_order)
+        indices = np.concatenate([self.sequence_indices[i] for i in sequence_order]).astype(np.int64)
+        if self.shuffle:
+            indices = np.roll(indices, rng.randint(len(indices)))
+
+        # Pad by repeating the first items, so that all the ranks do the same number of steps
+        indices = np.resize(indices, self.total_size)
+        return indices[self.rank * self.num_samples:(self.rank + 1) * self.num_samples]
+
+    def __iter__(self):
+        indices = self.shard(self.epoch)
+        if self.shuffle:
+            indices = np.random.RandomState([self.seed, self.epoch, self.rank]).permutation(indices)
+        return iter(indices.tolist())
+
+
+def _check_worker(rank, world_size, keys, port):
+    """Shards seen by each rank of a gloo process group"""
+    import torch
+    dist.init_process_group("gloo", init_method="tcp://127.0.0.1:{}".format(port),
+                            rank=rank, world_size=world_size)
+    sampler = SequenceShardSampler(list(range(len(keys))), keys, seed=0)
+    out = []
+    for epoch in range(2):
+        sampler.set_epoch(epoch)
+        indices = torch.tensor(list(sampler))
+        gathered = [torch.zeros_like(indices) for _ in range(world_size)]
+        dist.all_gather(gathered, indices)
+        out.append([g.tolist() for g in gathered])
+    if rank == 0:
+        for epoch, shards in enumerate(out):
+            seen = sorted(set(i for shard in shards for i in shard))
+            assert seen == list(range(len(keys))), "every item is sampled"
+            assert len(set(len(shard) for shard in shards)) == 1, "same number of steps on every rank"
+            for r, shard in enumerate(shards):
+                sequences = sorted(set(keys[i][0] for i in shard))
+                print("epoch {} rank {}: {} items of sequences {}".format(epoch, r, len(shard), sequences))
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    # Local check with the gloo backend and CPU processes
+    import torch.multiprocessing as mp
+
+    world_size = 4
+    keys = [(sequence, frame) for sequence, n in zip(["00", "01", "02", "05", "08"], [50, 30, 80, 20, 45])
+            for frame in range(n)]
+    mp.spawn(_check_worker, args=(world_size, keys, 29533), nprocs=world_size)
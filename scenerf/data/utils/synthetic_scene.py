@@ -0,0 +1,388 @@
+"""
+Procedural scenes made of axis aligned boxes, rendered by ray casting and written
+in the BundleFusion and SemanticKITTI layouts, so that the loaders, renderers,
+TSDF fusion and evaluation can be run and timed without the real datasets.
+"""
+import os
+
+import numpy as np
+from numba import njit, prange
+from PIL import Image
+
+from scenerf.data.semantic_kitti.io_data import pack
+
+
+BF_SCENES = ["apt0", "apt1", "apt2", "office0", "office1", "office2", "office3", "copyroom"]
+# Raw SemanticKITTI ids, remapped by semantic-kitti.yaml
+KITTI_LABELS = {"car": 10, "road": 40, "sidewalk": 48, "building": 50, "vegetation": 70}
+# Velodyne to cam0 of KITTI sequence 00, rounded
+KITTI_TR = np.array([
+    [0, -1, 0, 0],
+    [0, 0, -1, -0.08],
+    [1, 0, 0, -0.27],
+    [0, 0, 0, 1],
+], dtype=np.float64)
+
+
+@njit(parallel=True)
+def _cast_boxes(origins, dirs, lo, hi, inside, t, box_id, normals):
+    for i in prange(origins.shape[0]):
+        for b in range(lo.shape[0]):
+            t_enter, t_exit = -np.inf, np.inf
+            axis_enter, axis_exit = 0, 0
+            for k in range(3):
+                if dirs[i, k] == 0:
+                    if origins[i, k] < lo[b, k] or origins[i, k] > hi[b, k]:
+                        t_enter = np.inf
+                    continue
+                t1 = (lo[b, k] - origins[i, k]) / dirs[i, k]
+                t2 = (hi[b, k] - origins[i, k]) / dirs[i, k]
+                if t1 > t2:
+                    t1, t2 = t2, t1
+                if t1 > t_enter:
+                    t_enter, axis_enter = t1, k
+                if t2 < t_exit:
+                    t_exit, axis_exit = t2, k
+            if t_enter > t_exit:
+                continue
+            # Entering the box from the outside, leaving it from the inside
+            if inside[b]:
+                t_hit, axis = t_exit, axis_exit
+            else:
+                t_hit, axis = t_enter, axis_enter
+            if t_hit > 1e-6 and t_hit < t[i]:
+                t[i] = t_hit
+                box_id[i] = b
+                normals[i, 0] = 0
+                normals[i, 1] = 0
+                normals[i, 2] = 0
+                normals[i, axis] = -1.0 if dirs[i, axis] > 0 else 1.0
+
+
+class BoxScene:
+    """
+    Axis aligned boxes in world coordinates.
+    A box flagged inside is seen from the inside (the walls of a room), the others from the outside.
+    """
+
+    def __init__(self):
+        self.lo = []
+        self.hi = []
+        self.colors = []
+        self.labels = []
+        self.inside = []
+
+    def add_box(self, lo, hi, color, label=0, inside=False):
+        self.lo.append(lo)
+        self.hi.append(hi)
+        self.colors.append(color)
+        self.labels.append(label)
+        self.inside.append(inside)
+
+    def arrays(self):
+        return (np.array(self.lo, dtype=np.float64), np.array(self.hi, dtype=np.float64),
+                np.array(self.colors, dtype=np.float64), np.array(self.labels, dtype=np.int64),
+                np.array(self.inside, dtype=bool))
+
+    def cast(self, origins, dirs):
+        """
+        First intersection of the rays with the boxes, by the slab method
+        origins: (N, 3)
+        dirs: (N, 3), not necessarily normalized
+        ------
+        return
+        t: (N,) ray parameter of the hit, inf when nothing is hit
+        box_id: (N,) index of the box hit, -1 when nothing is hit
+        normals: (N, 3) unit normal of the surface hit, facing the ray
+        """
+        lo, hi, _, _, inside = self.arrays()
+        n_rays = origins.shape[0]
+        t = np.full(n_rays, np.inf)
+        box_id = np.full(n_rays, -1, dtype=np.int64)
+        normals = np.zeros((n_rays, 3))
+        _cast_boxes(np.ascontiguousarray(origins, dtype=np.float64), np.ascontiguousarray(dirs, dtype=np.float64),
+                    lo, hi, inside, t, box_id, normals)
+        return t, box_id, normals
+
+    def labels_at(self, pts):
+        """
+        Label of the first box containing each point, 0 outside the boxes. The inside boxes are ignored.
+        pts: (N, 3)
+        ------
+        return
+        (N,) int64
+        """
+        lo, hi, _, labels, inside = self.arrays()
+        out = np.zeros(pts.shape[0], dtype=np.int64)
+        for i in reversed(range(lo.shape[0])):
+            if inside[i]:
+                continue
+            in_box = np.ones(pts.shape[0], dtype=bool)
+            for axis in range(3):
+                in_box &= (pts[:, axis] >= lo[i, axis]) & (pts[:, axis] < hi[i, axis])
+            out[in_box] = labels[i]
+        return out
+
+    def shade(self, origins, dirs, t, box_id, normals, background=(0.6, 0.75, 0.9), checker_size=0.25):
+        """
+        Lambertian color of the hits with a checkerboard texture, so that the photometric losses have gradients
+        ------
+        return
+        (N, 3) float in [0, 1]
+        """
+        _, _, colors, _, _ = self.arrays()
+        found = box_id >= 0
+        pts = origins[found] + dirs[found] * t[found, None]
+        checker = np.floor(pts / checker_size + 1e-4).astype(np.int64).sum(-1) % 2
+        light = np.array([0.3, -0.8, 0.5]) / np.linalg.norm([0.3, -0.8, 0.5])
+        lambert = 0.55 + 0.45 * np.abs(normals[found] @ light)
+
+        rgb = np.tile(np.array(background, dtype=np.float64), (t.shape[0], 1))
+        rgb[found] = colors[box_id[found]] * lambert[:, None] * (0.7 + 0.3 * checker[:, None])
+        return np.clip(rgb, 0, 1)
+
+
+def look_at(eye, target, up=(0, 1, 0)):
+    """
+    Camera to world pose of a camera at eye looking at target (x right, y down, z forward)
+    ------
+    return
+    (4, 4)
+    """
+    z = np.asarray(target, dtype=np.float64) - eye
+    z /= np.linalg.norm(z)
+    x = np.cross(z, up)
+    x /= np.linalg.norm(x)
+    y = np.cross(z, x)
+    pose = np.eye(4)
+    pose[:3, 0], pose[:3, 1], pose[:3, 2], pose[:3, 3] = x, y, z, eye
+    return pose
+
+
+def camera_rays(cam_K, width, height, pose):
+    """
+    Rays through the pixel centers, the ray parameter of a hit is its depth along the optical axis
+    ------
+    return
+    origins: (H * W, 3)
+    dirs: (H * W, 3)
+    """
+    u, v = np.meshgrid(np.arange(width), np.arange(height))
+    pix = np.stack([u.reshape(-1), v.reshape(-1), np.ones(width * height)], axis=1)
+    dirs_cam = pix @ np.linalg.inv(cam_K).T
+    dirs = dirs_cam @ pose[:3, :3].T
+    origins = np.tile(pose[:3, 3], (dirs.shape[0], 1))
+    return origins, dirs
+
+
+def render(scene, cam_K, width, height, pose):
+    """
+    return
+    rgb: (H, W, 3) uint8
+    depth: (H, W) float, 0 where nothing is hit
+    """
+    origins, dirs = camera_rays(cam_K, width, height, pose)
+    t, box_id, normals = scene.cast(origins, dirs)
+    rgb = scene.shade(origins, dirs, t, box_id, normals)
+    depth = np.where(box_id >= 0, t, 0)
+    return (rgb.reshape(height, width, 3) * 255).round().astype(np.uint8), depth.reshape(height, width)
+
+
+# ==== BundleFusion layout ====
+
+def random_room(rng, room_size=(6.0, 3.0, 6.0), n_boxes=8):
+    """Room centered on the origin with the floor at y = 0, furniture boxes on the floor"""
+    w, h, d = room_size
+    scene = BoxScene()
+    scene.add_box([-w / 2, 0, -d / 2], [w / 2, h, d / 2], rng.uniform(0.5, 0.9, 3), inside=True)
+    for _ in range(n_boxes):
+        # Keep the boxes off the ellipse followed by the camera in room_trajectory
+        while True:
+            size = rng.uniform([0.3, 0.3, 0.3], [1.2, 1.5, 1.2])
+            center = rng.uniform([-w / 2 + 0.6, 0, -d / 2 + 0.6], [w / 2 - 0.6, 0, d / 2 - 0.6])
+            radius = np.sqrt((center[0] / (0.3 * w)) ** 2 + (center[2] / (0.3 * d)) ** 2)
+            if abs(radius - 1) * 0.3 * min(w, d) > np.linalg.norm(size[[0, 2]]) / 2 + 0.3:
+                break
+        scene.add_box(center - size * [0.5, 0, 0.5], center + size * [0.5, 1, 0.5], rng.uniform(0.1, 1.0, 3))
+    return scene
+
+
+def room_trajectory(n_frames, room_size=(6.0, 3.0, 6.0), n_turns=1.0):
+    """Camera to world poses going around the room while looking at its center"""
+    w, _, d = room_size
+    poses = []
+    for i in range(n_frames):
+        angle = 2 * np.pi * n_turns * i / n_frames
+        eye = np.array([0.3 * w * np.cos(angle), 1.4 + 0.1 * np.sin(3 * angle), 0.3 * d * np.sin(angle)])
+        target = np.array([0.3 * np.cos(2 * angle), 0.8, 0.3 * np.sin(2 * angle)])
+        poses.append(look_at(eye, target))
+    return poses
+
+
+def write_info_txt(scene_dir, cam_K, width, height, depth_shift=1000):
+    intrinsic = np.eye(4)
+    intrinsic[:3, :3] = cam_K
+    intrinsic = " ".join("{:g}".format(x) for x in intrinsic.reshape(-1))
+    with open(os.path.join(scene_dir, "info.txt"), "w") as f:
+        f.write("m_versionNumber = 4\n")
+        f.write("m_sensorName = Synthetic\n")
+        f.write("m_colorWidth = {}\n".format(width))
+        f.write("m_colorHeight = {}\n".format(height))
+        f.write("m_depthWidth = {}\n".format(width))
+        f.write("m_depthHeight = {}\n".format(height))
+        f.write("m_depthShift = {}\n".format(depth_shift))
+        f.write("m_calibrationColorIntrinsic = {}\n".format(intrinsic))
+        f.write("m_calibrationColorExtrinsic = 1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1\n")
+        f.write("m_calibrationDepthIntrinsic = {}\n".format(intrinsic))
+        f.write("m_calibrationDepthExtrinsic = 1 0 0 0 0 1 0 0 0 0 1 0 0 0 0 1\n")
+
+
+def write_bundlefusion_scene(scene_dir, n_frames=100, width=640, height=480,
+                             room_size=(6.0, 3.0, 6.0), n_boxes=8, seed=0):
+    """
+    Write a synthetic room as read by BundlefusionDataset: frame-XXXXXX.color.jpg,
+    frame-XXXXXX.depth.png (uint16, millimeters), frame-XXXXXX.pose.txt (camera to world) and info.txt
+    """
+    os.makedirs(scene_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    scene = random_room(rng, room_size, n_boxes)
+    cam_K = np.array([
+        [585.0 * width / 640, 0, (width - 1) / 2],
+        [0, 585.0 * width / 640, (height - 1) / 2],
+        [0, 0, 1],
+    ])
+    write_info_txt(scene_dir, cam_K, width, height)
+
+    for i, pose in enumerate(room_trajectory(n_frames, room_size)):
+        rgb, depth = render(scene, cam_K, width, height, pose)
+        prefix = os.path.join(scene_dir, "frame-{:06d}".format(i))
+        Image.fromarray(rgb).save(prefix + ".color.jpg", "JPEG", quality=95)
+        depth_mm = np.clip(depth * 1000, 0, np.iinfo(np.uint16).max).round().astype(np.uint16)
+        Image.fromarray(depth_mm).save(prefix + ".depth.png")
+        np.savetxt(prefix + ".pose.txt", pose, fmt="%.6f")
+    return n_frames
+
+
+# ==== SemanticKITTI layout ====
+
+def random_street(rng, length, road_width=8.0, n_cars=None):
+    """
+    Straight street along z in the cam0 frame of the first frame (x right, y down),
+    ground at y = 1.65, buildings on both sides and parked cars
+    """
+    ground_y = 1.65
+    scene = BoxScene()
+    scene.add_box([-road_width / 2, ground_y, -20], [road_width / 2, ground_y + 0.4, length],
+                  [0.35, 0.35, 0.38], KITTI_LABELS["road"])
+    for side in (-1, 1):
+        x_in, x_out = side * road_width / 2, side * (road_width / 2 + 3)
+        scene.add_box([min(x_in, x_out), ground_y - 0.15, -20], [max(x_in, x_out), ground_y + 0.4, length],
+                      [0.6, 0.6, 0.55], KITTI_LABELS["sidewalk"])
+        z = -20
+        while z < length:
+            size = rng.uniform([6, 5, 8], [12, 15, 25])
+            x0 = side * (road_width / 2 + 3 + rng.uniform(0, 3))
+            x1 = x0 + side * size[0]
+            label = "vegetation" if rng.rand() < 0.25 else "building"
+            color = [0.2, 0.5, 0.2] if label == "vegetation" else rng.uniform(0.3, 0.9, 3)
+            scene.add_box([min(x0, x1), ground_y - size[1], z], [max(x0, x1), ground_y, z + size[2]],
+                          color, KITTI_LABELS[label])
+            z += size[2] + rng.uniform(1, 6)
+
+    if n_cars is None:
+        n_cars = int(length / 15)
+    for _ in range(n_cars):
+        x = rng.choice([-1, 1]) * (road_width / 2 - 1.2)
+        z = rng.uniform(0, length)
+        scene.add_box([x - 0.9, ground_y - 1.5, z], [x + 0.9, ground_y, z + 4.2],
+                      rng.uniform(0.1, 1.0, 3), KITTI_LABELS["car"])
+    return scene
+
+
+def street_trajectory(n_frames, speed=1.0):
+    """cam0 to world poses driving along the street, with gentle turns"""
+    poses = []
+    for i in range(n_frames):
+        z = speed * i
+        yaw = 0.05 * np.sin(z / 15)
+        pose = np.eye(4)
+        pose[:3, :3] = [[np.cos(yaw), 0, np.sin(yaw)], [0, 1, 0], [-np.sin(yaw), 0, np.cos(yaw)]]
+        pose[:3, 3] = [0.8 * np.sin(z / 20), 0, z]
+        poses.append(pose)
+    return poses
+
+
+def lidar_dirs(n_beams=64, n_azimuth=1024):
+    """Unit directions of a Velodyne HDL-64 like scan in the velodyne frame (x forward, y left, z up)"""
+    elevation = np.deg2rad(np.linspace(2.0, -24.8, n_beams))
+    azimuth = np.linspace(-np.pi, np.pi, n_azimuth, endpoint=False)
+    elevation, azimuth = np.meshgrid(elevation, azimuth, indexing="ij")
+    return np.stack([
+        np.cos(elevation) * np.cos(azimuth),
+        np.cos(elevation) * np.sin(azimuth),
+        np.sin(elevation),
+    ], axis=-1).reshape(-1, 3)
+
+
+def voxel_centers():
+    """Centers of the 256x256x32 SemanticKITTI voxels in the velodyne frame, in the label file order"""
+    x = 0.1 + 0.2 * np.arange(256)
+    y = -25.6 + 0.1 + 0.2 * np.arange(256)
+    z = -2.0 + 0.1 + 0.2 * np.arange(32)
+    x, y, z = np.meshgrid(x, y, z, indexing="ij")
+    return np.stack([x, y, z], axis=-1).reshape(-1, 3)
+
+
+def write_kitti_sequence(root, sequence, n_frames=100, image_size=(1241, 376), n_beams=64,
+                         n_azimuth=1024, max_range=80.0, voxels_every=5, seed=0):
+    """
+    Write a synthetic street as read by KittiDataset: dataset/poses/<sequence>.txt and
+    dataset/sequences/<sequence>/{calib.txt, image_2, velodyne, voxels}.
+    The voxels (.bin, .label, .invalid) are written every voxels_every frames, as in SemanticKITTI
+    """
+    rng = np.random.RandomState(seed)
+    seq_dir = os.path.join(root, "dataset", "sequences", sequence)
+    for subdir in ("image_2", "velodyne", "voxels"):
+        os.makedirs(os.path.join(seq_dir, subdir), exist_ok=True)
+    os.makedirs(os.path.join(root, "dataset", "poses"), exist_ok=True)
+
+    width, height = image_size
+    fx = 718.856 * width / 1241
+    cam_K = np.array([[fx, 0, width / 2], [0, fx, height / 2], [0, 0, 1]])
+    P2 = np.concatenate([cam_K, [[0.06 * fx], [0], [0]]], axis=1)
+    P0 = np.concatenate([cam_K, np.zeros((3, 1))], axis=1)
+    with open(os.path.join(seq_dir, "calib.txt"), "w") as f:
+        for key, P in (("P0", P0), ("P1", P0), ("P2", P2), ("P3", P2)):
+            f.write("{}: {}\n".format(key, " ".join("{:.12e}".format(x) for x in P.reshape(-1))))
+        f.write("Tr: {}\n".format(" ".join("{:.12e}".format(x) for x in KITTI_TR[:3].reshape(-1))))
+
+    poses = street_trajectory(n_frames)
+    scene = random_street(rng, length=n_frames * 1.0 + 80)
+    with open(os.path.join(root, "dataset", "poses", sequence + ".txt"), "w") as f:
+        for pose in poses:
+            f.write(" ".join("{:.12e}".format(x) for x in pose[:3].reshape(-1)) + "\n")
+
+    T_cam2_2_cam0 = np.eye(4)
+    T_cam2_2_cam0[0, 3] = -P2[0, 3] / P2[0, 0]
+    dirs_velo = lidar_dirs(n_beams, n_azimuth)
+    centers_velo = np.concatenate([voxel_centers(), np.ones((256 * 256 * 32, 1))], axis=1)
+
+    for i, pose in enumerate(poses):
+        frame_id = "{:06d}".format(i)
+        rgb, _ = render(scene, cam_K, width, height, pose @ T_cam2_2_cam0)
+        Image.fromarray(rgb).save(os.path.join(seq_dir, "image_2", frame_id + ".png"))
+
+        T_velo_2_world = pose @ KITTI_TR
+        origins = np.tile(T_velo_2_world[:3, 3], (dirs_velo.shape[0], 1))
+        t, box_id, _ = scene.cast(origins, dirs_velo @ T_velo_2_world[:3, :3].T)
+        keep = (box_id >= 0) & (t < max_range)
+        scan = np.concatenate([dirs_velo[keep] * t[keep, None], np.full((keep.sum(), 1), 0.5)], axis=1)
+        scan.astype(np.float32).tofile(os.path.join(seq_dir, "velodyne", frame_id + ".bin"))
+
+        if i % voxels_every == 0:
+            labels = scene.labels_at((centers_velo @ T_velo_2_world.T)[:, :3]).astype(np.uint16)
+            prefix = os.path.join(seq_dir, "voxels", frame_id)
+            labels.tofile(prefix + ".label")
+            pack(labels > 0).tofile(prefix + ".bin")
+            pack(np.zeros(labels.shape[0], dtype=bool)).tofile(prefix + ".invalid")
+    return n_frames
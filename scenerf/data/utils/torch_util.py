@@ -13,3 +13,34 @@ def worker_init_fn(worker_id):
     """
     base_seed = torch.IntTensor(1).random_().item()
     np.random.seed(base_seed + worker_id)
+
+
+def pad_stack(seqs, pad_value=0):
+    """Stack per-item lists of per-source tensors into one padded tensor.
+
+    Items may have a different number of sources, and the source tensors may
+    differ in size along any dimension (e.g. a variable number of lidar points).
+    Everything is padded with `pad_value` up to the largest shape in the batch.
+
+    Args:
+        seqs: list (B) of lists (S_i) of tensors with the same number of dims.
+        pad_value: value written in the padded entries.
+
+    Returns:
+        stacked: (B, S, *max_shape) tensor
+        mask: (B, S) bool tensor, True for the real (non-padded) sources
+    """
+    bs = len(seqs)
+    n_sources = max([len(s) for s in seqs] + [0])
+    mask = torch.zeros(bs, n_sources, dtype=torch.bool)
+    tensors = [t for s in seqs for t in s]
+    if len(tensors) == 0:
+        return torch.zeros(bs, n_sources), mask
+
+    max_shape = np.max([tuple(t.shape) for t in tensors], axis=0)
+    stacked = tensors[0].new_full((bs, n_sources) + tuple(int(d) for d in max_shape), pad_value)
+    for i, s in enumerate(seqs):
+        for j, t in enumerate(s):
+            stacked[(i, j) + tuple(slice(0, d) for d in t.shape)] = t
+            mask[i, j] = True
+    return stacked, mask
@@ -1,4 +1,6 @@
 import numpy as np
+import torch
+from torchmetrics import Metric
 
 def compute_depth_errors(gt, pred, min_depth=1e-3, max_depth=80):
     """Computation of error metrics between predicted and ground truth depths
@@ -21,4 +23,106 @@ def compute_depth_errors(gt, pred, min_depth=1e-3, max_depth=80):
 
     sq_rel = np.mean(((gt - pred) ** 2) / gt)
 
-    return abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3
\ No newline at end of file
+    return abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3
+
+
+DEPTH_METRICS = ["abs_rel", "sq_rel", "rmse", "rmse_log", "a1", "a2", "a3"]
+
+
+def compute_depth_errors_torch(gt, pred, min_depth=1e-3, max_depth=80):
+    """Same as compute_depth_errors on the device of pred, without modifying pred
+    ------
+    return
+    (7,) abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3
+    """
+    pred = pred.clamp(min=min_depth, max=max_depth)
+
+    thresh = torch.maximum((gt / pred), (pred / gt))
+    a1 = (thresh < 1.25     ).float().mean()
+    a2 = (thresh < 1.25 ** 2).float().mean()
+    a3 = (thresh < 1.25 ** 3).float().mean()
+
+    rmse = (gt - pred) ** 2
+    rmse = torch.sqrt(rmse.mean())
+
+    rmse_log = (torch.log(gt) - torch.log(pred)) ** 2
+    rmse_log = torch.sqrt(rmse_log.mean())
+
+    abs_rel = torch.mean(torch.abs(gt - pred) / gt)
+
+    sq_rel = torch.mean(((gt - pred) ** 2) / gt)
+
+    return torch.stack([abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3])
+
+
+def compute_depth_errors_batch(gt, pred, mask, min_depth=1e-3, max_depth=80):
+    """Same as compute_depth_errors_torch on the points of mask of each source, for all the sources at once
+    gt, pred, mask: (S, N), the means of a source are masked sums over its row
+    ------
+    return
+    (S, 7) metrics of the sources, (S,) number of points of the sources
+    """
+    pred = pred.clamp(min=min_depth, max=max_depth)
+    # The masked out points are replaced by a valid depth, their terms are zeroed by the sums
+    gt = torch.where(mask, gt, pred)
+    weights = mask.to(pred.dtype)
+    n_pts = weights.sum(1)
+
+    def mean(x):
+        return (x * weights).sum(1) / n_pts.clamp(min=1)
+
+    thresh = torch.maximum((gt / pred), (pred / gt))
+    a1 = mean((thresh < 1.25     ).to(pred.dtype))
+    a2 = mean((thresh < 1.25 ** 2).to(pred.dtype))
+    a3 = mean((thresh < 1.25 ** 3).to(pred.dtype))
+
+    rmse = torch.sqrt(mean((gt - pred) ** 2))
+
+    rmse_log = torch.sqrt(mean((torch.log(gt) - torch.log(pred)) ** 2))
+
+    abs_rel = mean(torch.abs(gt - pred) / gt)
+
+    sq_rel = mean(((gt - pred) ** 2) / gt)
+
+    return torch.stack([abs_rel, sq_rel, rmse, rmse_log, a1, a2, a3], dim=1), n_pts
+
+
+class DepthMetrics(Metric):
+    """Mean over the evaluated sources of the metrics of compute_depth_errors.
+
+    The sums stay on the device of the model, update does not synchronize with the host.
+    The ranks are merged by compute, once per epoch.
+    """
+    full_state_update = False
+
+    def __init__(self, min_depth=1e-3, max_depth=80, dist_sync_on_step=False):
+        super().__init__(dist_sync_on_step=dist_sync_on_step)
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.add_state("sum_errors", default=torch.zeros(len(DEPTH_METRICS), dtype=torch.float64),
+                       dist_reduce_fx="sum")
+        self.add_state("n_sources", default=torch.zeros((), dtype=torch.float64), dist_reduce_fx="sum")
+
+    def update(self, gt, pred, mask=None):
+        """
+        gt, pred: (N,) depths of a source, numpy arrays or tensors,
+        or (S, N) depths of S sources with mask: (S, N) evaluated points. The sources are
+        evaluated at once on the device, the ones without any point of mask are skipped
+        """
+        pred = pred.detach()
+        gt = torch.as_tensor(gt, dtype=pred.dtype, device=pred.device)
+        if mask is None:
+            pred, gt = pred.reshape(1, -1), gt.reshape(1, -1)
+            mask = torch.ones_like(gt, dtype=torch.bool)
+        errors, n_pts = compute_depth_errors_batch(gt, pred, mask, self.min_depth, self.max_depth)
+        evaluated = n_pts > 0
+        self.sum_errors += (errors * evaluated.unsqueeze(1)).sum(0).to(self.sum_errors.dtype)
+        self.n_sources += evaluated.sum().to(self.n_sources.dtype)
+
+    def compute(self):
+        """
+        return
+        dict metric name -> mean over the sources, NaN when no source was evaluated
+        """
+        errors = self.sum_errors / self.n_sources
+        return {metric: errors[i] for i, metric in enumerate(DEPTH_METRICS)}
@@ -0,0 +1,111 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class RaySampler(nn.Module):
+    """
+    Sample the source pixels where the training rays are rendered, from a pool of the pixels of the
+    stride x stride grid of the (W, H) images built once. The "uniform" mode draws them uniformly, the
+    "importance" mode with a probability growing with the moving average of their per ray loss,
+    mixed with a uniform draw of weight uniform_ratio. Its distribution is rebuilt every
+    refresh_every updates. The pixels of a draw are distinct, except when an importance draw does
+    not give enough distinct pixels. The errors are plain tensors and not buffers, so that they are
+    neither saved in the checkpoints nor broadcast from the first rank under DDP.
+    """
+
+    def __init__(self, img_size, stride=2, mode="uniform",
+                 uniform_ratio=0.5, error_decay=0.9, refresh_every=10):
+        super().__init__()
+        assert mode in ("uniform", "importance"), mode
+        self.mode = mode
+        self.uniform_ratio = uniform_ratio
+        self.error_decay = error_decay
+        self.refresh_every = refresh_every
+        self.n_updates = 0
+
+        xs = torch.arange(start=0, end=img_size[0], step=stride).float()
+        ys = torch.arange(start=0, end=img_size[1], step=stride).float()
+        # ij order, the indexing argument needs torch >= 1.10
+        grid_x, grid_y = torch.meshgrid(xs, ys)
+        self.pixels = torch.stack([grid_x, grid_y], dim=-1).reshape(-1, 2)
+        # Unvisited pixels start with the largest color error so that they are sampled early
+        self.pixel_errors = torch.ones(self.pixels.shape[0])
+        self.cdf = torch.empty(0)
+
+    @property
+    def n_pixels(self):
+        return self.pixels.shape[0]
+
+    def sample(self, n_rays, n_pairs=1, device=None):
+        """
+        Draw n_rays pixels for each of the n_pairs sources, on device (the device of the last draw by default)
+        ------
+        return
+        idx: (n_pairs, n_rays) indices of the pixels in the pool, to pass to update
+        pix: (n_pairs, n_rays, 2) pixel coordinates
+        """
+        if device is not None and self.pixels.device != torch.device(device):
+            self.pixels = self.pixels.to(device)
+            self.pixel_errors = self.pixel_errors.to(device)
+            self.cdf = self.cdf.to(device)
+        n_rays = min(n_rays, self.n_pixels)
+        # Oversample to replace the duplicates
+        n_candidates = min(n_rays + max(16, n_rays // 4), self.n_pixels)
+        if self.mode == "importance":
+            if self.cdf.shape[0] == 0 or self.n_updates % self.refresh_every == 0:
+                self.refresh()
+            if n_candidates == self.n_pixels:
+                # Weighted draw without replacement over the whole pool (Gumbel top-k)
+                probs = (self.cdf - F.pad(self.cdf[:-1], (1, 0))).clamp(min=1e-12)
+                gumbel = -torch.log(-torch.log(torch.rand(n_pairs, self.n_pixels, device=self.pixels.device)))
+                idx = (probs.log() + gumbel).topk(n_rays, dim=1).indices
+                return idx, self.pixels[idx]
+            u = torch.rand(n_pairs, n_candidates, device=self.pixels.device)
+            candidates = torch.searchsorted(self.cdf, u * self.cdf[-1]).clamp(max=self.n_pixels - 1)
+        elif n_candidates == self.n_pixels:
+            candidates = torch.rand(n_pairs, self.n_pixels, device=self.pixels.device).argsort(dim=1)
+        else:
+            candidates = torch.randint(self.n_pixels, (n_pairs, n_candidates), device=self.pixels.device)
+        idx = self.first_distinct(candidates, n_rays)
+        return idx, self.pixels[idx]
+
+    @staticmethod
+    def first_distinct(candidates, n):
+        """
+        n candidates of each row, in random order, without the duplicates when there are enough distinct candidates
+        candidates: (n_rows, m)
+        ------
+        return
+        (n_rows, n)
+        """
+        sorted_candidates, _ = candidates.sort(dim=1)
+        duplicates = torch.zeros_like(sorted_candidates, dtype=torch.bool)
+        duplicates[:, 1:] = sorted_candidates[:, 1:] == sorted_candidates[:, :-1]
+        # The duplicates go last, the distinct candidates are shuffled
+        priority = torch.rand(candidates.shape, device=candidates.device) + duplicates
+        order = priority.argsort(dim=1)[:, :n]
+        return sorted_candidates.gather(1, order)
+
+    @torch.no_grad()
+    def update(self, idx, errors):
+        """
+        Update the moving average of the errors of the sampled pixels, no-op in the uniform mode
+        idx: (..., n_rays) as returned by sample
+        errors: (..., n_rays) per ray loss, NaN for the rays without loss
+        """
+        if self.mode != "importance":
+            return
+        idx = idx.reshape(-1).to(self.pixel_errors.device)
+        errors = errors.reshape(-1).to(self.pixel_errors)
+        valid = torch.isfinite(errors)
+        idx, errors = idx[valid], errors[valid]
+        self.pixel_errors[idx] = self.error_decay * self.pixel_errors[idx] + (1 - self.error_decay) * errors
+        self.n_updates += 1
+
+    def refresh(self):
+        """Rebuild the cumulative distribution of the importance mode from the current errors"""
+        errors = self.pixel_errors.clamp(min=0)
+        probs = (1 - self.uniform_ratio) * errors / errors.sum().clamp(min=1e-12) \
+            + self.uniform_ratio / self.n_pixels
+        self.cdf = torch.cumsum(probs, dim=0)
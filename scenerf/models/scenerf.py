@@ -5,9 +5,10 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.optim.lr_scheduler import ExponentialLR
 
-from scenerf.loss.depth_metrics import compute_depth_errors
+from scenerf.loss.depth_metrics import DepthMetrics, compute_depth_errors_torch
 from scenerf.loss.ss_loss import compute_l1_loss
 from scenerf.models.pe import PositionalEncoding
+from scenerf.models.ray_sampler import RaySampler
 from scenerf.models.ray_som_kl import RaySOM
 from scenerf.models.resnetfc import ResnetFC
 from scenerf.models.unet2d_sphere import UNet2DSphere
@@ -15,7 +16,7 @@ from scenerf.models.utils import (
     compute_direction_from_pixels, sample_rays_viewdir, sample_pix_features,
     cam_pts_2_cam_pts, pix_2_cam_pts,
     cam_pts_2_pix, sample_feats_2d,
-    sample_rays_gaussian)
+    sample_rays_gaussian, sample_pix_features_stacked)
 from scenerf.models.spherical_mapping import SphericalMapping
 
 
@@ -40,6 +41,7 @@ class SceneRF(pl.LightningModule):
             sphere_H=452, sphere_W=1500,
             use_color=True,
             use_reprojection=True,
+            ray_sampling="uniform",
     ):
         super().__init__()
         
@@ -49,6 +51,10 @@ class SceneRF(pl.LightningModule):
         self.weight_decay = weight_decay
         self.img_size = img_size
         self.sampling_method = sampling_method
+        # Pixels of the training rays, uniform or biased toward the pixels with a high recent loss
+        self.ray_sampler = RaySampler(img_size, stride=2, mode=ray_sampling)
+        # Depth metrics accumulated on the device during the epoch, by log prefix
+        self.depth_metrics = nn.ModuleDict({prefix: DepthMetrics() for prefix in ["traindepth", "valdepth"]})
         self.density_head = "softplus"
         self.min_depth = 0.1
         self.depth_window = 100
@@ -120,6 +126,9 @@ class SceneRF(pl.LightningModule):
         """
         pts_3d: bs, n_pts, 3
         """
+        if "source_masks" in batch:
+            return self.forward_stacked(batch, step_type)
+
         img_input = batch["img_inputs"]
 
         bs = img_input.shape[0]
@@ -200,10 +209,138 @@ class SceneRF(pl.LightningModule):
                 self.evaluate_depth(
                     step_type, gt_depth_infer, pred_depth_infer)
 
+        return self.combine_losses(
+            step_type, bs,
+            total_loss_reprojection, total_loss_color,
+            total_loss_kl, total_min_som_vars,
+            total_loss_dist2closest_gauss)
+
+    def forward_stacked(self, batch, step_type):
+        """
+        Same as forward for a batch collated with collate_stacked_fn.
+        The rays of all the (item, source) pairs are rendered in a single call
+        and the per-source losses are computed with segment reductions.
+        """
+        img_input = batch["img_inputs"]
+
+        bs = img_input.shape[0]
+
+        T_velo2cams = batch["T_velo_2_cam"]
+        T_cam2velo = torch.inverse(T_velo2cams[0])
+        cam_K = batch['cam_K'][0]
+        inv_K = torch.inverse(cam_K)
+
+        pix_coords, out_pix_coords, _ = self.spherical_mapping.from_pixels(inv_K=inv_K)
+        x_rgbs = self.net_rgb(img_input, pix=pix_coords,
+                              pix_sphere=out_pix_coords)
+
+        source_masks = batch['source_masks'].reshape(-1)  # n_pairs
+        n_pairs = source_masks.shape[0]
+        n_sources = n_pairs // bs
+        img_sources = batch['img_sources'].flatten(0, 1)  # n_pairs, 3, H, W
+        img_targets = batch['img_targets'].flatten(0, 1)
+        T_source2infers = batch['T_source2infers'].reshape(n_pairs, 4, 4)
+        T_source2targets = batch['T_source2targets'].reshape(n_pairs, 4, 4)
+        loc2d_with_depths = batch['loc2d_with_depths'].flatten(0, 1)  # n_pairs, n_pts, 2
+        lidar_depths = batch['lidar_depths'].flatten(0, 1)  # n_pairs, n_pts
+
+        # The sequences of a batch may have different calibrations
+        cam_Ks = batch['cam_K']
+        per_item_K = not torch.all(cam_Ks == cam_Ks[0])
+
+        def rays_cam_K(n_rays_per_source):
+            if per_item_K:
+                return cam_Ks.repeat_interleave(n_sources * n_rays_per_source, dim=0)
+            return cam_Ks[0]
+
+        n_rays = self.n_rays
+        pix_idx, pix_source = self.ray_sampler.sample(n_rays, n_pairs, device=self.device)  # n_pairs, n_rays, 2
+
+        # The rays are ordered by (item, source, ray) so that each item's rays are contiguous
+        cam_K = rays_cam_K(n_rays)
+        inv_K = torch.inverse(cam_K)
+        render_out_dict = self.render_rays_batch(
+            cam_K,
+            T_source2infers.repeat_interleave(n_rays, dim=0),
+            x_rgbs,
+            T_cam2velo=T_cam2velo,
+            ray_batch_size=n_pairs * n_rays,
+            sampled_pixels=pix_source.reshape(-1, 2))
+
+        depth_source_rendered = render_out_dict['depth']
+        loss_kl = render_out_dict['loss_kl']
+        gaussian_means = render_out_dict['gaussian_means']
+        gaussian_stds = render_out_dict['gaussian_stds']
+        som_vars = render_out_dict['som_vars']
+
+        diff = torch.abs(gaussian_means -
+                         depth_source_rendered.unsqueeze(-1).detach())
+        min_diff, gaussian_idx = torch.min(diff, dim=1)
+        min_stds = torch.gather(gaussian_stds, 1, gaussian_idx.unsqueeze(-1))
+        min_som_vars = torch.gather(som_vars, 1, gaussian_idx.unsqueeze(-1))
+
+        sampled_color_source = sample_pix_features_stacked(pix_source, img_sources)  # n_pairs, 3, n_rays
+        loss_color = torch.abs(
+            render_out_dict['color'].reshape(n_pairs, n_rays, 3) - sampled_color_source.transpose(1, 2))
+
+        loss_reprojection, reprojection_mask = self.compute_reprojection_loss_stacked(
+            pix_source, sampled_color_source, depth_source_rendered.reshape(n_pairs, n_rays),
+            img_targets, inv_K, cam_K, T_source2targets)
+
+        if step_type == "train":
+            ray_errors = loss_color.detach().mean(-1) + torch.where(
+                reprojection_mask, loss_reprojection.detach(), torch.zeros_like(loss_reprojection))
+            ray_errors[~source_masks] = float("nan")  # padded sources
+            self.ray_sampler.update(pix_idx, ray_errors)
+
+        # ==== Per source means, summed over the valid sources
+        def sum_source_means(x):
+            return (x.reshape(n_pairs, -1).mean(1) * source_masks).sum()
+
+        n_valid_rays = reprojection_mask.sum(1)
+        loss_reprojection = (loss_reprojection * reprojection_mask).sum(1) / n_valid_rays.clamp(min=1)
+        total_loss_reprojection = (loss_reprojection * (source_masks & (n_valid_rays > 0))).sum()
+
+        n_valid_sources = source_masks.sum()
+        for key, value in [
+            ("depth/closest_pts_to_depth", render_out_dict['closest_pts_to_depths']),
+            ("depth/weights_at_depth", render_out_dict['weights_at_depth']),
+            ("_som/dist_2_closest_gaussian", min_diff),
+            ("_som/closest_std", min_stds),
+        ]:
+            self.log(step_type + key, sum_source_means(value.detach()) / n_valid_sources,
+                     on_epoch=True, sync_dist=True)
+
+        # ====== Depth evaluation ======
+        # lidar points are padded with depth 0
+        n_pts = lidar_depths.shape[1]
+        with torch.no_grad():
+            cam_K = rays_cam_K(n_pts)
+            render_out_dict = self.render_rays_batch(
+                cam_K,
+                T_source2infers.repeat_interleave(n_pts, dim=0),
+                x_rgbs,
+                ray_batch_size=n_pairs * n_pts,
+                sampled_pixels=loc2d_with_depths.reshape(-1, 2).float())
+        pred_depths = render_out_dict['depth'].reshape(n_pairs, n_pts)
+        self.evaluate_depth_batch(step_type, lidar_depths, pred_depths,
+                                  (lidar_depths > 0) & source_masks.unsqueeze(1))
+
+        return self.combine_losses(
+            step_type, bs,
+            total_loss_reprojection,
+            sum_source_means(loss_color),
+            sum_source_means(loss_kl),
+            sum_source_means(min_som_vars),
+            sum_source_means(min_diff))
+
+    def combine_losses(self, step_type, bs,
+                       total_loss_reprojection, total_loss_color,
+                       total_loss_kl, total_min_som_vars,
+                       total_loss_dist2closest_gauss):
         # ==== Combine all the losses
         total_loss = 0
 
-
         total_loss_reprojection /= bs
         if self.use_reprojection:
             total_loss += total_loss_reprojection
@@ -250,18 +387,8 @@ class SceneRF(pl.LightningModule):
                               step_type):
 
 
-        xs = torch.arange(start=0, end=self.img_size[0], step=2).type_as(cam_K)
-        ys = torch.arange(start=0, end=self.img_size[1], step=2).type_as(cam_K)
-        grid_x, grid_y = torch.meshgrid(xs, ys)
-
-        sampled_pixels = torch.cat([
-            grid_x.unsqueeze(-1),
-            grid_y.unsqueeze(-1)
-        ], dim=2).reshape(-1, 2)
-
-        perm = torch.randperm(sampled_pixels.shape[0])
-        idx = perm[:n_grids]
-        pix_source = sampled_pixels[idx, :]
+        pix_idx, pix_source = self.ray_sampler.sample(n_grids, device=self.device)
+        pix_idx, pix_source = pix_idx[0], pix_source[0]
 
         render_out_dict = self.render_rays_batch(
             cam_K,
@@ -301,6 +428,8 @@ class SceneRF(pl.LightningModule):
 
         sampled_color_source = sample_pix_features(pix_source, img_source)
         loss_color = torch.abs(color_rendered - sampled_color_source.T)
+        if step_type == "train":
+            self.ray_sampler.update(pix_idx, loss_color.detach().mean(-1))
 
         loss_reprojection = self.compute_reprojection_loss(
             pix_source, sampled_color_source, depth_source_rendered,
@@ -320,32 +449,41 @@ class SceneRF(pl.LightningModule):
         return ret
 
     def evaluate_depth(self, step_type, gt_depth, pred_depth, log=True, ret_mean=True):
-        depth_errors = []
+        """
+        Accumulate the depth metrics of a source, logged at the end of the epoch.
+        With log=False, return the metrics of the source instead
+        """
+        if not log:
+            pred_depth = pred_depth.detach().reshape(-1)
+            gt_depth = torch.as_tensor(gt_depth, dtype=pred_depth.dtype, device=pred_depth.device).reshape(-1)
+            return compute_depth_errors_torch(gt_depth, pred_depth).cpu().numpy()
 
-        depth_error = compute_depth_errors(
-            gt_depth.reshape(-1).detach().cpu().numpy(),
-            pred_depth.reshape(-1).detach().cpu().numpy(),
-        )
+        self.depth_metrics[step_type + "depth"].update(gt_depth, pred_depth)
 
-        depth_errors.append(depth_error)
+    def evaluate_depth_batch(self, step_type, gt_depths, pred_depths, masks):
+        """
+        Accumulate the depth metrics of the sources of a stacked batch in one update on the device,
+        gt_depths, pred_depths, masks: (n_pairs, N), the pairs without any point of masks are skipped
+        """
+        self.depth_metrics[step_type + "depth"].update(gt_depths, pred_depths, masks)
 
-        if ret_mean:
-            agg_depth_errors = np.array(depth_errors).mean(0)
-        else:
-            agg_depth_errors = np.array(depth_errors).sum(0)
-        metric_list = ["abs_rel", "sq_rel",
-                       "rmse", "rmse_log", "a1", "a2", "a3"]
-        
-        if not log:
-            return agg_depth_errors
+    def log_depth_metrics(self, step_type):
+        # Merges the sums of all the ranks, a single synchronization per epoch
+        metric = self.depth_metrics[step_type + "depth"]
+        depth_errors = metric.compute()
+        metric.reset()
+        if torch.isnan(depth_errors["abs_rel"]):
+            # No source was evaluated
+            return
+        for name, value in depth_errors.items():
+            self.log(step_type + "depth/{}".format(name), value)
 
-        for i_metric, metric in enumerate(metric_list):
-            key = step_type + "depth/{}".format(metric)
+    def on_train_epoch_end(self, *args):
+        self.log_depth_metrics("train")
 
-            self.log(key, agg_depth_errors[i_metric],
-                    on_epoch=True, sync_dist=True)
+    def on_validation_epoch_end(self):
+        self.log_depth_metrics("val")
 
- 
     def compute_reprojection_loss(
             self,
             pix_source, sampled_color_source,
@@ -385,6 +523,50 @@ class SceneRF(pl.LightningModule):
      
         return loss_reprojections
 
+    def compute_reprojection_loss_stacked(
+            self,
+            pix_source, sampled_color_source,
+            depth_rendered,
+            img_targets,
+            inv_K, cam_K, T_source2targets):
+        """
+        Same as compute_reprojection_loss for n_pairs sources at once
+        pix_source: (n_pairs, n_rays, 2)
+        sampled_color_source: (n_pairs, 3, n_rays)
+        depth_rendered: (n_pairs, n_rays)
+        img_targets: (n_pairs, 3, H, W)
+        inv_K, cam_K: (3, 3) or (n_pairs * n_rays, 3, 3)
+        T_source2targets: (n_pairs, 4, 4)
+        ------
+        return
+        loss_reprojections: (n_pairs, n_rays)
+        mask: (n_pairs, n_rays), rays projecting in front of the target camera
+        """
+        n_pairs, n_rays, _ = pix_source.shape
+        cam_source_pts = pix_2_cam_pts(pix_source.reshape(-1, 2), inv_K, depth_rendered.reshape(-1))
+        cam_pts_target = cam_pts_2_cam_pts(cam_source_pts, T_source2targets.repeat_interleave(n_rays, dim=0))
+
+        pix_target = cam_pts_2_pix(cam_pts_target, cam_K).reshape(n_pairs, n_rays, 2)
+        mask = cam_pts_target[:, 2].reshape(n_pairs, n_rays) > 0
+
+        # ===== Sample the colors at 2d locations =====
+        sampled_color_target = sample_pix_features_stacked(pix_target, img_targets)
+
+        sampled_color_target_identity_reprojection = sample_pix_features_stacked(
+            pix_source, img_targets)
+
+        loss_reprojection = torch.abs(
+            sampled_color_target - sampled_color_source).mean(1)
+        loss_identity_reprojection = torch.abs(
+            sampled_color_target_identity_reprojection - sampled_color_source).mean(1)
+        loss_identity_reprojection += torch.randn(
+            loss_identity_reprojection.shape, device=self.device) * 0.00001
+
+        loss_reprojections = torch.stack([loss_reprojection, loss_identity_reprojection])
+        loss_reprojections = torch.min(loss_reprojections, dim=0)[0]
+
+        return loss_reprojections, mask
+
     def step(self, batch, step_type):
         out_dict = self.forward(batch, step_type)
         return out_dict['total_loss']
@@ -507,6 +689,11 @@ class SceneRF(pl.LightningModule):
         # x_sphere, 
         cam_K, T_cam2velo, viewdir, output_type="density"):
         saved_shape = cam_pts.shape
+        if cam_K.dim() == 3 and len(saved_shape) == 3:
+            # one intrinsics per ray, repeat it for every point of the ray
+            cam_K = cam_K.repeat_interleave(saved_shape[1], dim=0)
+        if x_rgb["1_1"].dim() == 3:
+            x_rgb = {k: v.unsqueeze(0) for k, v in x_rgb.items()}
         # print(cam_pts.shape)
         cam_pts = cam_pts.reshape(-1, 3)
         projected_pix = cam_pts_2_pix(cam_pts, cam_K)
@@ -519,10 +706,10 @@ class SceneRF(pl.LightningModule):
         pe = self.pe(cam_pts)
         
 
-        feats_2d_sphere = [sample_feats_2d(x_rgb["1_1"].unsqueeze(0), pix_sphere_coords, (self.out_img_W, self.out_img_H))]
+        feats_2d_sphere = [sample_feats_2d(x_rgb["1_1"], pix_sphere_coords, (self.out_img_W, self.out_img_H))]
         for scale in [2, 4, 8, 16]:
             key = "1_{}".format(scale)
-            feats_2d_sphere.append(sample_feats_2d(x_rgb[key].unsqueeze(0), pix_sphere_coords, (self.out_img_W//scale, self.out_img_H//scale)))
+            feats_2d_sphere.append(sample_feats_2d(x_rgb[key], pix_sphere_coords, (self.out_img_W//scale, self.out_img_H//scale)))
         
         feats_2d_sphere = torch.cat(feats_2d_sphere, dim=-1)
     
@@ -567,7 +754,7 @@ class SceneRF(pl.LightningModule):
         gaussian_means_pts = gaussian_means_sensor_distance * direction
 
         gaussian_means_pts_infer = cam_pts_2_cam_pts(
-            gaussian_means_pts.reshape(-1, 3), T_source2infer)
+            gaussian_means_pts, T_source2infer)
         gaussian_means_pts_infer = gaussian_means_pts_infer.reshape(
             n_rays, n_gaussians, 3)
 
@@ -4,15 +4,17 @@ import numpy as np
 import math
 import torch.nn.functional as F
 
+from scenerf.models.utils import matmul_pts
+
 
 def pix_2_cam_pts(pix, inv_K, depth):
     """
     pix: (B, 2)
-    inv_K: (3, 3)
+    inv_K: (3, 3) or (B, 3, 3)
     depth: (B,)
     """
     homo_pix = torch.cat([pix, torch.ones_like(pix)[:, :1]], dim=1)
-    cam_pts = (inv_K @ homo_pix.T).T
+    cam_pts = matmul_pts(inv_K, homo_pix)
     cam_pts = depth.view(-1, 1) * cam_pts
 
     return cam_pts
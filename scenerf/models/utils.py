@@ -49,6 +49,21 @@ def sample_rel_poses(step=0.5, angle=0, max_distance=10.1):
     return rel_poses
 
 
+def matmul_pts(M, pts):
+    """
+    M: (d, d) shared by all points, or (N, d, d) one matrix per row of pts
+    pts: (N, d) or (N, P, d)
+    ------
+    return
+    M applied to the points, same shape as pts
+    """
+    if M.dim() == 2:
+        return (M @ pts.reshape(-1, pts.shape[-1]).T).T.reshape(pts.shape)
+    if pts.dim() == 3:
+        M = M.unsqueeze(1)
+    return (M @ pts.unsqueeze(-1)).squeeze(-1)
+
+
 def weighted_uniform_sampling(d_min, d_max, unit_direction, weights):
     n_rays, n_fine, _ = unit_direction.shape
     device = unit_direction.device
@@ -119,7 +134,7 @@ def sample_rays_viewdir(
         weights=None):
     """
     pix: (n_rays, 2)
-    T: (4, 4)
+    T: (4, 4) or (n_rays, 4, 4)
     """
     device = inv_K.device
     if sampled_pixels is None:
@@ -132,7 +147,7 @@ def sample_rays_viewdir(
 
     # Unproject pixels into cam coords to get the direction
     homo_pix = torch.cat([sampled_pixels, torch.ones_like(sampled_pixels)[:, :1]], dim=1)
-    viewdir = (inv_K[:3, :3] @ homo_pix.T).T
+    viewdir = matmul_pts(inv_K[..., :3, :3], homo_pix)
     cam_pts_direction = viewdir.reshape(n_rays, 1, 3).expand(-1, n_pts_per_ray,
                                                                        -1)  # n_rays, n_pts_per_ray, 3
     unit_direction = F.normalize(cam_pts_direction, dim=2)  # n_rays, n_pts_per_ray, 3
@@ -162,12 +177,11 @@ def sample_rays_viewdir(
     homo_cam_pts = torch.cat([cam_pts, ones], dim=2).float()
 
     # Change to camera coord of the other frame    
-    homo_pts_infer = (T_cam2cam @ homo_cam_pts.reshape(-1, 4).T).T
-    homo_pts_infer = homo_pts_infer.reshape(n_rays, n_pts_per_ray, 4)
+    homo_pts_infer = matmul_pts(T_cam2cam, homo_cam_pts)
     pts_cam = homo_pts_infer[:, :, :3]
     
     
-    viewdir_infer = (T_cam2cam[:3, :3] @ viewdir.T).T
+    viewdir_infer = matmul_pts(T_cam2cam[..., :3, :3], viewdir)
     
     # print(depth.shape, sensor_distance_source.shape)
     return pts_cam, depth, sensor_distance_sampled, viewdir_infer
@@ -177,7 +191,7 @@ def sample_rays_viewdir(
 def compute_direction_from_pixels(sampled_pixels, inv_K):
     # Unproject pixels into cam coords to get the direction\
     homo_pix = torch.cat([sampled_pixels, torch.ones_like(sampled_pixels)[:, :1]], dim=1)
-    directions = (inv_K[:3, :3] @ homo_pix.T).T
+    directions = matmul_pts(inv_K[..., :3, :3], homo_pix)
     unit_direction = F.normalize(directions, dim=1)  # n_rays, 3
     return unit_direction
 
@@ -194,7 +208,7 @@ def sample_rays_gaussian(
         n_pts_per_gaussian=8):
     """
     pix: (n_rays, 2)
-    T: (4, 4)
+    T: (4, 4) or (n_rays, 4, 4)
     # """
    
     n_pts_per_ray = n_gaussians * n_pts_per_gaussian
@@ -222,8 +236,7 @@ def sample_rays_gaussian(
     homo_cam_pts = torch.cat([cam_pts, ones], dim=2).float()
 
     # Change to camera coord of the other frame    
-    homo_pts_infer = (T_cam2cam @ homo_cam_pts.reshape(-1, 4).T).T
-    homo_pts_infer = homo_pts_infer.reshape(n_rays, n_pts_per_ray, 4)
+    homo_pts_infer = matmul_pts(T_cam2cam, homo_cam_pts)
     pts_cam = homo_pts_infer[:, :, :3]
 
     return pts_cam, depth_volume, sensor_distance_sampled
@@ -231,19 +244,20 @@ def sample_rays_gaussian(
 
 def sample_feats_2d(x_rgb, projected_pix, img_size=(1220, 370)):
     """
-    x_rgb: (d, 370, 1220)
-    projected_pix: (N, 2)
+    x_rgb: (B, d, 370, 1220)
+    projected_pix: (N, 2), the first N/B points are sampled in x_rgb[0], the next N/B in x_rgb[1], ...
     """
+    bs = x_rgb.shape[0]
     projected_pix = (projected_pix / torch.tensor(img_size).type_as(projected_pix).reshape(1, 2)) * 2 - 1
-    projected_pix = projected_pix.reshape(1, 1, -1, 2)
+    projected_pix = projected_pix.reshape(bs, 1, -1, 2)
     feats_2d = F.grid_sample(
         x_rgb,
         projected_pix,
         align_corners=False,
         mode='bilinear',
         padding_mode="zeros"
-    )  # [1, d, n_rays, n_pts_per_rays]
-    feats_2d = feats_2d.reshape(feats_2d.shape[1], -1).T
+    )  # [B, d, 1, N/B]
+    feats_2d = feats_2d.permute(0, 2, 3, 1).reshape(-1, feats_2d.shape[1])
     return feats_2d
 
 
@@ -269,15 +283,38 @@ def sample_pix_features(pix, img):
     return color_bilinear
 
 
+def sample_pix_features_stacked(pix, img):
+    """
+    pix: G, B, 2 # the 2 columns store x, y coords
+    img: G, C, H, W
+    -------------
+    return 
+    color_bilinear: G, 3, B
+    """
+    pix = pix.float()
+    pix_t = torch.ones_like(pix)  # G, B, 2
+    pix_t[:, :, 0] = (pix[:, :, 0] / (img.shape[3] - 1) - 0.5) * 2
+    pix_t[:, :, 1] = (pix[:, :, 1] / (img.shape[2] - 1) - 0.5) * 2
+
+    color_bilinear = F.grid_sample(
+        img,
+        pix_t.unsqueeze(2).float(),
+        align_corners=False,
+        mode='bilinear', padding_mode='zeros').squeeze(-1)
+
+    return color_bilinear
+
+
 def cam_pts_2_cam_pts(cam_ptx_from, T):
     """
-    cam_ptx_from: B, 3
+    cam_ptx_from: B, 3 or B, P, 3
+    T: (4, 4) or (B, 4, 4)
     """
-    ones = torch.ones(cam_ptx_from.shape[0], 1, device=cam_ptx_from.device)
-    homo_cam_ptx_from = torch.cat([cam_ptx_from, ones], dim=1).float()
+    ones = torch.ones(cam_ptx_from.shape[:-1] + (1,), device=cam_ptx_from.device)
+    homo_cam_ptx_from = torch.cat([cam_ptx_from, ones], dim=-1).float()
     # print(T_cam_minus1_0.dtype, homo_cam_minus1_pts.dtype)
-    homo_cam_pts_to = (T @ homo_cam_ptx_from.T).T
-    cam_pts_to = homo_cam_pts_to[:, :3]
+    homo_cam_pts_to = matmul_pts(T, homo_cam_ptx_from)
+    cam_pts_to = homo_cam_pts_to[..., :3]
 
     return cam_pts_to
 
@@ -285,11 +322,11 @@ def cam_pts_2_cam_pts(cam_ptx_from, T):
 def pix_2_cam_pts(pix, inv_K, depth):
     """
     pix: (B, 2)
-    inv_K: (3, 3)
+    inv_K: (3, 3) or (B, 3, 3)
     depth: (B,)
     """
     homo_pix = torch.cat([pix, torch.ones_like(pix)[:, :1]], dim=1)
-    cam_pts = (inv_K @ homo_pix.T).T
+    cam_pts = matmul_pts(inv_K, homo_pix)
     cam_pts = depth.reshape(-1, 1) * cam_pts
 
     return cam_pts
@@ -298,13 +335,13 @@ def pix_2_cam_pts(pix, inv_K, depth):
 def cam_pts_2_pix(cam_pts, K):
     """
     cam_pts: (B, 3)
-    K: (3, 3)
+    K: (3, 3) or (B, 3, 3)
     ------
     return
     pix: (B, 2)
     """
     # print(K.dtype, cam_pts.dtype)
-    homo_pix = (K @ cam_pts.T).T
+    homo_pix = matmul_pts(K, cam_pts)
     mask = homo_pix[:, 2] > 0
     # homo_pix[mask, 2] = 1.0
 
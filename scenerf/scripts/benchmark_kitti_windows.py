@@ -0,0 +1,97 @@
+import time
+
+import click
+import numpy as np
+
+from scenerf.data.semantic_kitti.kitti_dataset import KittiDataset, build_windows
+
+
+def build_windows_loop(positions, start_ids, image_exists, frames_interval, sequence_distance):
+    """Reference frame by frame construction of the windows, as in the previous versions of KittiDataset"""
+    windows = []
+    for frame_id in start_ids:
+        rel_frame_ids = []
+        distances = []
+        distance = 0
+        cnt = -1
+        while True:
+            cnt += 1
+            rel_frame_id = frame_id + cnt
+            should_add = rel_frame_id < len(image_exists) and image_exists[rel_frame_id]
+            if not should_add:
+                break
+            if len(rel_frame_ids) > 0:
+                prev_xyz = positions[rel_frame_ids[-1]]
+                current_xyz = positions[rel_frame_id]
+                rel_distance = np.sqrt(
+                    (prev_xyz[0] - current_xyz[0]) ** 2 + (prev_xyz[2] - current_xyz[2]) ** 2)
+                distance += rel_distance
+                if rel_distance < frames_interval:
+                    continue
+                if distance > sequence_distance:
+                    break
+            rel_frame_ids.append(rel_frame_id)
+            distances.append(distance)
+        windows.append((rel_frame_ids, distances, bool(should_add)))
+    return windows
+
+
+def synthetic_positions(n_frames, seed=0):
+    """Car like trajectory: speed between 0 (stops) and 1.5m per frame, smooth heading"""
+    rng = np.random.RandomState(seed)
+    speed = np.clip(np.cumsum(rng.normal(0, 0.05, n_frames)) + 0.8, 0, 1.5)
+    heading = np.cumsum(rng.normal(0, 0.02, n_frames))
+    positions = np.zeros((n_frames, 3))
+    positions[:, 0] = np.cumsum(speed * np.sin(heading))
+    positions[:, 2] = np.cumsum(speed * np.cos(heading))
+    return positions
+
+
+@click.command()
+@click.option('--root', default="", help='path to dataset folder, synthetic trajectories if empty')
+@click.option('--preprocess_root', default="", help='path to preprocess folder')
+@click.option('--split', default="train", help='split of the dataset to build')
+@click.option('--n_frames', default=4500, help='number of frames of the synthetic trajectories')
+@click.option('--n_sequences', default=10, help='number of synthetic trajectories')
+@click.option('--frames_interval', default=0.4, help='Interval between supervision frames')
+@click.option('--sequence_distance', default=10, help='Distance between the input and the last frames in the sequence')
+def main(root, preprocess_root, split, n_frames, n_sequences, frames_interval, sequence_distance):
+    """Compare the window construction of KittiDataset with the frame by frame loop and time the dataset init"""
+    if root != "":
+        start_time = time.time()
+        ds = KittiDataset(
+            split=split,
+            root=root,
+            preprocess_root=preprocess_root,
+            frames_interval=frames_interval,
+            sequence_distance=sequence_distance)
+        print("KittiDataset({}) init: {:.2f}s, {} scans".format(split, time.time() - start_time, len(ds)))
+        return
+
+    t_loop, t_vectorized, n_windows = 0, 0, 0
+    for seed in range(n_sequences):
+        positions = synthetic_positions(n_frames, seed)
+        image_exists = np.ones(n_frames, dtype=bool)
+        start_ids = np.arange(n_frames)
+
+        start_time = time.time()
+        expected = build_windows_loop(positions, start_ids, image_exists, frames_interval, sequence_distance)
+        t_loop += time.time() - start_time
+
+        start_time = time.time()
+        windows = build_windows(positions, start_ids, image_exists, frames_interval, sequence_distance)
+        t_vectorized += time.time() - start_time
+
+        # The distances can differ by an ulp, numpy squares arrays but calls pow on scalars
+        for (ids, distances, should_add), (ref_ids, ref_distances, ref_should_add) in zip(windows, expected):
+            assert ids == ref_ids and should_add == ref_should_add and np.allclose(distances, ref_distances), \
+                "windows differ from the reference on trajectory {}".format(seed)
+        n_windows += len(windows)
+
+    print("{} windows".format(n_windows))
+    print("frame by frame: {:.3f}s".format(t_loop))
+    print("vectorized:     {:.3f}s ({:.1f}x)".format(t_vectorized, t_loop / t_vectorized))
+
+
+if __name__ == "__main__":
+    main()
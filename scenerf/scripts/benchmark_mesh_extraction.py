@@ -0,0 +1,126 @@
+import gc
+import os
+import tempfile
+import time
+import threading
+
+import click
+import numpy as np
+from scipy.spatial import cKDTree
+
+from scenerf.data.utils import fusion
+from scenerf.scripts.benchmark_tsdf_integration import bf_frames, kitti_frames
+
+
+def face_corners(faces, rep, norms):
+    """
+    Corners of the faces, ordered by the representatives of the vertices of the faces
+    ------
+    return
+    representatives of the vertices of the face and of the corner, index of the vertex of the corners
+    """
+    face_rep = np.repeat(np.sort(rep[faces], axis=1), 3, axis=0)
+    corner_rep = rep[faces].reshape(-1, 1)
+    # The normals order the corners at the same position
+    order = np.lexsort(np.concatenate([face_rep, corner_rep, np.round(norms[faces].reshape(-1, 3) * 1e3)],
+                                      axis=1).T[::-1])
+    return np.concatenate([face_rep, corner_rep], axis=1)[order], faces.reshape(-1)[order]
+
+
+def compare_meshes(ref, mesh, vol_origin, voxel_size):
+    """
+    The vertices are matched to the nearest vertices of ref, the vertices of ref at the same
+    position are represented by one of them
+    ------
+    return
+    same faces, max vertex and normal differences, vertices of different colors away from and
+    at the middle of two voxels (where the vertex rounds to either of the voxels)
+    """
+    tree = cKDTree(ref[0])
+    ref_rep = tree.query(ref[0])[1]
+    dist, rep = tree.query(mesh[0])
+    if len(ref[1]) != len(mesh[1]):
+        return False, dist.max(), np.inf, -1, -1
+    ref_keys, ref_corners = face_corners(ref[1], ref_rep, ref[2])
+    keys, corners = face_corners(mesh[1], rep, mesh[2])
+    vox = (ref[0][ref_corners].astype(np.float64) - vol_origin) / voxel_size
+    tie = np.any(np.abs(np.abs(vox - np.floor(vox)) - 0.5) < 1e-3, axis=1)
+    other_color = np.any(ref[3][ref_corners] != mesh[3][corners], axis=1)
+    return (np.array_equal(ref_keys, keys), dist.max(), np.abs(ref[2][ref_corners] - mesh[2][corners]).max(),
+            int(np.sum(other_color & ~tie)), int(np.sum(other_color & tie)))
+
+
+def rss():
+    """Resident memory of this process in bytes (Linux)"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def timed(fn):
+    """
+    return
+    result, time, peak increase of the resident memory of this process in MB, sampled every ms
+    """
+    gc.collect()
+    start = rss()
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(1e-3):
+            peak[0] = max(peak[0], rss())
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    t = time.time()
+    result = fn()
+    t = time.time() - t
+    done.set()
+    sampler.join()
+    return result, t, (max(peak[0], rss()) - start) / 2 ** 20
+
+
+@click.command()
+@click.option('--dataset', default="kitti", help='kitti or bf')
+@click.option('--n_frames', default=20, help='number of integrated frames')
+@click.option('--scale', default=2, help='voxel size divisor of the volume of the dataset')
+@click.option('--chunk_size', default=64)
+@click.option('--n_workers', default=4, help='processes of the parallel extraction')
+def main(dataset, n_frames, scale, chunk_size, n_workers):
+    """
+    Time and peak memory of the mesh extraction of TSDFVolume on the whole volume and in chunks,
+    in this process, in parallel and streamed to a .ply file. The chunked meshes are compared
+    against the mesh of the whole volume
+    """
+    if dataset == "kitti":
+        vol_bnds, voxel_size, cam_K, frames = kitti_frames(n_frames)
+    else:
+        vol_bnds, voxel_size, cam_K, frames = bf_frames(n_frames)
+    tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size / scale, trunc_margin=10, use_gpu=False)
+    colors, depths, poses = zip(*frames)
+    tsdf_vol.integrate_many(colors, depths, cam_K, poses)
+
+    # Compile the numba functions of the chunks outside of the timings
+    tsdf_vol.get_mesh(chunk_size=chunk_size)
+    ref, t, peak = timed(lambda: tsdf_vol.get_mesh(chunk_size=None))
+    print("{}: {} vertices, {} faces".format(dataset, len(ref[0]), len(ref[1])))
+    print("  whole volume:              {:6.2f}s, {:7.1f}MB".format(t, peak))
+    for name, workers in [("chunks:", 0), ("chunks, {} processes:".format(n_workers), n_workers)]:
+        mesh, t, peak = timed(lambda: tsdf_vol.get_mesh(chunk_size=chunk_size, n_workers=workers))
+        same_faces, verts_diff, norms_diff, n_colors, n_ties = compare_meshes(ref, mesh, tsdf_vol._vol_origin, tsdf_vol._voxel_size)
+        print("  {:<26} {:6.2f}s, {:7.1f}MB, same faces: {}, max vertex difference {:.1e}m, max normal "
+              "difference {:.1e}, other colors: {} vertices, {} between two voxels".format(
+                name, t, peak, same_faces, verts_diff, norms_diff, n_colors, n_ties))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _, t, peak = timed(lambda: fusion.meshwrite(os.path.join(tmp_dir, "ref.ply"), *tsdf_vol.get_mesh(
+            chunk_size=None)))
+        print("  whole volume, .ply:        {:6.2f}s, {:7.1f}MB".format(t, peak))
+        (n_verts, n_faces), t, peak = timed(lambda: tsdf_vol.write_mesh(
+            os.path.join(tmp_dir, "chunks.ply"), chunk_size=chunk_size, n_workers=n_workers))
+        print("  chunks, {} processes, .ply: {:6.2f}s, {:7.1f}MB, {} vertices, {} faces".format(
+            n_workers, t, peak, n_verts, n_faces))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from scenerf.data.utils import fusion
+
+
+def random_mesh(n_verts, seed=0):
+    """
+    Mesh of the size of the meshes of depth2tsdf_bf.py, 2 faces per vertex
+    ------
+    return
+    verts, faces, norms, colors as TSDFVolume.get_mesh
+    """
+    rng = np.random.RandomState(seed)
+    verts = (rng.rand(n_verts, 3) * 4.8 - 2.4).astype(np.float32)
+    norms = rng.randn(n_verts, 3).astype(np.float32)
+    norms /= np.linalg.norm(norms, axis=1, keepdims=True)
+    colors = rng.randint(0, 256, (n_verts, 3)).astype(np.uint8)
+    faces = rng.randint(0, n_verts, (2 * n_verts, 3)).astype(np.int32)
+    return verts, faces, norms, colors
+
+
+def timed(fn, *args, **kwargs):
+    t = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - t
+
+
+@click.command()
+@click.option('--n_verts', default=1000000, help='number of vertices of the mesh')
+def main(n_verts):
+    """
+    Write and read throughput of meshwrite/meshread and pcwrite/pcread in binary and ASCII .ply
+    """
+    mesh = random_mesh(n_verts)
+    verts, faces, norms, colors = mesh
+    xyzrgb = np.hstack([verts, colors]).astype(np.float32)
+    print("mesh of {} vertices and {} faces".format(len(verts), len(faces)))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "mesh.ply")
+        for binary in [True, False]:
+            name = "binary" if binary else "ASCII"
+            _, t_write = timed(fusion.meshwrite, filename, *mesh, binary=binary)
+            size = os.path.getsize(filename) / 2 ** 20
+            read, t_read = timed(fusion.meshread, filename)
+            atol = 0 if binary else 1e-6  # %f keeps 6 decimals
+            assert np.allclose(read[0], verts, rtol=0, atol=atol) and np.allclose(read[2], norms, rtol=0, atol=atol)
+            assert np.array_equal(read[1], faces) and np.array_equal(read[3], colors)
+            print("  {:<15} {:7.1f}MB, write {:6.2f}s ({:6.1f}MB/s), read {:6.2f}s ({:6.1f}MB/s)".format(
+                "mesh, " + name, size, t_write, size / t_write, t_read, size / t_read))
+
+            _, t_write = timed(fusion.pcwrite, filename, xyzrgb, binary=binary)
+            size = os.path.getsize(filename) / 2 ** 20
+            read, t_read = timed(fusion.pcread, filename)
+            assert np.allclose(read, xyzrgb, rtol=0, atol=atol)
+            print("  {:<15} {:7.1f}MB, write {:6.2f}s ({:6.1f}MB/s), read {:6.2f}s ({:6.1f}MB/s)".format(
+                "points, " + name, size, t_write, size / t_write, t_read, size / t_read))
+
+
+if __name__ == "__main__":
+    main()
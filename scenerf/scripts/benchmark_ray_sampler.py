@@ -0,0 +1,141 @@
+import time
+
+import click
+import numpy as np
+import torch
+import torch.nn as nn
+
+from scenerf.data.utils.synthetic_scene import random_room, room_trajectory, render
+from scenerf.models.pe import PositionalEncoding
+from scenerf.models.ray_sampler import RaySampler
+
+
+def sample_pixels_randperm(img_size, n_rays):
+    """Reference sampling of SceneRF.process_single_source before RaySampler"""
+    xs = torch.arange(start=0, end=img_size[0], step=2).float()
+    ys = torch.arange(start=0, end=img_size[1], step=2).float()
+    grid_x, grid_y = torch.meshgrid(xs, ys)
+
+    sampled_pixels = torch.cat([
+        grid_x.unsqueeze(-1),
+        grid_y.unsqueeze(-1)
+    ], dim=2).reshape(-1, 2)
+
+    perm = torch.randperm(sampled_pixels.shape[0])
+    idx = perm[:n_rays]
+    return sampled_pixels[idx, :]
+
+
+def time_sampling(img_size, n_rays, n_iters):
+    t = time.time()
+    for _ in range(n_iters):
+        sample_pixels_randperm(img_size, n_rays)
+    t_randperm = (time.time() - t) / n_iters
+
+    timings = [t_randperm]
+    for mode in ["uniform", "importance"]:
+        sampler = RaySampler(img_size, mode=mode)
+        t = time.time()
+        for _ in range(n_iters):
+            idx, _ = sampler.sample(n_rays)
+            sampler.update(idx, torch.rand(idx.shape))
+        timings.append((time.time() - t) / n_iters)
+    return timings
+
+
+def synthetic_depth(width, height, seed):
+    """Depth map of a synthetic room seen from its trajectory"""
+    rng = np.random.RandomState(seed)
+    scene = random_room(rng)
+    cam_K = np.array([[585.0 * width / 640, 0, (width - 1) / 2], [0, 585.0 * width / 640, (height - 1) / 2], [0, 0, 1]])
+    pose = room_trajectory(8)[seed % 8]
+    _, depth = render(scene, cam_K, width, height, pose)
+    return torch.from_numpy(depth).float()
+
+
+def fit_depth(depth, mode, n_rays, n_steps, eval_every, seed):
+    """
+    Fit a coordinate MLP to the depth map with the rays drawn by RaySampler, the per ray loss is
+    the relative depth error, used as the error of the importance mode
+    ------
+    return
+    list of (step, abs_rel over all the pixels of the pool)
+    """
+    torch.manual_seed(seed)
+    height, width = depth.shape
+    sampler = RaySampler((width, height), mode=mode)
+    pe = PositionalEncoding(num_freqs=8, d_in=2)
+    mlp = nn.Sequential(
+        nn.Linear(pe.d_out, 128), nn.ReLU(),
+        nn.Linear(128, 128), nn.ReLU(),
+        nn.Linear(128, 1), nn.Softplus())
+    optimizer = torch.optim.Adam(mlp.parameters(), lr=3e-3)
+
+    def predict(pix):
+        x = pix / torch.tensor([width, height]) * 2 - 1
+        return mlp(pe(x)).squeeze(-1)
+
+    def gt(pix):
+        pix = pix.long()
+        return depth[pix[:, 1], pix[:, 0]]
+
+    all_gt = gt(sampler.pixels)
+    valid = all_gt > 0
+    curve = []
+    for step in range(n_steps + 1):
+        if step % eval_every == 0:
+            with torch.no_grad():
+                pred = predict(sampler.pixels[valid])
+                curve.append((step, ((pred - all_gt[valid]).abs() / all_gt[valid]).mean().item()))
+        if step == n_steps:
+            break
+        idx, pix = sampler.sample(n_rays)
+        idx, pix = idx[0], pix[0]
+        target = gt(pix)
+        errors = (predict(pix) - target).abs() / target.clamp(min=1e-3)
+        errors = torch.where(target > 0, errors, torch.zeros_like(errors))
+        optimizer.zero_grad()
+        errors.mean().backward()
+        optimizer.step()
+        sampler.update(idx, errors.detach())
+    return curve
+
+
+def steps_to_reach(curve, target):
+    for step, abs_rel in curve:
+        if abs_rel <= target:
+            return step
+    return None
+
+
+@click.command()
+@click.option('--n_rays', default=1200, help='rays per step')
+@click.option('--n_iters', default=200, help='draws timed per image size')
+@click.option('--width', default=320, help='width of the synthetic depth maps')
+@click.option('--height', default=240, help='height of the synthetic depth maps')
+@click.option('--n_steps', default=1500, help='training steps of each fit')
+@click.option('--eval_every', default=25, help='steps between two evaluations of abs_rel')
+@click.option('--target_abs_rel', default=0.01, help='abs_rel at which a fit is considered converged')
+@click.option('--n_seeds', default=3, help='number of synthetic depth maps')
+def main(n_rays, n_iters, width, height, n_steps, eval_every, target_abs_rel, n_seeds):
+    """
+    Time RaySampler against the meshgrid + randperm of every step, and compare the convergence of
+    uniform and importance sampling on a toy depth fitting problem
+    """
+    for img_size in [(1220, 370), (640, 480)]:
+        t_randperm, t_uniform, t_importance = time_sampling(img_size, n_rays, n_iters)
+        print("{}x{}, {} rays: meshgrid + randperm {:.3f}ms, uniform {:.3f}ms, importance {:.3f}ms".format(
+            img_size[0], img_size[1], n_rays, t_randperm * 1e3, t_uniform * 1e3, t_importance * 1e3))
+
+    print("Steps to reach abs_rel {} (final abs_rel)".format(target_abs_rel))
+    for seed in range(n_seeds):
+        depth = synthetic_depth(width, height, seed)
+        results = []
+        for mode in ["uniform", "importance"]:
+            curve = fit_depth(depth, mode, n_rays, n_steps, eval_every, seed)
+            results.append("{}: {} ({:.4f})".format(mode, steps_to_reach(curve, target_abs_rel), curve[-1][1]))
+        print("  scene {}: {}".format(seed, ", ".join(results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import functools
+import os
+import pickle
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from scenerf.data.utils import fusion
+from scenerf.data.utils.recon_archive import load_recon_arrays, save_recon_arrays
+from scenerf.scripts.benchmark_tsdf_integration import bf_frames
+
+
+def recon_frame(n_frames):
+    """
+    Reconstruction of a frame of the size of depth2tsdf_bf.py and generate_sc_gt_bf.py
+    ------
+    return
+    arrays of the tsdf and of the sc_gt files
+    """
+    vol_bnds, voxel_size, cam_K, frames = bf_frames(n_frames)
+    tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10, use_gpu=False)
+    colors, depths, poses = zip(*frames)
+    tsdf_vol.integrate_many(colors, depths, cam_K, poses)
+    verts, faces, norms, colors = tsdf_vol.get_mesh()
+    tsdf_grid, _ = tsdf_vol.get_volume()
+    occ = np.zeros_like(tsdf_grid) + 255
+    occ[(tsdf_grid > voxel_size) & (tsdf_grid != 255)] = 0
+    occ[(abs(tsdf_grid) < voxel_size) & (tsdf_grid != 255)] = 1
+    tsdf = {"tsdf_grid": tsdf_grid, "verts": verts, "faces": faces, "norms": norms, "colors": colors}
+    return tsdf, {"tsdf_grid": tsdf_grid, "occ": occ.astype(np.uint8)}
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) / 2 ** 20
+
+
+def drop_page_cache(path):
+    """Evict the files of path from the page cache so that the loads read the disk (Linux)"""
+    for f in os.listdir(path):
+        fd = os.open(os.path.join(path, f), os.O_RDONLY)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.close(fd)
+
+
+def load_pickles(tsdf_dir, gt_dir, frame_id):
+    with open(os.path.join(gt_dir, "{}.pkl".format(frame_id)), "rb") as f:
+        target = pickle.load(f)["occ"]
+    with open(os.path.join(tsdf_dir, "{}.pkl".format(frame_id)), "rb") as f:
+        tsdf_grid = pickle.load(f)["tsdf_grid"]
+    return target, tsdf_grid
+
+
+def load_archives(tsdf_dir, gt_dir, frame_id, mmap=False):
+    target, = load_recon_arrays(gt_dir, frame_id, ["occ"], mmap=mmap)
+    tsdf_grid, = load_recon_arrays(tsdf_dir, frame_id, ["tsdf_grid"], mmap=mmap)
+    return target, tsdf_grid
+
+
+@click.command()
+@click.option('--n_frames', default=100, help='number of frames of the evaluation loop')
+@click.option('--n_integrated', default=20, help='number of frames integrated in the reconstruction')
+@click.option('--cold/--warm', default=True, help='drop the files from the page cache before each pass')
+def main(n_frames, n_integrated, cold):
+    """
+    Size and load time of the tsdf_grid and occ arrays of the SC evaluation loop of eval_sc_bf.py
+    with the legacy per frame pickles and with the archives of save_recon_arrays, all deflated or
+    with tsdf_grid stored (as written by the reconstruction scripts) and memory mapped
+    """
+    tsdf, sc_gt = recon_frame(n_integrated)
+    print("tsdf_grid {}, mesh of {} vertices".format(sc_gt["tsdf_grid"].shape, len(tsdf["verts"])))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        formats = [
+            ("pickle", load_pickles, None),
+            ("npz, deflated", load_archives, ()),
+            ("npz, stored tsdf_grid", load_archives, ("tsdf_grid",)),
+            ("npz, stored tsdf_grid, mmap", functools.partial(load_archives, mmap=True), ("tsdf_grid",)),
+        ]
+        for name, load, stored in formats:
+            tsdf_dir = os.path.join(tmp_dir, name, "tsdf")
+            gt_dir = os.path.join(tmp_dir, name, "sc_gt")
+            os.makedirs(tsdf_dir)
+            os.makedirs(gt_dir)
+            t = time.time()
+            for frame_id in range(n_frames):
+                if stored is None:
+                    for save_dir, data in [(tsdf_dir, tsdf), (gt_dir, sc_gt)]:
+                        with open(os.path.join(save_dir, "{}.pkl".format(frame_id)), "wb") as handle:
+                            pickle.dump(data, handle)
+                else:
+                    save_recon_arrays(tsdf_dir, frame_id, tsdf, stored=stored)
+                    save_recon_arrays(gt_dir, frame_id, sc_gt, stored=stored)
+            t_write = (time.time() - t) / n_frames
+            if cold:
+                drop_page_cache(tsdf_dir)
+                drop_page_cache(gt_dir)
+
+            t = time.time()
+            n_occupied = 0
+            for frame_id in range(n_frames):
+                target, tsdf_grid = load(tsdf_dir, gt_dir, frame_id)
+                # What the evaluation loop computes from the arrays
+                n_occupied += int(np.sum((np.abs(tsdf_grid) < 0.04) & (target == 1)))
+            t_read = (time.time() - t) / n_frames
+            print("  {:<28} {:6.2f}MB + {:5.2f}MB per frame, write {:6.1f}ms, load {:6.1f}ms per frame".format(
+                name, dir_size(tsdf_dir) / n_frames, dir_size(gt_dir) / n_frames, t_write * 1e3, t_read * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import time
+
+import click
+import numpy as np
+
+from scenerf.data.utils import fusion
+from scenerf.data.utils.synthetic_scene import (
+    KITTI_TR, random_room, random_street, render, room_trajectory, street_trajectory)
+
+
+def kitti_frames(n_frames, image_size=(1220, 370), max_depth=80.0, seed=0):
+    """
+    Depths of a synthetic street in the volume of depth2tsdf.py (velodyne frame of the first frame)
+    ------
+    return
+    volume bounds, voxel size, cam_K, list of (rgb, depth, cam to volume pose)
+    """
+    width, height = image_size
+    cam_K = np.array([[707.0912, 0, 601.8873], [0, 707.0912, 183.1104], [0, 0, 1]])
+    scene = random_street(np.random.RandomState(seed), length=n_frames + 80)
+    frames = []
+    for pose in street_trajectory(n_frames):
+        rgb, depth = render(scene, cam_K, width, height, pose)
+        depth[depth > max_depth] = 0
+        frames.append((rgb.astype(np.float32), depth, np.linalg.inv(KITTI_TR) @ pose))
+    vol_bnds = np.array([[0, 51.2], [-25.6, 25.6], [-2, 4.4]])
+    return vol_bnds, 0.2, cam_K, frames
+
+
+def bf_frames(n_frames, image_size=(640, 480), seed=0):
+    """
+    Depths of a synthetic room in a volume of the size used by depth2tsdf_bf.py, centered on the room
+    """
+    width, height = image_size
+    cam_K = np.array([[585.0, 0, (width - 1) / 2], [0, 585.0, (height - 1) / 2], [0, 0, 1]])
+    scene = random_room(np.random.RandomState(seed))
+    frames = []
+    for pose in room_trajectory(n_frames):
+        rgb, depth = render(scene, cam_K, width, height, pose)
+        frames.append((rgb.astype(np.float32), depth, pose))
+    vol_bnds = np.array([[-2.4, 2.4], [0, 3.84], [-2.4, 2.4]])
+    return vol_bnds, 0.04, cam_K, frames
+
+
+def integrate_frames(vol_bnds, voxel_size, cam_K, frames, **kwargs):
+    """
+    return
+    volume, per frame integration times
+    """
+    tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10, use_gpu=False, **kwargs)
+    # Compile the numba kernels
+    rgb, depth, pose = frames[0]
+    fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, use_gpu=False, **kwargs).integrate(rgb, depth, cam_K, pose)
+
+    times = []
+    for rgb, depth, pose in frames:
+        t = time.time()
+        tsdf_vol.integrate(rgb, depth, cam_K, pose, obs_weight=1.)
+        times.append(time.time() - t)
+    return tsdf_vol, np.array(times)
+
+
+def integrate_stack(vol_bnds, voxel_size, cam_K, frames, **kwargs):
+    """
+    return
+    volume, time of the integration of all the frames with integrate_many
+    """
+    colors, depths, poses = [np.stack(x) for x in zip(*frames)]
+    # Compile the numba kernels
+    fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, use_gpu=False, **kwargs).integrate_many(
+        colors[:1], depths[:1], cam_K, poses[:1])
+
+    tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10, use_gpu=False, **kwargs)
+    t = time.time()
+    tsdf_vol.integrate_many(colors, depths, cam_K, poses, obs_weight=1.)
+    return tsdf_vol, time.time() - t
+
+
+def assert_same_volumes(ref_vol, tsdf_vol):
+    for name in ["_tsdf_vol_cpu", "_weight_vol_cpu", "_color_vol_cpu"]:
+        assert np.array_equal(getattr(ref_vol, name), getattr(tsdf_vol, name)), name
+
+
+@click.command()
+@click.option('--dataset', default="kitti", help='kitti or bf')
+@click.option('--n_frames', default=20, help='number of integrated frames')
+def main(dataset, n_frames):
+    """
+    Per frame CPU integration time of TSDFVolume with and without frustum culling, for both CPU
+    kernels, and of the integration of all the frames in one integrate_many call
+    """
+    if dataset == "kitti":
+        vol_bnds, voxel_size, cam_K, frames = kitti_frames(n_frames)
+    else:
+        vol_bnds, voxel_size, cam_K, frames = bf_frames(n_frames)
+
+    ref_vol, ref_times = integrate_frames(vol_bnds, voxel_size, cam_K, frames,
+                                          frustum_culling=False, cpu_kernel="numpy")
+    n_blocks = np.mean([ref_vol.frustum_block_ids(depth, cam_K, pose).shape[0] for _, depth, pose in frames])
+    print("{}: {} frames, {:.0f}% of the voxels kept by the frustum culling".format(
+        dataset, n_frames, 100 * n_blocks / (len(ref_vol._block_corners) // 8)))
+    print("  numpy kernel, all the voxels:      {:.1f}ms per frame, {:.1f} fps".format(
+        1e3 * ref_times.mean(), 1 / ref_times.mean()))
+    for cpu_kernel, frustum_culling in [("numpy", True), ("fused", False), ("fused", True)]:
+        tsdf_vol, times = integrate_frames(vol_bnds, voxel_size, cam_K, frames,
+                                           frustum_culling=frustum_culling, cpu_kernel=cpu_kernel)
+        assert_same_volumes(ref_vol, tsdf_vol)
+        print("  {} kernel, {:<20} {:.1f}ms per frame, {:.1f} fps, identical volumes".format(
+            cpu_kernel, "frustum culling:" if frustum_culling else "all the voxels:",
+            1e3 * times.mean(), 1 / times.mean()))
+    tsdf_vol, t = integrate_stack(vol_bnds, voxel_size, cam_K, frames)
+    assert_same_volumes(ref_vol, tsdf_vol)
+    print("  integrate_many, frustum culling:   {:.1f}ms per frame, {:.1f} fps, identical volumes".format(
+        1e3 * t / n_frames, n_frames / t))
+
+if __name__ == "__main__":
+    main()
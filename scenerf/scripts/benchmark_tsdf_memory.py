@@ -0,0 +1,77 @@
+import time
+
+import click
+import numpy as np
+
+from scenerf.data.utils import fusion
+from scenerf.scripts.benchmark_tsdf_integration import kitti_frames
+
+# float32 TSDF and weight, uint8 RGB
+VOXEL_NBYTES = 4 + 4 + 3
+
+
+def dense_nbytes(vol_bnds, voxel_size):
+    """Bytes of the TSDF, weight and color volumes of TSDFVolume"""
+    vol_dim = np.ceil((vol_bnds[:, 1] - vol_bnds[:, 0]) / voxel_size).astype(int)
+    return VOXEL_NBYTES * int(np.prod(vol_dim))
+
+
+def fuse_sparse(vol_bnds, voxel_size, cam_K, frames):
+    """
+    return
+    volume, integration time
+    """
+    tsdf_vol = fusion.SparseTSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10)
+    colors, depths, poses = zip(*frames)
+    t = time.time()
+    tsdf_vol.integrate_many(colors, depths, cam_K, poses)
+    return tsdf_vol, time.time() - t
+
+
+def report(name, vol_bnds, voxel_size, tsdf_vol, t):
+    dense = dense_nbytes(vol_bnds, voxel_size)
+    allocated = VOXEL_NBYTES * tsdf_vol.n_allocated_blocks * tsdf_vol._block_size ** 3
+    print("  {:<20} dense {:7.1f}MB, sparse {:7.1f}MB in {} blocks ({:.1f}%), {:7.1f}MB with the free slots, "
+          "{:.2f}s".format(name, dense / 2 ** 20, allocated / 2 ** 20, tsdf_vol.n_allocated_blocks,
+                           100 * allocated / dense, tsdf_vol.nbytes / 2 ** 20, t))
+
+
+@click.command()
+@click.option('--n_frames', default=20, help='number of integrated frames of a KITTI scene')
+@click.option('--sequence_length', default=200, help='number of frames of the sequence, one per meter')
+@click.option('--sequence_voxel_size', default=0.2, help='voxel size of the fusion of the sequence')
+def main(n_frames, sequence_length, sequence_voxel_size):
+    """
+    Memory of SparseTSDFVolume against the dense volumes of TSDFVolume, on synthetic KITTI frames:
+    the 51.2m scene of depth2tsdf.py at several voxel sizes, and the fusion of a whole sequence
+    """
+    # Compile the numba kernels
+    vol_bnds, _, cam_K, frames = kitti_frames(1)
+    fuse_sparse(vol_bnds, 0.8, cam_K, frames)
+
+    vol_bnds, voxel_size, cam_K, frames = kitti_frames(n_frames)
+    print("KITTI scene, {} frames".format(n_frames))
+    for scale in [1, 2, 4]:
+        tsdf_vol, t = fuse_sparse(vol_bnds, voxel_size / scale, cam_K, frames)
+        if scale == 1:
+            # Same volumes as TSDFVolume
+            dense_vol = fusion.TSDFVolume(vol_bnds.copy(), voxel_size=voxel_size, trunc_margin=10, use_gpu=False)
+            colors, depths, poses = zip(*frames)
+            dense_vol.integrate_many(colors, depths, cam_K, poses)
+            tsdf, color = tsdf_vol.get_volume()
+            weight = tsdf_vol.to_dense(tsdf_vol._weight_blocks, 0)
+            assert np.array_equal(tsdf, dense_vol._tsdf_vol_cpu)
+            assert np.array_equal(weight, dense_vol._weight_vol_cpu)
+            assert np.array_equal(color, dense_vol._color_vol_cpu)
+        report("voxel size {:.3f}m".format(voxel_size / scale), vol_bnds, voxel_size / scale, tsdf_vol, t)
+
+    # Volume along the whole trajectory, in the velodyne frame of the first frame
+    _, _, cam_K, frames = kitti_frames(sequence_length)
+    vol_bnds = np.array([[0, sequence_length + 51.2], [-25.6, 25.6], [-2, 4.4]])
+    print("KITTI sequence, {} frames".format(sequence_length))
+    tsdf_vol, t = fuse_sparse(vol_bnds, sequence_voxel_size, cam_K, frames)
+    report("voxel size {:.3f}m".format(sequence_voxel_size), vol_bnds, sequence_voxel_size, tsdf_vol, t)
+
+
+if __name__ == "__main__":
+    main()
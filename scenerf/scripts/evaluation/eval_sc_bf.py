@@ -6,7 +6,7 @@ from tqdm import tqdm
 from PIL import Image
 import click
 from scenerf.loss.sscMetrics import SSCMetrics
-import pickle
+from scenerf.data.utils.recon_archive import load_recon_arrays
 from scenerf.loss.depth_metrics import compute_depth_errors
 
 torch.set_grad_enabled(False)
@@ -85,20 +85,11 @@ def main(root, dataset, bs, n_gpus, n_workers_per_gpu, model_name, recon_save_di
             sequence = batch['sequence'][i]
 
             gt_save_dir = os.path.join(recon_save_dir, "sc_gt", sequence)
-            gt_save_filepath = os.path.join(gt_save_dir, "{}.pkl".format(frame_id))
-
-            with open(gt_save_filepath, "rb") as f:
-                data = pickle.load(f)
-                target = data["occ"]
+            # Only the needed arrays are read, the stored tsdf_grid is memory mapped
+            target, = load_recon_arrays(gt_save_dir, frame_id, ["occ"])
             
             tsdf_save_dir = os.path.join(recon_save_dir, "tsdf", sequence)
-            os.makedirs(tsdf_save_dir, exist_ok=True)
-            tsdf_save_filepath = os.path.join(tsdf_save_dir, "{}.pkl".format(frame_id))
-
-
-            with open(tsdf_save_filepath, "rb") as f:
-                data = pickle.load(f)
-                tsdf_grid = data["tsdf_grid"]
+            tsdf_grid, = load_recon_arrays(tsdf_save_dir, frame_id, ["tsdf_grid"], mmap=True)
 
             voxel_size = 0.04
             occ = tsdf2occ(tsdf_grid, 
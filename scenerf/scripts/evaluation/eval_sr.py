@@ -53,6 +53,7 @@ def main(
             preprocess_root=preprocess_root,
             sequence_distance=sequence_distance,
             n_sources=1000, # Get all frames in sequence
+            lazy_sources=True, # Load the source frames on access
             frames_interval=frames_interval,
             batch_size=bs,
             num_workers=4,
@@ -70,7 +71,8 @@ def main(
                 frame_id = batch['frame_id'][i]
                 target_1_1 = batch['target_1_1'][i]
                 sequence = batch['sequence'][i]
-                fov_mask = batch['fov_mask_1'][i].reshape(target_1_1.shape)
+                _, fov_mask, _ = data_module.val_ds.get_vox2pix(sequence, 1)
+                fov_mask = torch.from_numpy(np.array(fov_mask)).reshape(target_1_1.shape)
                 
                 tsdf_save_dir = os.path.join(recon_save_dir, "tsdf", sequence)   
                 tsdf_save_path = os.path.join(tsdf_save_dir, frame_id + ".npy")
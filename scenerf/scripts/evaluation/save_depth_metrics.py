@@ -48,6 +48,7 @@ def main(
         preprocess_root=preprocess_root,
         sequence_distance=sequence_distance,
         n_sources=1000, # Get all frames in sequence
+        lazy_sources=True, # Load the source frames on access
         frames_interval=frames_interval,
         batch_size=bs,
         num_workers=4,
@@ -53,6 +53,7 @@ def main(
         batch_size=int(bs / n_gpus),
         num_workers=int(n_workers_per_gpu),
         n_sources=1000,
+        lazy_sources=True, # Load the source frames on access
     )
     data_module.setup_val_ds()
     data_loader = data_module.val_dataloader(shuffle=True)
@@ -0,0 +1,48 @@
+import os
+import time
+
+import click
+
+from scenerf.data.utils.synthetic_scene import BF_SCENES, write_bundlefusion_scene, write_kitti_sequence
+
+
+@click.group()
+def main():
+    """Write procedural scenes in the dataset layouts, to run the benchmarks without the real data"""
+    pass
+
+
+@main.command()
+@click.option('--root', default="", help='output folder, used as the bundlefusion root')
+@click.option('--scenes', default=",".join(BF_SCENES), help='comma separated list of scenes')
+@click.option('--n_frames', default=100, help='number of frames per scene')
+@click.option('--width', default=640, help='image width')
+@click.option('--height', default=480, help='image height')
+@click.option('--n_boxes', default=8, help='number of boxes in each room')
+@click.option('--seed', default=0, help='random seed of the first scene')
+def bundlefusion(root, scenes, n_frames, width, height, n_boxes, seed):
+    """Synthetic rooms in the layout read by BundlefusionDataset"""
+    for i, scene_name in enumerate(scenes.split(",")):
+        start_time = time.time()
+        write_bundlefusion_scene(
+            os.path.join(root, scene_name), n_frames=n_frames, width=width, height=height,
+            n_boxes=n_boxes, seed=seed + i)
+        print("{}: {} frames in {:.1f}s".format(scene_name, n_frames, time.time() - start_time))
+
+
+@main.command()
+@click.option('--root', default="", help='output folder, used as the kitti root')
+@click.option('--sequences', default="08", help='comma separated list of sequences')
+@click.option('--n_frames', default=100, help='number of frames per sequence')
+@click.option('--n_azimuth', default=1024, help='number of lidar points per beam')
+@click.option('--seed', default=0, help='random seed of the first sequence')
+def kitti(root, sequences, n_frames, n_azimuth, seed):
+    """Synthetic streets in the layout read by KittiDataset"""
+    for i, sequence in enumerate(sequences.split(",")):
+        start_time = time.time()
+        write_kitti_sequence(root, sequence, n_frames=n_frames, n_azimuth=n_azimuth, seed=seed + i)
+        print("{}: {} frames in {:.1f}s".format(sequence, n_frames, time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
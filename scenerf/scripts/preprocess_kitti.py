@@ -0,0 +1,182 @@
+import glob
+import os
+import pickle
+from multiprocessing import Pool
+
+import click
+import numpy as np
+from tqdm import tqdm
+
+from scenerf.data.semantic_kitti.kitti_dataset import (
+    KittiDataset, lidar_depth_path, save_lidar_depth, compute_source_transformation)
+from scenerf.data.semantic_kitti.label_store import label_store_path, save_sequence_labels
+from scenerf.data.semantic_kitti.transform_store import (
+    TransformStore, transform_store_path, transform_key, make_records)
+from scenerf.data.utils.helpers import read_calib
+
+
+SEQUENCES = ["00", "01", "02", "03", "04", "05", "06", "07", "08", "09", "10"]
+
+
+def _save_lidar_depth(args):
+    return save_lidar_depth(*args)
+
+
+def _save_sequence_labels(args):
+    return save_sequence_labels(*args)
+
+
+def _compute_source_transformation(args):
+    key, scan, source_id = args
+    T_out_dict = compute_source_transformation(scan, source_id)
+    return key, T_out_dict["T_source2infer"], T_out_dict["T_source2target"]
+
+
+def read_legacy_transforms(transform_preprocess_root, frames_interval):
+    """Records of the per frame pickles written by the previous versions of KittiDataset"""
+    keys, T_source2infers, T_source2targets = [], [], []
+    pattern = os.path.join(transform_preprocess_root, "*_{}_all".format(frames_interval), "*.pkl")
+    for transform_path in glob.glob(pattern):
+        sequence = os.path.basename(os.path.dirname(transform_path)).split("_")[0]
+        frame_id = os.path.splitext(os.path.basename(transform_path))[0]
+        try:
+            with open(transform_path, "rb") as input_file:
+                transform_data = pickle.load(input_file)
+        except (EOFError, pickle.UnpicklingError):
+            # truncated by concurrent writers
+            continue
+        for source_id, T_out_dict in transform_data.items():
+            keys.append(transform_key(sequence, frame_id, source_id))
+            T_source2infers.append(T_out_dict["T_source2infer"])
+            T_source2targets.append(T_out_dict["T_source2target"])
+    if len(keys) == 0:
+        return None
+    return make_records(keys, np.stack(T_source2infers), np.stack(T_source2targets))
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--root', default="", help='path to dataset folder')
+@click.option('--preprocess_root', default="", help='path to preprocess folder')
+@click.option('--sequences', default=",".join(SEQUENCES), help='comma separated list of sequences')
+@click.option('--n_workers', default=8, help='number of processes')
+@click.option('--overwrite', default=False, help='recompute the frames already in the store')
+def precompute_depths(root, preprocess_root, sequences, n_workers, overwrite):
+    """Project every lidar scan in the image and store the sparse depths in preprocess_root/depth"""
+    depth_preprocess_root = os.path.join(preprocess_root, "depth")
+    image_size = (1220, 370)
+
+    jobs = []
+    for sequence in sequences.split(","):
+        calib = read_calib(
+            os.path.join(root, "dataset", "sequences", sequence, "calib.txt")
+        )
+        P = calib["P2"]
+        T_velo_2_cam = calib['T_cam0_2_cam2'] @ calib["Tr"]
+
+        lidar_paths = sorted(glob.glob(
+            os.path.join(root, "dataset", "sequences", sequence, "velodyne", "*.bin")))
+        for lidar_path in lidar_paths:
+            frame_id = os.path.splitext(os.path.basename(lidar_path))[0]
+            out_path = lidar_depth_path(depth_preprocess_root, sequence, frame_id)
+            if not overwrite and os.path.exists(out_path):
+                continue
+            jobs.append((lidar_path, P, T_velo_2_cam, image_size, out_path))
+
+    print("{} scans to project".format(len(jobs)))
+    n_pts = 0
+    with Pool(n_workers) as pool:
+        for n in tqdm(pool.imap_unordered(_save_lidar_depth, jobs, chunksize=16), total=len(jobs)):
+            n_pts += n
+    print("Saved {} points to {}".format(n_pts, depth_preprocess_root))
+
+
+@main.command()
+@click.option('--root', default="", help='path to dataset folder')
+@click.option('--preprocess_root', default="", help='path to preprocess folder')
+@click.option('--frames_interval', default=0.4, help='Interval between supervision frames')
+@click.option('--sequence_distance', default=10, help='Distance between the input and the last frames in the sequence')
+@click.option('--splits', default="train,val", help='comma separated list of splits')
+@click.option('--n_workers', default=8, help='number of processes')
+@click.option('--save_every', default=2000, help='number of transformations between two checkpoints')
+def precompute_transforms(root, preprocess_root, frames_interval, sequence_distance, splits, n_workers, save_every):
+    """
+    Run the ICPs of all the (frame, source) pairs of the splits and store the transformations
+    in a single store opened read-only by KittiDataset. Interrupted runs resume from the last checkpoint.
+    """
+    transform_preprocess_root = os.path.join(preprocess_root, "transform")
+    store_path = transform_store_path(transform_preprocess_root, frames_interval)
+
+    # Start from the store, the checkpoints of an interrupted run and the legacy per frame pickles
+    n_records = TransformStore.merge(
+        store_path, read_legacy_transforms(transform_preprocess_root, frames_interval))
+    store = TransformStore(store_path)
+    print("{} transformations in {}".format(n_records, store_path))
+
+    jobs = []
+    queued = set()
+    for split in splits.split(","):
+        ds = KittiDataset(
+            split=split,
+            root=root,
+            preprocess_root=preprocess_root,
+            frames_interval=frames_interval,
+            sequence_distance=sequence_distance)
+        for scan in ds.scans:
+            for source_id in range(1, len(scan["poses"])):
+                key = transform_key(scan["sequence"], scan["frame_id"], source_id)
+                if key in store or key in queued:
+                    continue
+                queued.add(key)
+                jobs.append((key, scan, source_id))
+    print("{} transformations to compute".format(len(jobs)))
+
+    results = []
+    with Pool(n_workers) as pool:
+        for result in tqdm(pool.imap_unordered(_compute_source_transformation, jobs, chunksize=4),
+                           total=len(jobs)):
+            results.append(result)
+            if len(results) == save_every:
+                TransformStore.save_part(store_path, make_records(*zip(*results)))
+                results = []
+    if len(results) > 0:
+        TransformStore.save_part(store_path, make_records(*zip(*results)))
+
+    n_records = TransformStore.merge(store_path)
+    print("Saved {} transformations to {}".format(n_records, store_path))
+
+
+
+@main.command()
+@click.option('--root', default="", help='path to dataset folder')
+@click.option('--preprocess_root', default="", help='path to preprocess folder')
+@click.option('--sequences', default=",".join(SEQUENCES), help='comma separated list of sequences')
+@click.option('--n_workers', default=8, help='number of processes')
+def precompute_labels(root, preprocess_root, sequences, n_workers):
+    """
+    Store the remapped uint8 voxel labels (255 for invalid) of each sequence
+    in a compressed archive preprocess_root/labels/<sequence>.npz
+    """
+    label_preprocess_root = os.path.join(preprocess_root, "labels")
+    jobs = []
+    for sequence in sequences.split(","):
+        voxel_dir = os.path.join(root, "dataset", "sequences", sequence, "voxels")
+        frames = []
+        for label_path in sorted(glob.glob(os.path.join(voxel_dir, "*.label"))):
+            frame_id = os.path.splitext(os.path.basename(label_path))[0]
+            frames.append((frame_id, label_path, os.path.join(voxel_dir, frame_id + ".invalid")))
+        if len(frames) > 0:
+            jobs.append((frames, label_store_path(label_preprocess_root, sequence)))
+
+    with Pool(min(n_workers, max(len(jobs), 1))) as pool:
+        list(tqdm(pool.imap_unordered(_save_sequence_labels, jobs), total=len(jobs)))
+    for _, out_path in jobs:
+        print("{}: {:.1f} MB".format(out_path, os.path.getsize(out_path) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from scenerf.data.semantic_kitti.kitti_dm import KittiDataModule
 from tqdm import tqdm
 import os
+import time
 import click
 import torch
 import imageio
@@ -37,12 +38,16 @@ torch.set_grad_enabled(False)
 @click.option('--preprocess_root', default="", help='path to preprocess folder')
 @click.option('--root', default="", help='path to dataset folder')
 @click.option('--recon_save_dir', default="")
+@click.option('--sparse_tsdf', default=False, help='fuse in a block sparse volume, same result with less memory')
+@click.option('--mesh_chunk_size', default=None, type=int, help='run marching cubes on chunks of mesh_chunk_size^3 voxels, on the whole volume by default')
+@click.option('--mesh_workers', default=0, help='processes running marching cubes on the chunks of the volume, 0 runs it in this process')
 def main(
         root, preprocess_root,
         bs, recon_save_dir,
         sequence_distance,
         frames_interval, 
         angle, step, max_distance,
+        sparse_tsdf, mesh_chunk_size, mesh_workers,
 ):
 
         
@@ -52,6 +57,7 @@ def main(
             preprocess_root=preprocess_root,
             sequence_distance=sequence_distance,
             n_sources=1000, # Get all frames in sequence
+            lazy_sources=True, # Load the source frames on access
             frames_interval=frames_interval,
             batch_size=bs,
             num_workers=4,
@@ -90,8 +96,12 @@ def main(
                 vol_bnds[:,0] = vox_origin
                 vol_bnds[:,1] = vox_origin + np.array([scene_size[0], scene_size[1], scene_size[2]])
 
-                tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=0.2)
+                if sparse_tsdf:
+                    tsdf_vol = fusion.SparseTSDFVolume(vol_bnds, voxel_size=0.2)
+                else:
+                    tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=0.2)
 
+                rgbs, depths, poses = [], [], []
                 for (step, angle), rel_pose in tqdm(rel_poses.items()):
                     rel_pose = rel_pose.numpy()
                     depth_filepath = os.path.join(depth_save_dir, "{}_{}_{}.npy".format(frame_id, step, angle))
@@ -100,11 +110,16 @@ def main(
                     render_rgb_filepath = os.path.join(render_rgb_save_dir, "{}_{}_{}.png".format(frame_id, step, angle))
                     rgb = read_rgb(render_rgb_filepath) * 255.0
 
-                    tsdf_vol.integrate(rgb, depth, cam_K, np.linalg.inv(T_velo2cam) @ rel_pose, obs_weight=1.)
-                    
+                    rgbs.append(rgb)
+                    depths.append(depth)
+                    poses.append(np.linalg.inv(T_velo2cam) @ rel_pose)
+
+                t = time.time()
+                tsdf_vol.integrate_many(rgbs, depths, cam_K, poses, obs_weight=1.)
+                print("integrated {} frames, {:.1f} fps".format(len(depths), len(depths) / (time.time() - t)))
                 
                 tsdf_grid, _ = tsdf_vol.get_volume()
-                verts, faces, norms, colors = tsdf_vol.get_mesh()
+                verts, faces, norms, colors = tsdf_vol.get_mesh(chunk_size=mesh_chunk_size, n_workers=mesh_workers)
                 
                 
                 np.save(tsdf_save_path, tsdf_grid)
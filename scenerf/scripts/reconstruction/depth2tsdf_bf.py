@@ -1,14 +1,15 @@
 from scenerf.data.bundlefusion.bundlefusion_dm import BundlefusionDM
 from scenerf.data.utils import fusion
+from scenerf.data.utils.recon_archive import save_recon_arrays
 from scenerf.models.utils import sample_rel_poses_bf
 
 import torch
 import numpy as np
 import os
+import time
 from tqdm import tqdm
 from PIL import Image
 import click
-import pickle
 from scenerf.loss.depth_metrics import compute_depth_errors
 
 
@@ -58,7 +59,9 @@ def evaluate_depth(gt_depth, pred_depth):
 @click.option('--angle', default=30)
 @click.option('--step', default=0.2)
 @click.option('--max_distance', default=2.1, help='max pose sample distance')
-def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir, max_distance, step, angle):
+@click.option('--mesh_chunk_size', default=None, type=int, help='run marching cubes on chunks of mesh_chunk_size^3 voxels, on the whole volume by default')
+@click.option('--mesh_workers', default=0, help='processes running marching cubes on the chunks of the volume, 0 runs it in this process')
+def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir, max_distance, step, angle, mesh_chunk_size, mesh_workers):
 
     data_module = BundlefusionDM(
         dataset,
@@ -87,7 +90,6 @@ def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir, max_dista
             
             tsdf_save_dir = os.path.join(recon_save_dir, "tsdf", sequence)
             os.makedirs(tsdf_save_dir, exist_ok=True)
-            save_filepath = os.path.join(tsdf_save_dir, "{}.pkl".format(frame_id))
  
 
 
@@ -103,6 +105,7 @@ def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir, max_dista
 
 
             rel_poses = sample_rel_poses_bf(angle, max_distance, step)
+            rgbs, depths, T_source2infers = [], [], []
             for (step, angle), rel_pose in tqdm(rel_poses.items()):
                 
                 T_source2infer = rel_pose
@@ -116,9 +119,15 @@ def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir, max_dista
                 depth = np.load(depth_filepath)
                 rgb = read_rgb(render_rgb_filepath) * 255
                 
-                tsdf_vol.integrate(rgb, depth, cam_K, T_source2infer, obs_weight=1.)
+                rgbs.append(rgb)
+                depths.append(depth)
+                T_source2infers.append(T_source2infer)
+
+            t = time.time()
+            tsdf_vol.integrate_many(rgbs, depths, cam_K, T_source2infers, obs_weight=1.)
+            print("integrated {} frames, {:.1f} fps".format(len(depths), len(depths) / (time.time() - t)))
            
-            verts, faces, norms, colors = tsdf_vol.get_mesh()
+            verts, faces, norms, colors = tsdf_vol.get_mesh(chunk_size=mesh_chunk_size, n_workers=mesh_workers)
             tsdf_grid, _ = tsdf_vol.get_volume() 
 
             data = {
@@ -129,9 +138,8 @@ def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir, max_dista
                     "colors": colors,
                 }
             
-            with open(save_filepath, "wb") as handle:
-                pickle.dump(data, handle)
-                print("wrote to", save_filepath)
+            save_filepath = save_recon_arrays(tsdf_save_dir, frame_id, data)
+            print("wrote to", save_filepath)
             
             
 
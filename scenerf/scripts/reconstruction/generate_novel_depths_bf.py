@@ -30,6 +30,75 @@ def disparity_normalization_vis(disparity):
 
 
 
+def render_novel_view(model, cam_K, T_source2infer, x_rgb, img_size=(640, 480), scale=2):
+    """
+    Render the depth and color seen from T_source2infer, on a grid of stride scale upsampled to img_size
+    ------
+    return
+    depth: (1, 1, H, W) tensor
+    color: (H, W, 3) numpy array in [0, 1]
+    """
+    xs = torch.arange(start=0, end=img_size[0], step=scale).type_as(cam_K)
+    ys = torch.arange(start=0, end=img_size[1], step=scale).type_as(cam_K)
+    grid_x, grid_y = torch.meshgrid(xs, ys)
+    rendered_im_size = grid_x.shape
+
+    sampled_pixels = torch.cat([
+        grid_x.unsqueeze(-1),
+        grid_y.unsqueeze(-1)
+    ], dim=2).reshape(-1, 2)
+
+
+    render_out_dict = model.render_rays_batch(cam_K,
+                                              T_source2infer.type_as(cam_K),
+                                              x_rgb,
+                                              ray_batch_size=8000,
+                                              sampled_pixels=sampled_pixels)
+    
+    depth_rendered = render_out_dict['depth'].reshape(rendered_im_size[0], rendered_im_size[1])
+    color_rendered = render_out_dict['color'].reshape(rendered_im_size[0], rendered_im_size[1], 3)
+
+    depth_rendered = F.interpolate(
+        depth_rendered.T.unsqueeze(0).unsqueeze(0) ,
+        scale_factor=scale,
+        mode="bilinear"
+    )
+    color_rendered = F.interpolate(
+        color_rendered.permute(2, 1, 0).unsqueeze(0) ,
+        scale_factor=scale,
+        mode="bilinear"
+    )
+
+    color_rendered_np = color_rendered.clamp(0, 1).detach().cpu().numpy().squeeze()
+
+    color_rendered_np = np.transpose(color_rendered_np, (1, 2, 0))
+    return depth_rendered, color_rendered_np
+
+
+def save_novel_view(depth_rendered, color_rendered_np, depth_filepath, render_rgb_filepath, depth_visual_filepath):
+    """Save the rendered depth (.npy), color (.png) and a colormapped disparity (.png)"""
+    print("color_rendered_np", color_rendered_np.min(), color_rendered_np.max())
+    plt.imsave(render_rgb_filepath, color_rendered_np)
+    print("Color saved {}".format(render_rgb_filepath))                
+
+    np.save(depth_filepath, depth_rendered.squeeze().detach().cpu().numpy())
+    print("saved depth", depth_filepath)
+
+    disp = depth2disp(depth_rendered, min_depth=0.1, max_depth=10.0).squeeze()
+    disp_resized = disp
+    disp_np = disp_resized.detach().cpu().numpy()
+    vmax = disp_np.max()
+    vmin = disp_np.min()
+    
+    normalizer = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+    mapper = cm.ScalarMappable(norm=normalizer, cmap='magma')
+    colormapped_im = (mapper.to_rgba(disp_np)[:, :, :3] * 255).astype(np.uint8)
+    im = pil.fromarray(colormapped_im)
+
+    im.save(depth_visual_filepath)
+    print("saved depth visual", depth_visual_filepath)
+
+
 @click.command()
 @click.option('--n_gpus', default=1, help='number of GPUs')
 @click.option('--bs', default=1, help='Batch size')
@@ -108,62 +177,9 @@ def main(root, dataset, bs, n_gpus, n_workers_per_gpu, model_path,
                         continue
 
 
-                    img_size = (640, 480)
-                    scale = 2
-                    xs = torch.arange(start=0, end=img_size[0], step=scale).type_as(cam_K)
-                    ys = torch.arange(start=0, end=img_size[1], step=scale).type_as(cam_K)
-                    grid_x, grid_y = torch.meshgrid(xs, ys)
-                    rendered_im_size = grid_x.shape
-
-                    sampled_pixels = torch.cat([
-                        grid_x.unsqueeze(-1),
-                        grid_y.unsqueeze(-1)
-                    ], dim=2).reshape(-1, 2)
-
-
-                    render_out_dict = model.render_rays_batch(cam_K,
-                                                              T_source2infer.type_as(cam_K),
-                                                              x_rgb,
-                                                              ray_batch_size=8000,
-                                                              sampled_pixels=sampled_pixels)
-                    
-                    depth_rendered = render_out_dict['depth'].reshape(rendered_im_size[0], rendered_im_size[1])
-                    color_rendered = render_out_dict['color'].reshape(rendered_im_size[0], rendered_im_size[1], 3)
-
-                    depth_rendered = F.interpolate(
-                        depth_rendered.T.unsqueeze(0).unsqueeze(0) ,
-                        scale_factor=scale,
-                        mode="bilinear"
-                    )
-                    color_rendered = F.interpolate(
-                        color_rendered.permute(2, 1, 0).unsqueeze(0) ,
-                        scale_factor=scale,
-                        mode="bilinear"
-                    )
-                
-                    color_rendered_np = color_rendered.clamp(0, 1).detach().cpu().numpy().squeeze()
-
-                    color_rendered_np = np.transpose(color_rendered_np, (1, 2, 0))
-                    print("color_rendered_np", color_rendered_np.min(), color_rendered_np.max())
-                    plt.imsave(render_rgb_filepath, color_rendered_np)
-                    print("Color saved {}".format(render_rgb_filepath))                
-
-                    np.save(depth_filepath, depth_rendered.squeeze().detach().cpu().numpy())
-                    print("saved depth", depth_filepath)
-
-                    disp = depth2disp(depth_rendered, min_depth=0.1, max_depth=10.0).squeeze()
-                    disp_resized = disp
-                    disp_np = disp_resized.detach().cpu().numpy()
-                    vmax = disp_np.max()
-                    vmin = disp_np.min()
-                    
-                    normalizer = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
-                    mapper = cm.ScalarMappable(norm=normalizer, cmap='magma')
-                    colormapped_im = (mapper.to_rgba(disp_np)[:, :, :3] * 255).astype(np.uint8)
-                    im = pil.fromarray(colormapped_im)
-
-                    im.save(depth_visual_filepath)
-                    print("saved depth visual", depth_visual_filepath)
+                    depth_rendered, color_rendered_np = render_novel_view(model, cam_K, T_source2infer, x_rgb)
+                    save_novel_view(depth_rendered, color_rendered_np,
+                                    depth_filepath, render_rgb_filepath, depth_visual_filepath)
 
 
 if __name__ == "__main__":
@@ -1,105 +1,148 @@
 from scenerf.data.bundlefusion.bundlefusion_dm import BundlefusionDM
+from scenerf.data.bundlefusion.bundlefusion_dataset import BundlefusionDataset, read_pose
 from scenerf.data.utils import fusion
-import torch
+from scenerf.data.utils.recon_archive import (
+    recon_exists, save_recon_arrays, read_recon_manifest, recon_manifest_path, append_recon_manifest)
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numba
 import numpy as np
 import os
+import time
 from tqdm import tqdm
 import click
-import pickle
 
 
-torch.set_grad_enabled(False)
+def _init_worker(n_threads):
+    # The processes share the cores, each fused integration runs on its share
+    numba.set_num_threads(n_threads)
+
+
+def generate_frame(job):
+    """
+    Integrate the source depths of a frame in a TSDF volume in its camera frame and write
+    the volume and its occupancy. Only the depths and poses are read, the voxel ground-truth
+    does not use the colors. A volume without free or without occupied voxels is not written.
+    ------
+    return
+    sequence, frame_id, error message or None
+    """
+    sequence, frame_id, cam_K, depth_shift, infer_pose_path, source_pose_paths, source_depth_paths, save_dir = job
+    infer_pose = read_pose(infer_pose_path)
+    # Same float32 transformations as the dataloader items
+    T_source2infers = [(np.linalg.inv(infer_pose) @ read_pose(path)).astype(np.float32)
+                       for path in source_pose_paths]
+    # The depth images are in 1 / depth_shift meters, the volume in meters
+    source_depths = [BundlefusionDataset._read_depth(path).astype(np.float32) / depth_shift
+                     for path in source_depth_paths]
+    blank = np.zeros(source_depths[0].shape + (3,), dtype=np.uint8)
+
+    voxel_size = 0.04
+    sx, sy, sz = 4.8, 4.8, 3.84
+    scene_size = (sx, sy, sz)
+    vox_origin = (-sx / 2, -sy / 2, 0)
+    vol_bnds = np.zeros((3, 2))
+    vol_bnds[:, 0] = vox_origin
+    vol_bnds[:, 1] = vox_origin + np.array([scene_size[0], scene_size[1], scene_size[2]])
+
+    tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10, use_gpu=False)
+    tsdf_vol.integrate_many([blank] * len(source_depths), source_depths, cam_K.astype(np.float32),
+                            T_source2infers, obs_weight=1.)
+    tsdf_grid, _ = tsdf_vol.get_volume()
+
+    occ = np.zeros_like(tsdf_grid) + 255
+    occ[(tsdf_grid > voxel_size) & (tsdf_grid != 255)] = 0  # the unknown voxels has tsdf value of 255
+    occ[(abs(tsdf_grid) < voxel_size) & (tsdf_grid != 255)] = 1
+
+    n_free, n_occupied = int(np.sum(occ == 0)), int(np.sum(occ == 1))
+    if n_free == 0 or n_occupied == 0:
+        return sequence, frame_id, "{} free and {} occupied voxels".format(n_free, n_occupied)
+
+    data = {
+        "tsdf_grid": tsdf_grid,
+        "occ": occ.astype(np.uint8),
+    }
+    save_recon_arrays(save_dir, frame_id, data)
+    return sequence, frame_id, None
+
+
+def generate_frames(jobs, n_workers):
+    """
+    Run generate_frame on the jobs, in this process when n_workers <= 1
+    ------
+    return
+    iterator of the results in completion order
+    """
+    if n_workers <= 1:
+        yield from map(generate_frame, jobs)
+        return
+    n_threads = max(1, numba.config.NUMBA_NUM_THREADS // n_workers)
+    # The workers run the parallel numba kernels, their threading layer is not fork-safe
+    context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(n_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(n_threads,)) as executor:
+        futures = [executor.submit(generate_frame, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
 
 
 @click.command()
-@click.option('--n_gpus', default=1, help='number of GPUs')
-@click.option('--bs', default=1, help='Batch size')
-@click.option('--n_workers_per_gpu', default=3, help='number of workers per GPU')
+@click.option('--n_workers', default=4, help='number of processes, each integrating a frame (<= 1: in this process)')
 @click.option('--dataset', default='bf', help='bf or tum_rgbd dataset to eval on')
 @click.option('--root', default="", help='path to dataset folder')
 @click.option('--recon_save_dir')
-def main(root, dataset, bs, n_gpus, n_workers_per_gpu, recon_save_dir):
-
+def main(root, dataset, n_workers, recon_save_dir):
+    """
+    Write the voxel ground-truth of the val frames in recon_save_dir/sc_gt/{sequence}/{frame_id}.npz.
+    The frames are distributed to a process pool, the completed frames are listed in
+    recon_save_dir/sc_gt/manifest.txt and skipped by the next runs.
+    """
     data_module = BundlefusionDM(
         dataset,
         root=root,
-        batch_size=int(bs / n_gpus),
-        num_workers=int(n_workers_per_gpu),
         n_sources=1000,
         train_n_frames=16,
         val_n_frames=16,
         val_frame_interval=2
     )
-    data_module.setup()
-    data_loader = data_module.val_dataloader(shuffle=False)
-
-    for batch in tqdm(data_loader):
-
-        for i in range(bs):
-            cam_K = batch['cam_K_depth'][i].numpy()
-            inv_K = np.linalg.inv(cam_K)
-            # inv_K = torch.inverse(cam_K)
-            frame_id = batch['frame_id'][i]
-           
-            sequence = batch['sequence'][i]
-            infer_depth = batch['infer_depths'][i].numpy()
-            
-            
-            save_dir = os.path.join(recon_save_dir, "sc_gt")
-            save_dir = os.path.join(save_dir, sequence)
-            if not os.path.exists(save_dir):
-                os.makedirs(save_dir)
-            save_filepath = os.path.join(save_dir, "{}.pkl".format(frame_id))
-            if os.path.exists(save_filepath):
-                print("exist", save_filepath)
+    data_module.setup_val_ds()
+    val_ds = data_module.val_ds
+
+    gt_save_dir = os.path.join(recon_save_dir, "sc_gt")
+    os.makedirs(gt_save_dir, exist_ok=True)
+    done = read_recon_manifest(gt_save_dir)
+    with open(recon_manifest_path(gt_save_dir), "a") as manifest_file:
+        jobs = []
+        depth_shifts = {}
+        for index, scan in enumerate(val_ds.scans):
+            # With more sources than frames in the window, every frame but the input is a source
+            plan, _ = val_ds.plan_item(index)
+            sequence, frame_id = scan["sequence"], plan["frame_id"]
+            if (sequence, frame_id) in done:
                 continue
-
-            source_depths = batch['source_depths'][i]
-            img_sources = batch["img_sources"][i]
-            T_source2infers = batch["T_source2infers"][i]
-
-
-           
-            voxel_size = 0.04
-            sx, sy, sz = 4.8, 4.8, 3.84
-            scene_size = (sx, sy, sz)
-            vox_origin = (-sx / 2, -sy / 2, 0)
-            vol_bnds = np.zeros((3,2))
-            vol_bnds[:,0] = vox_origin
-            vol_bnds[:,1] = vox_origin + np.array([scene_size[0], scene_size[1], scene_size[2]])
-
-            tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10)
-            
-            for source_id in tqdm(range(len(img_sources))):
-                
-                T_source2infer = T_source2infers[source_id].numpy()
-                source_depth = source_depths[source_id]
-                img_source = img_sources[source_id]
-
-                source_depth = torch.from_numpy(source_depth).unsqueeze(0).unsqueeze(0)
-                source_depth = torch.nn.functional.interpolate(source_depth, size=(480, 640), mode='bilinear', align_corners=False).squeeze()
-               
-                rgb = img_source.permute(1, 2, 0).numpy() * 255
-
-                tsdf_vol.integrate(rgb, source_depth, cam_K, T_source2infer, obs_weight=1.)
-                
-           
-            verts, faces, norms, colors = tsdf_vol.get_mesh()
-            tsdf_grid, _ = tsdf_vol.get_volume() 
-
-            occ = np.zeros_like(tsdf_grid) + 255
-            occ[(tsdf_grid > voxel_size)& (tsdf_grid != 255)] = 0 # the unknown voxels has tsdf value of 255
-            occ[(abs(tsdf_grid) < voxel_size) & (tsdf_grid != 255)] = 1
-            
-            data = {
-                    "tsdf_grid": tsdf_grid,
-                    "occ": occ.astype(np.uint8),
-                }
-                
-            with open(save_filepath, "wb") as handle:
-                pickle.dump(data, handle)
-                print(data['tsdf_grid'].shape)
-                print("wrote to", save_filepath)
+            save_dir = os.path.join(gt_save_dir, sequence)
+            if recon_exists(save_dir, frame_id):
+                # Written before the manifest
+                append_recon_manifest(manifest_file, sequence, frame_id)
+                continue
+            os.makedirs(save_dir, exist_ok=True)
+            if sequence not in depth_shifts:
+                depth_shifts[sequence] = BundlefusionDataset.read_depth_shift(
+                    os.path.join(root, sequence, "info.txt"))
+            jobs.append((sequence, frame_id, scan["cam_K_depth"], depth_shifts[sequence],
+                         plan["infer_pose_path"], plan["source_pose_paths"], plan["source_depth_paths"], save_dir))
+        print("{} frames done, {} frames to generate".format(len(val_ds.scans) - len(jobs), len(jobs)))
+
+        t = time.time()
+        n_failed = 0
+        for sequence, frame_id, error in tqdm(generate_frames(jobs, n_workers), total=len(jobs)):
+            if error is not None:
+                n_failed += 1
+                print("failed", sequence, frame_id, error)
+                continue
+            append_recon_manifest(manifest_file, sequence, frame_id)
+        print("generated {} frames, {} failed, {:.2f} frames per second".format(
+            len(jobs) - n_failed, n_failed, len(jobs) / (time.time() - t)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import glob
+import os
+import pickle
+from multiprocessing import Pool
+
+import click
+import numpy as np
+from tqdm import tqdm
+
+from scenerf.data.utils.recon_archive import ArrayArchive, recon_archive_path, save_recon_arrays
+
+
+def migrate_pickle(args):
+    """
+    Convert a per frame pickle of depth2tsdf_bf.py, reconstruct_bf.py or generate_sc_gt_bf.py
+    to an archive and check the archive reads back the same arrays
+    ------
+    return
+    pickle path, error message or None
+    """
+    pickle_path, remove = args
+    try:
+        return pickle_path, _migrate_pickle(pickle_path, remove)
+    except Exception as e:
+        # reported by the main process, the other pickles are still converted
+        return pickle_path, "{}: {}".format(type(e).__name__, e)
+
+
+def _migrate_pickle(pickle_path, remove):
+    """
+    return
+    error message or None
+    """
+    save_dir = os.path.dirname(pickle_path)
+    frame_id = os.path.splitext(os.path.basename(pickle_path))[0]
+    try:
+        with open(pickle_path, "rb") as f:
+            data = pickle.load(f)
+    except (EOFError, pickle.UnpicklingError):
+        # truncated by an interrupted run
+        return "unreadable pickle"
+    data = {name: np.asarray(array) for name, array in data.items()}
+    path = save_recon_arrays(save_dir, frame_id, data)
+    with ArrayArchive(path) as archive:
+        same = sorted(archive.files) == sorted(data)
+        for name, array in data.items():
+            if not same:
+                break
+            read = archive[name]
+            same = read.dtype == array.dtype and np.array_equal(read, array)
+    if not same:
+        os.remove(path)
+        return "different arrays read back"
+    if remove:
+        os.remove(pickle_path)
+    return None
+
+
+@click.command()
+@click.option('--recon_save_dir', help='recon_save_dir of the reconstruction scripts')
+@click.option('--n_workers', default=4, help='number of processes')
+@click.option('--remove', default=False, help='remove the pickles once their archive is checked')
+def main(recon_save_dir, n_workers, remove):
+    """
+    Convert the tsdf/{sequence}/{frame_id}.pkl and sc_gt/{sequence}/{frame_id}.pkl files written by
+    the previous versions of the reconstruction scripts to the .npz archives of recon_archive.py.
+    The frames which already have an archive are skipped.
+    """
+    jobs = []
+    for pickle_path in sorted(glob.glob(os.path.join(recon_save_dir, "*", "*", "*.pkl"))):
+        frame_id = os.path.splitext(os.path.basename(pickle_path))[0]
+        if os.path.exists(recon_archive_path(os.path.dirname(pickle_path), frame_id)):
+            continue
+        jobs.append((pickle_path, remove))
+    print("{} pickles to convert".format(len(jobs)))
+
+    n_failed = 0
+    with Pool(n_workers) as pool:
+        for pickle_path, error in tqdm(pool.imap_unordered(migrate_pickle, jobs), total=len(jobs)):
+            if error is not None:
+                n_failed += 1
+                print("failed", pickle_path, error)
+    print("Converted {} pickles, {} failed".format(len(jobs) - n_failed, n_failed))
+
+
+if __name__ == "__main__":
+    main()
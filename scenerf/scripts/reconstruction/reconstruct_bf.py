@@ -0,0 +1,133 @@
+import functools
+import os
+import time
+
+import click
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from scenerf.data.bundlefusion.bundlefusion_dm import BundlefusionDM
+from scenerf.data.utils import fusion
+from scenerf.data.utils.recon_archive import recon_exists, save_recon_arrays
+from scenerf.models.scenerf_bf import SceneRF
+from scenerf.models.utils import sample_rel_poses_bf
+from scenerf.scripts.reconstruction.generate_novel_depths_bf import render_novel_view, save_novel_view
+
+
+@click.command()
+@click.option('--n_gpus', default=1, help='number of GPUs')
+@click.option('--bs', default=1, help='Batch size')
+@click.option('--n_workers_per_gpu', default=3, help='number of workers per GPU')
+@click.option('--dataset', default='bf', help='bf or tum_rgbd dataset to eval on')
+@click.option('--root', default="/gpfsdswork/dataset/bundlefusion", help='path to dataset folder')
+@click.option('--model_path', default="", help='model path')
+@click.option('--recon_save_dir', default="")
+@click.option('--angle', default=30)
+@click.option('--step', default=0.2)
+@click.option('--max_distance', default=2.1, help='max pose sample distance')
+@click.option('--save_renders', default=False,
+              help='also save the depth, render_rgb and depth_visual files of generate_novel_depths_bf.py')
+@click.option('--max_queued', default=2, help='rendered poses waiting for their integration')
+@click.option('--mesh_chunk_size', default=None, type=int, help='run marching cubes on chunks of mesh_chunk_size^3 voxels, on the whole volume by default')
+@click.option('--mesh_workers', default=0, help='processes running marching cubes on the chunks of the volume, 0 runs it in this process')
+def main(root, dataset, bs, n_gpus, n_workers_per_gpu, model_path,
+         recon_save_dir, max_distance, step, angle, save_renders, max_queued, mesh_chunk_size, mesh_workers):
+    """
+    generate_novel_depths_bf.py and depth2tsdf_bf.py in a single pass: the depth and color rendered
+    at each pose are integrated in memory by a background thread while the next pose is rendered.
+    The TSDF is fused on the CPU, the GPU renders.
+    """
+    torch.set_grad_enabled(False)
+
+    data_module = BundlefusionDM(
+        dataset=dataset,
+        root=root,
+        batch_size=int(bs / n_gpus),
+        num_workers=int(n_workers_per_gpu),
+        n_sources=1,
+    )
+    data_module.setup_val_ds()
+    val_dataloader = data_module.val_dataloader(shuffle=False)
+
+    model = SceneRF.load_from_checkpoint(model_path)
+    model.cuda()
+    model.eval()
+
+    rel_poses = sample_rel_poses_bf(angle, max_distance, step)
+
+    voxel_size = 0.04
+    sx, sy, sz = 4.8, 4.8, 3.84
+    scene_size = (sx, sy, sz)
+    vox_origin = (-sx / 2, -sy / 2, 0)
+
+    for batch in tqdm(val_dataloader):
+        cam_K = batch['cam_K_depth'][0].cuda()
+        img_inputs = batch["img_inputs"].cuda()
+        inv_K = torch.inverse(cam_K)
+
+        pix_coords, out_pix_coords, _ = model.spherical_mapping.from_pixels(inv_K=inv_K)
+        x_rgbs = model.net_rgb(img_inputs, pix=pix_coords, pix_sphere=out_pix_coords)
+
+        for i in range(img_inputs.shape[0]):
+            x_rgb = {}
+            for k in x_rgbs:
+                x_rgb[k] = x_rgbs[k][i]
+
+            frame_id = batch['frame_id'][i]
+            sequence = batch['sequence'][i]
+
+            tsdf_save_dir = os.path.join(recon_save_dir, "tsdf", sequence)
+            os.makedirs(tsdf_save_dir, exist_ok=True)
+            if recon_exists(tsdf_save_dir, frame_id):
+                print("exist", tsdf_save_dir, frame_id)
+                continue
+
+            depth_save_dir = os.path.join(recon_save_dir, "depth", sequence)
+            depth_visual_save_dir = os.path.join(recon_save_dir, "depth_visual", sequence)
+            render_rgb_save_dir = os.path.join(recon_save_dir, "render_rgb", sequence)
+            if save_renders:
+                os.makedirs(depth_save_dir, exist_ok=True)
+                os.makedirs(depth_visual_save_dir, exist_ok=True)
+                os.makedirs(render_rgb_save_dir, exist_ok=True)
+
+            vol_bnds = np.zeros((3, 2))
+            vol_bnds[:, 0] = vox_origin
+            vol_bnds[:, 1] = vox_origin + np.array([scene_size[0], scene_size[1], scene_size[2]])
+            tsdf_vol = fusion.TSDFVolume(vol_bnds, voxel_size=voxel_size, trunc_margin=10, use_gpu=False)
+
+            t = time.time()
+            with fusion.IntegrationWorker(tsdf_vol, cam_K.cpu().numpy(), max_queued=max_queued) as worker:
+                for (pose_step, pose_angle), rel_pose in rel_poses.items():
+                    depth_rendered, color_rendered_np = render_novel_view(model, cam_K, rel_pose, x_rgb)
+                    depth_rendered = depth_rendered.cpu()
+
+                    callback = None
+                    if save_renders:
+                        name = "{}_{:.2f}_{:.2f}".format(frame_id, pose_step, pose_angle)
+                        callback = functools.partial(
+                            save_novel_view, depth_rendered, color_rendered_np,
+                            os.path.join(depth_save_dir, name + ".npy"),
+                            os.path.join(render_rgb_save_dir, name + ".png"),
+                            os.path.join(depth_visual_save_dir, name + ".png"))
+                    worker.put(color_rendered_np * 255, depth_rendered.squeeze().numpy(), rel_pose.numpy(),
+                               callback=callback)
+            print("rendered and integrated {} poses, {:.1f} poses per second".format(
+                worker.n_integrated, worker.n_integrated / (time.time() - t)))
+
+            verts, faces, norms, colors = tsdf_vol.get_mesh(chunk_size=mesh_chunk_size, n_workers=mesh_workers)
+            tsdf_grid, _ = tsdf_vol.get_volume()
+
+            data = {
+                "tsdf_grid": tsdf_grid,
+                "verts": verts,
+                "faces": faces,
+                "norms": norms,
+                "colors": colors,
+            }
+            save_filepath = save_recon_arrays(tsdf_save_dir, frame_id, data)
+            print("wrote to", save_filepath)
+
+
+if __name__ == "__main__":
+    main()
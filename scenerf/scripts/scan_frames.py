@@ -0,0 +1,88 @@
+import glob
+import os
+from multiprocessing import Pool
+
+import click
+from tqdm import tqdm
+
+from scenerf.data.utils.frame_stats import check_bf_frame, check_kitti_frame, save_frame_stats
+
+
+def _check_bf_frame(args):
+    return check_bf_frame(*args)
+
+
+def _check_kitti_frame(args):
+    return check_kitti_frame(*args)
+
+
+def frame_ids_of(paths, n_prefix=0):
+    return {os.path.basename(path)[n_prefix:n_prefix + 6] for path in paths}
+
+
+def run(check_fn, jobs, n_workers, out_dir):
+    records = []
+    with Pool(n_workers) as pool:
+        for record in tqdm(pool.imap_unordered(check_fn, jobs, chunksize=16), total=len(jobs)):
+            records.append(record)
+    records = save_frame_stats(out_dir, records)
+
+    errors = records[records["error"] != ""]
+    print("{} frames, {} errors".format(len(records), len(errors)))
+    for record in errors[:20]:
+        print("  {}_{}: {}".format(record["sequence"], record["frame_id"], record["error"]))
+    print("Saved the stats to {}".format(out_dir))
+
+
+@click.group()
+def main():
+    """Check that every frame can be read, write the invalid frames and per frame depth stats"""
+    pass
+
+
+@main.command()
+@click.option('--root', default="", help='path to dataset folder')
+@click.option('--out_dir', default="", help='output folder, the dataset folder by default')
+@click.option('--n_workers', default=8, help='number of processes')
+def bundlefusion(root, out_dir, n_workers):
+    """
+    Scan all the scenes of root. BundlefusionDataset skips the windows with an invalid frame
+    when root/frame_stats.npy exists.
+    """
+    jobs = []
+    for scene_dir in sorted(glob.glob(os.path.join(root, "*", "info.txt"))):
+        scene_dir = os.path.dirname(scene_dir)
+        sequence = os.path.basename(scene_dir)
+        frame_ids = set()
+        for suffix in ("color.jpg", "depth.png", "pose.txt"):
+            frame_ids |= frame_ids_of(glob.glob(os.path.join(scene_dir, "frame-*." + suffix)), len("frame-"))
+        jobs += [(scene_dir, sequence, frame_id) for frame_id in sorted(frame_ids)]
+    run(_check_bf_frame, jobs, n_workers, out_dir if out_dir != "" else root)
+
+
+@main.command()
+@click.option('--root', default="", help='path to dataset folder')
+@click.option('--preprocess_root', default="", help='path to preprocess folder, where the stats are written')
+@click.option('--sequences', default="00,01,02,03,04,05,06,07,08,09,10", help='comma separated list of sequences')
+@click.option('--n_workers', default=8, help='number of processes')
+def kitti(root, preprocess_root, sequences, n_workers):
+    """Scan the sequences. KittiDataset skips the windows with an invalid frame"""
+    # Late import, kitti_dataset imports the open3d based helpers
+    from scenerf.data.utils.helpers import read_calib, read_poses
+
+    jobs = []
+    for sequence in sequences.split(","):
+        seq_dir = os.path.join(root, "dataset", "sequences", sequence)
+        calib = read_calib(os.path.join(seq_dir, "calib.txt"))
+        T_velo_2_cam = calib["T_cam0_2_cam2"] @ calib["Tr"]
+        poses = read_poses(os.path.join(root, "dataset", "poses", sequence + ".txt"))
+        frame_ids = frame_ids_of(glob.glob(os.path.join(seq_dir, "image_2", "*.png"))) | \
+            frame_ids_of(glob.glob(os.path.join(seq_dir, "velodyne", "*.bin")))
+        for frame_id in sorted(frame_ids):
+            pose = poses[int(frame_id)] if int(frame_id) < len(poses) else None
+            jobs.append((seq_dir, sequence, frame_id, pose, calib["P2"], T_velo_2_cam))
+    run(_check_kitti_frame, jobs, n_workers, preprocess_root)
+
+
+if __name__ == "__main__":
+    main()
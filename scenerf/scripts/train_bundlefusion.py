@@ -58,6 +58,10 @@ logger = logging.getLogger(__name__)
 
 @click.option('--n_frames', default=16, help='number of frames in a sequence')
 @click.option('--frame_interval', default=2, help='interval between frames in a sequence')
+@click.option('--stack_sources', default=False, help='render the rays of all the sources in a single batch')
+@click.option('--shard_by_sequence', default=False, help='give each GPU contiguous frames of a few scenes')
+@click.option('--ray_sampling', default="uniform", help='pixels of the training rays: uniform or importance')
+@click.option('--io_threads', default=0, help='threads reading the files of a batch concurrently in each worker')
 
 def main(
         dataset, root,
@@ -74,7 +78,7 @@ def main(
         use_color, use_reprojection,
         sphere_w, sphere_h, max_epochs,
         sampling_method, net_2d,
-        n_frames, frame_interval):
+        n_frames, frame_interval, stack_sources, shard_by_sequence, io_threads, ray_sampling):
     assert root != "" and os.path.isdir(root), "$BF_ROOT is not set"
     assert logdir != "" and os.path.isdir(logdir), "$BF_LOG is not set"
     exp_name = exp_prefix
@@ -88,6 +92,8 @@ def main(
         exp_name += "NoReproj"
     if not use_color:
         exp_name += "NoColor"
+    if ray_sampling != "uniform":
+        exp_name += "_{}Rays".format(ray_sampling)
 
 
     # Setup dataloaders
@@ -98,6 +104,9 @@ def main(
         root=root,
         batch_size=int(bs / n_gpus),
         num_workers=int(n_workers_per_gpu),
+        stack_sources=stack_sources,
+        shard_by_sequence=shard_by_sequence,
+        io_threads=io_threads,
     )
 
     print(exp_name)
@@ -113,6 +122,7 @@ def main(
         weight_decay=wd,
         n_rays=n_rays,
         smooth_loss_weight=smooth_loss_weight,
+        stack_sources=stack_sources,
         sample_grid_size=sample_grid_size,
         max_sample_depth=max_sample_depth,
         sampling_method=sampling_method,
@@ -127,7 +137,8 @@ def main(
         sphere_W=sphere_w, sphere_H=sphere_h,
         eval_depth=eval_depth,
         use_color=use_color,
-        use_reprojection=use_reprojection
+        use_reprojection=use_reprojection,
+        ray_sampling=ray_sampling,
     )
 
     if enable_log:
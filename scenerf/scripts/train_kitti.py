@@ -45,6 +45,9 @@ seed_everything(42)
 @click.option('--max_epochs', default=20, help='')
 @click.option('--use_color', default=True, help='Use color loss')
 @click.option('--use_reprojection', default=True, help='Use reprojection loss')
+@click.option('--stack_sources', default=False, help='Render the rays of all the sources in a single batch')
+@click.option('--shard_by_sequence', default=False, help='Give each GPU contiguous frames of a few sequences')
+@click.option('--ray_sampling', default="uniform", help='Pixels of the training rays: uniform or importance')
 def main(
         dataset, root, preprocess_root,
         bs, n_gpus, n_workers_per_gpu,
@@ -59,7 +62,7 @@ def main(
         n_pts_per_gaussian, n_gaussians, std, som_sigma,
         add_fov_hor, add_fov_ver,
         use_color, use_reprojection,
-        sphere_w, sphere_h, max_epochs):
+        sphere_w, sphere_h, max_epochs, stack_sources, shard_by_sequence, ray_sampling):
 
     exp_name = exp_prefix
     exp_name += "_lr{}_{}rays".format(lr, n_rays)
@@ -70,6 +73,8 @@ def main(
         exp_name += "NoReproj"
     if not use_color:
         exp_name += "NoColor"
+    if ray_sampling != "uniform":
+        exp_name += "_{}Rays".format(ray_sampling)
 
 
        
@@ -81,7 +86,9 @@ def main(
         sequence_distance=sequence_distance,
         num_workers=int(n_workers_per_gpu),
         n_rays=n_rays,
-        eval_depth=eval_depth
+        eval_depth=eval_depth,
+        stack_sources=stack_sources,
+        shard_by_sequence=shard_by_sequence
     )
 
 
@@ -102,6 +109,7 @@ def main(
         eval_depth=eval_depth,
         use_color=use_color,
         use_reprojection=use_reprojection,
+        ray_sampling=ray_sampling,
     )
 
     if enable_log: